@@ -0,0 +1,85 @@
+"""
+Compare bl_numpy with python loops over bpy collections.
+
+Usage: blender --background --factory-startup --python devel/bench_bl_numpy.py
+           [-- SUBDIVISIONS]
+
+The default grid has about a million vertices.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import bpy
+
+sys.path.append(
+    str(Path(__file__).parent.parent / "src/bl_notebook/blender_notebook")
+)
+
+from bl_numpy import from_numpy, to_numpy, to_numpy_batch  # noqa: E402
+
+
+def measure(name, func, repeat=3):
+    best = min(_timeit(func) for _ in range(repeat))
+    print(f"{name:<32s} {best * 1000:10.2f} ms")
+    return best
+
+
+def _timeit(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    argv = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else []
+    subdivisions = int(argv[0]) if argv else 1000
+
+    bpy.ops.mesh.primitive_grid_add(
+        x_subdivisions=subdivisions, y_subdivisions=subdivisions
+    )
+    obj = bpy.context.active_object
+    mesh = obj.data
+    print(f"{len(mesh.vertices)} vertices, {len(mesh.polygons)} polygons")
+
+    naive = measure(
+        "vertices: python loop", lambda: [v.co[:] for v in mesh.vertices]
+    )
+    fast = measure("vertices: to_numpy", lambda: to_numpy(obj, "vertices"))
+    print(f"speedup {naive / fast:.1f}x")
+
+    co = to_numpy(obj, "vertices")
+
+    def set_naive():
+        for v, c in zip(mesh.vertices, co):
+            v.co = c
+
+    naive = measure("vertices: python loop (set)", set_naive)
+    fast = measure(
+        "vertices: from_numpy", lambda: from_numpy(obj, co, "vertices")
+    )
+    print(f"speedup {naive / fast:.1f}x")
+
+    naive = measure(
+        "loops: python loop", lambda: [x.vertex_index for x in mesh.loops]
+    )
+    fast = measure("loops: to_numpy", lambda: to_numpy(obj, "loops"))
+    print(f"speedup {naive / fast:.1f}x")
+
+    objects = []
+    for i in range(100):
+        bpy.ops.mesh.primitive_uv_sphere_add(location=(i, 0, 0))
+        objects.append(bpy.context.active_object)
+
+    naive = measure(
+        "100 spheres: python loop",
+        lambda: [v.co[:] for x in objects for v in x.data.vertices],
+    )
+    fast = measure(
+        "100 spheres: to_numpy_batch", lambda: to_numpy_batch(objects)
+    )
+    print(f"speedup {naive / fast:.1f}x")
+
+
+main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Measure startup time, peak RSS, request-to-reply latency and idle CPU of a
+blender kernel.
+
+Usage: python devel/bench_kernel_loop.py KERNEL_NAME [-n COUNT] [--idle SEC]
+                                         [--wake COUNT] [--gap SEC]
+
+The back-to-back latency never lets the kernel loop back off. The wake
+latency is the latency of a request after the kernel was idle for --gap
+seconds, which includes the backed-off timer interval.
+
+Peak RSS and idle CPU are read from /proc, so they are only reported on
+linux. They include all processes of the kernel (e.g., the launcher).
+"""
+
+import argparse
+import os
+import statistics
+import time
+from pathlib import Path
+
+from jupyter_client.manager import start_new_kernel
+
+
+def get_descendants(pid):
+    result = [pid]
+    for task in Path(f"/proc/{pid}/task").glob("*"):
+        with open(task / "children") as fh:
+            for child in fh.read().split():
+                result += get_descendants(int(child))
+    return result
+
+
+def get_cpu_time(pid):
+    """User and system CPU time of pid and its descendants in seconds"""
+    ticks = os.sysconf("SC_CLK_TCK")
+    total = 0
+    for p in get_descendants(pid):
+        with open(f"/proc/{p}/stat") as fh:
+            fields = fh.read().rsplit(")", 1)[1].split()
+        total += int(fields[11]) + int(fields[12])
+    return total / ticks
+
+
+def get_peak_rss(pid):
+    """Sum of peak RSS of pid and its descendants in bytes"""
+    total = 0
+    for p in get_descendants(pid):
+        with open(f"/proc/{p}/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    total += int(line.split()[1]) * 1024
+    return total
+
+
+def measure_latency(client, count):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        client.execute_interactive("pass", store_history=False)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def measure_wake_latency(client, count, gap):
+    latencies = []
+    for _ in range(count):
+        time.sleep(gap)
+        start = time.perf_counter()
+        client.execute_interactive("pass", store_history=False)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def format_latency(latencies):
+    ms = [x * 1000 for x in latencies]
+    return (
+        f"median {statistics.median(ms):.2f} ms,"
+        f" p95 {sorted(ms)[int(len(ms) * 0.95)]:.2f} ms,"
+        f" max {max(ms):.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("kernel_name")
+    parser.add_argument("-n", "--count", type=int, default=200)
+    parser.add_argument("--idle", type=float, default=10.0)
+    parser.add_argument("--wake", type=int, default=10)
+    parser.add_argument("--gap", type=float, default=2.0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    manager, client = start_new_kernel(
+        kernel_name=args.kernel_name, startup_timeout=120
+    )
+    print(f"startup: {time.perf_counter() - start:.2f} s")
+    try:
+        # Warm up
+        measure_latency(client, 10)
+
+        latencies = measure_latency(client, args.count)
+        print(f"latency: {format_latency(latencies)}")
+        if args.wake > 0:
+            latencies = measure_wake_latency(client, args.wake, args.gap)
+            print(f"wake latency: {format_latency(latencies)}")
+
+        pid = getattr(manager.provisioner, "pid", None)
+        if pid is not None and Path("/proc").exists():
+            print(f"peak rss: {get_peak_rss(pid) / 2**20:.1f} MiB")
+            start = get_cpu_time(pid)
+            time.sleep(args.idle)
+            cpu = get_cpu_time(pid) - start
+            print(f"idle cpu: {cpu / args.idle * 100:.2f} %")
+    finally:
+        client.stop_channels()
+        manager.shutdown_kernel(now=True)
+
+
+if __name__ == "__main__":
+    main()
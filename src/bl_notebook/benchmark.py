@@ -0,0 +1,106 @@
+"""
+Kernel startup benchmark.
+
+Each installed blender kernel (one for each version and launch profile) is
+started and waited for until it replies to kernel_info. The cold start drops
+the recorded startup files of blender (see prewarm.py) from the page cache
+first, so run `bl --warm` once to record them.
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from jupyter_client.blocking import BlockingKernelClient
+from jupyter_client.connect import write_connection_file
+from jupyter_client.launcher import launch_kernel
+
+from .blender.prewarm import evict_files, find_startup_files
+from .util import print_error
+
+BENCH_TIMEOUT = 120.0
+BENCH_COUNT = 3
+
+
+def start_kernel(kernel_dir, timeout=BENCH_TIMEOUT) -> float:
+    """Start the kernel and shut it down, return the startup time"""
+    with open(Path(kernel_dir) / "kernel.json") as fh:
+        spec = json.load(fh)
+
+    with tempfile.TemporaryDirectory() as tempdirname:
+        connection_file = Path(tempdirname) / "kernel-bench.json"
+        _, connection_info = write_connection_file(
+            str(connection_file),
+            ip="127.0.0.1",
+            key=uuid.uuid4().hex.encode("ascii"),
+        )
+        cmd = [
+            x.replace("{connection_file}", str(connection_file))
+            for x in spec["argv"]
+        ]
+        env = os.environ.copy()
+        env.update(spec.get("env", {}))
+
+        start = time.perf_counter()
+        process = launch_kernel(
+            cmd,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        client = BlockingKernelClient()
+        client.load_connection_info(connection_info)
+        client.start_channels()
+        try:
+            client.wait_for_ready(timeout=timeout)
+            elapsed = time.perf_counter() - start
+            client.shutdown()
+        finally:
+            client.stop_channels()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    return elapsed
+
+
+def bench_startup(kernel_dirs, cache_dir, count=BENCH_COUNT, verbose=False):
+    """Print cold and warm startup time of the kernels"""
+    rows = []
+    for kernel_dir in kernel_dirs:
+        kernel_dir = Path(kernel_dir)
+        with open(kernel_dir / "blender_config.json") as fh:
+            blender_config = json.load(fh)
+        files = find_startup_files(
+            cache_dir, blender_config["blender_executable"]
+        )
+        if files is None or not evict_files(files):
+            print_error(
+                f"{kernel_dir.name}: startup files are not recorded,"
+                " the cold start is the first start"
+            )
+
+        try:
+            cold = start_kernel(kernel_dir)
+            warm = [start_kernel(kernel_dir) for _ in range(count)]
+        except (OSError, RuntimeError) as exc:
+            print_error(f"{kernel_dir.name}: {exc}")
+            continue
+        if verbose:
+            times = ", ".join(f"{x:.2f}" for x in warm)
+            print_error(f"{kernel_dir.name}: cold {cold:.2f}, warm {times}")
+        rows.append((kernel_dir.name, cold, statistics.median(warm)))
+
+    if not rows:
+        return
+    width = max(len(name) for name, _, _ in rows)
+    print(f"{'kernel':<{width}}  {'cold':>8}  {'warm':>8}")
+    for name, cold, warm in rows:
+        print(f"{name:<{width}}  {cold:7.2f}s  {warm:7.2f}s")
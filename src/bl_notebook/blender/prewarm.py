@@ -0,0 +1,251 @@
+"""
+Page cache prewarming for blender startup.
+
+The files blender reads while starting (the binary, shared libraries, the
+python stdlib and datafiles) are recorded once per blender installation.
+Later launches issue readahead on exactly that set in parallel.
+"""
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from bl_notebook.util import normalize_path, print_error, run_command
+
+PREWARM_JOBS = 16
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Executed in blender to record mapped files and imported modules.
+RECORD_SCRIPT = """
+import json, os, sys
+files = set()
+try:
+    with open("/proc/self/maps") as fh:
+        for line in fh:
+            parts = line.split(None, 5)
+            if len(parts) == 6 and parts[5].startswith("/"):
+                files.add(parts[5].strip())
+except OSError:
+    files.add(sys.argv[0])
+for module in list(sys.modules.values()):
+    path = getattr(module, "__file__", None)
+    if path:
+        files.add(path)
+        cached = getattr(module, "__cached__", None)
+        if cached:
+            files.add(cached)
+with open(os.environ["BL_NOTEBOOK_PREWARM_OUTPUT"], "w") as fh:
+    json.dump(sorted(files), fh)
+"""
+
+STRACE_OPEN_RE = re.compile(
+    r'^(?:\d+\s+)?(?:open|openat)\((?:[^,"]+,\s*)?"((?:[^"\\]|\\.)*)"'
+    r".*\)\s*=\s*\d+",
+)
+
+
+def get_profile_path(cache_dir, blender) -> Path:
+    return (
+        Path(normalize_path(cache_dir)) / "prewarm" / (blender.name + ".json")
+    )
+
+
+def _parse_strace_log(path) -> List[str]:
+    files = []
+    with open(path, errors="replace") as fh:
+        for line in fh:
+            m = STRACE_OPEN_RE.match(line)
+            if m:
+                files.append(m.group(1))
+    return files
+
+
+def _record_command(blender):
+    return [
+        str(blender.executable),
+        "--background",
+        "--factory-startup",
+        "--python-expr",
+        RECORD_SCRIPT,
+    ]
+
+
+def record_startup_files(
+    blender, cache_dir, verbose=False, dry_run=False
+) -> Optional[List[str]]:
+    """Record files opened while blender starts up"""
+    profile_path = get_profile_path(cache_dir, blender)
+
+    with tempfile.TemporaryDirectory() as tempdirname:
+        output = Path(tempdirname) / "files.json"
+        env = os.environ.copy()
+        env["BL_NOTEBOOK_PREWARM_OUTPUT"] = str(output)
+        cmd = _record_command(blender)
+        strace = shutil.which("strace")
+        if strace:
+            log = Path(tempdirname) / "strace.log"
+            cmd = [
+                strace,
+                "-f",
+                "-qq",
+                "-e",
+                "trace=open,openat",
+                "-o",
+                str(log),
+            ] + cmd
+
+        code = run_command(
+            cmd,
+            verbose=verbose,
+            dry_run=dry_run,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env=env,
+        )
+        if code != 0:
+            return None
+
+        files = set()
+        if strace:
+            files.update(_parse_strace_log(log))
+        with suppress(FileNotFoundError), open(output) as fh:
+            files.update(json.load(fh))
+
+    files.add(str(blender.executable))
+    files = sorted(x for x in files if os.path.isfile(x))
+
+    profile_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(profile_path, "w") as fh:
+        json.dump(
+            {"executable": str(blender.executable), "files": files},
+            fh,
+            indent=2,
+        )
+    if verbose:
+        print_error(f"Recorded {len(files)} startup files in {profile_path}")
+
+    return files
+
+
+def load_startup_files(cache_dir, blender) -> Optional[List[str]]:
+    profile_path = get_profile_path(cache_dir, blender)
+    try:
+        with open(profile_path) as fh:
+            profile = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if profile.get("executable") != str(blender.executable):
+        return None
+    return profile["files"]
+
+
+def find_startup_files(cache_dir, executable) -> Optional[List[str]]:
+    """Find the recorded startup files by the blender executable"""
+    for profile_path in sorted(
+        (Path(normalize_path(cache_dir)) / "prewarm").glob("*.json")
+    ):
+        try:
+            with open(profile_path) as fh:
+                profile = json.load(fh)
+        except (OSError, ValueError):
+            continue
+        if profile.get("executable") == str(executable):
+            return profile["files"]
+    return None
+
+
+def evict_files(files) -> bool:
+    """Drop files from the page cache where possible
+
+    Returns False if the platform does not support it.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    for path in files:
+        with suppress(OSError):
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+    return True
+
+
+def _prewarm_file(path) -> int:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return 0
+    try:
+        size = os.fstat(fd).st_size
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        else:
+            # Populate the page cache by reading the file
+            while os.read(fd, READ_CHUNK_SIZE):
+                pass
+        return size
+    except OSError:
+        return 0
+    finally:
+        os.close(fd)
+
+
+def prewarm_files(files, jobs=PREWARM_JOBS) -> Tuple[int, int]:
+    """Issue readahead on files in parallel
+
+    Returns the number of files and bytes.
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        sizes = [x for x in executor.map(_prewarm_file, files) if x > 0]
+    return len(sizes), sum(sizes)
+
+
+def prewarm(
+    blender,
+    cache_dir,
+    record=True,
+    background=False,
+    verbose=False,
+    dry_run=False,
+) -> Optional[threading.Thread]:
+    """Prewarm the page cache for blender startup
+
+    The startup files are recorded first if record is true and they have
+    not been recorded yet. If background is true, readahead runs in a
+    daemon thread alongside the launch of blender.
+    """
+    files = load_startup_files(cache_dir, blender)
+    if files is None:
+        if not record:
+            return None
+        files = record_startup_files(
+            blender, cache_dir, verbose=verbose, dry_run=dry_run
+        )
+        if files is None:
+            return None
+
+    def run():
+        count, size = prewarm_files(files)
+        if verbose:
+            print_error(f"Prewarmed {count} files ({size / 2**20:.1f} MiB)")
+
+    if dry_run:
+        print_error(f"Prewarm {len(files)} files", dry_run=dry_run)
+        return None
+
+    if not background:
+        run()
+        return None
+
+    thread = threading.Thread(target=run, name="prewarm", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,301 @@
+"""
+Re-pack cached blender archives into a seekable zstd tar.
+
+The official linux archives are xz compressed and xz decompression dominates
+the extraction time. A re-packed archive is the same tar stream split into
+independent zstd frames (a concatenation of frames is still a valid zstd
+stream, so "tar -I zstd" can extract it), plus a JSON index of the frames and
+tar members for random access.
+"""
+
+import hashlib
+import json
+import lzma
+import os
+import re
+import shutil
+import subprocess
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from pathlib import Path
+from typing import List, Optional
+
+from bl_notebook.util import is_win32, print_error, run_command
+
+INDEX_FORMAT = 1
+REPACK_CHUNK_SIZE = 32 * 1024 * 1024
+REPACK_SUFFIX = ".tar.zst"
+INDEX_SUFFIX = ".idx.json"
+ZSTD_LEVEL = 3
+
+
+def get_repacked_path(archive_path) -> Path:
+    archive_path = Path(archive_path)
+    name = re.sub(r"\.tar\.xz$", "", archive_path.name, 1, re.I)
+    return archive_path.with_name(name + REPACK_SUFFIX)
+
+
+def get_index_path(repacked_path) -> Path:
+    repacked_path = Path(repacked_path)
+    return repacked_path.with_name(repacked_path.name + INDEX_SUFFIX)
+
+
+def is_repack_supported():
+    return not is_win32() and shutil.which("zstd") is not None
+
+
+def _compress_frame(data, level=ZSTD_LEVEL):
+    proc = subprocess.run(
+        ["zstd", "-q", "-c", f"-{level}", "-"],
+        input=data,
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return proc.stdout
+
+
+def _decompress_frame(data):
+    proc = subprocess.run(
+        ["zstd", "-q", "-d", "-c", "-"],
+        input=data,
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return proc.stdout
+
+
+class _ChunkingReader:
+    """File-like reader that hands fixed sized chunks to a callback
+
+    tarfile reads the decompressed stream through this object, so the tar
+    members are indexed in the same pass that produces the frames.
+    """
+
+    def __init__(self, fileobj, chunk_size, on_chunk):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.on_chunk = on_chunk
+        self.buffer = bytearray()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.buffer += data
+        while len(self.buffer) >= self.chunk_size:
+            self.on_chunk(bytes(self.buffer[: self.chunk_size]))
+            del self.buffer[: self.chunk_size]
+        return data
+
+    def flush(self):
+        while self.read(self.chunk_size):
+            pass
+        if self.buffer:
+            self.on_chunk(bytes(self.buffer))
+            self.buffer.clear()
+
+
+def _sha256_file(path, bufsize=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for data in iter(lambda: fh.read(bufsize), b""):
+            h.update(data)
+    return h.hexdigest()
+
+
+def repack_archive(
+    archive_path,
+    chunk_size=REPACK_CHUNK_SIZE,
+    jobs=None,
+    force=False,
+    verbose=False,
+) -> Optional[Path]:
+    """Convert a .tar.xz archive into a seekable .tar.zst archive
+
+    Returns the path of the re-packed archive, or None if the archive can
+    not be re-packed.
+    """
+    archive_path = Path(archive_path)
+    if not re.search(r"\.tar\.xz$", archive_path.name, re.I):
+        return None
+
+    repacked_path = get_repacked_path(archive_path)
+    index_path = get_index_path(repacked_path)
+    if not force and load_index(archive_path) is not None:
+        return repacked_path
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    if verbose:
+        print_error(f"Re-packing {archive_path} into {repacked_path}")
+
+    frames = []
+    members = []
+    pending = []
+    offsets = {"uncompressed": 0, "compressed": 0}
+    tmp_path = repacked_path.with_name(repacked_path.name + ".part")
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor, open(
+        tmp_path, "wb"
+    ) as output:
+
+        def write_frame(future, size):
+            data = future.result()
+            output.write(data)
+            frames.append(
+                [
+                    offsets["uncompressed"],
+                    offsets["compressed"],
+                    size,
+                    len(data),
+                ]
+            )
+            offsets["uncompressed"] += size
+            offsets["compressed"] += len(data)
+
+        def on_chunk(chunk):
+            future = executor.submit(_compress_frame, chunk)
+            pending.append((future, len(chunk)))
+            # Bound the memory used by the chunks in flight
+            while len(pending) > jobs * 2:
+                write_frame(*pending.pop(0))
+
+        try:
+            with lzma.open(archive_path, "rb") as source:
+                reader = _ChunkingReader(source, chunk_size, on_chunk)
+                with tarfile.open(fileobj=reader, mode="r|") as tar:
+                    for info in tar:
+                        members.append(
+                            [info.name, info.offset_data, info.size]
+                        )
+                reader.flush()
+            while pending:
+                write_frame(*pending.pop(0))
+        except BaseException:
+            for future, _ in pending:
+                future.cancel()
+            output.close()
+            with suppress(FileNotFoundError):
+                tmp_path.unlink()
+            raise
+
+    stat = archive_path.stat()
+    index = {
+        "format": INDEX_FORMAT,
+        "source": archive_path.name,
+        "source_size": stat.st_size,
+        "source_mtime": stat.st_mtime,
+        "source_sha256": _sha256_file(archive_path),
+        "chunk_size": chunk_size,
+        "frames": frames,
+        "members": members,
+    }
+    os.replace(tmp_path, repacked_path)
+    with open(index_path, "w") as fh:
+        json.dump(index, fh)
+
+    return repacked_path
+
+
+def load_index(archive_path) -> Optional[dict]:
+    """Load the index of the re-packed archive of archive_path
+
+    Returns None if the re-packed archive does not exist or is stale.
+    """
+    archive_path = Path(archive_path)
+    repacked_path = get_repacked_path(archive_path)
+    index_path = get_index_path(repacked_path)
+    try:
+        with open(index_path) as fh:
+            index = json.load(fh)
+        size = repacked_path.stat().st_size
+    except (OSError, ValueError):
+        return None
+
+    if index.get("format") != INDEX_FORMAT:
+        return None
+    if sum(x[3] for x in index["frames"]) != size:
+        return None
+    with suppress(FileNotFoundError):
+        # The original archive is kept only for verification.
+        stat = archive_path.stat()
+        if (
+            stat.st_size != index["source_size"]
+            or stat.st_mtime != index["source_mtime"]
+        ):
+            return None
+    return index
+
+
+def verify_source(archive_path, index) -> bool:
+    """Check the original archive against the checksum in the index"""
+    return _sha256_file(archive_path) == index["source_sha256"]
+
+
+def read_member(archive_path, name, index=None) -> bytes:
+    """Read a single member from the re-packed archive of archive_path
+
+    Only the frames covering the member are decompressed.
+    """
+    if index is None:
+        index = load_index(archive_path)
+        if index is None:
+            raise FileNotFoundError(f"No re-packed archive for {archive_path}")
+
+    try:
+        _, offset, size = next(x for x in index["members"] if x[0] == name)
+    except StopIteration:
+        raise KeyError(f"{name!r} not found in {archive_path}")
+
+    end = offset + size
+    frames = [
+        x for x in index["frames"] if x[0] < end and x[0] + x[2] > offset
+    ]
+    if not frames:
+        return b""
+
+    data = bytearray()
+    with open(get_repacked_path(archive_path), "rb") as fh:
+        for _, coffset, _, csize in frames:
+            fh.seek(coffset)
+            data += _decompress_frame(fh.read(csize))
+    start = offset - frames[0][0]
+    return bytes(data[start : start + size])
+
+
+def extract_repacked(archive_path, directory, verbose=False, dry_run=False):
+    """Extract the re-packed archive of archive_path into directory"""
+    # tar -I zstd -xf FILENAME -C DIRECTORY --strip-components=1
+    args = [
+        "tar",
+        "-I",
+        "zstd",
+        "-xf",
+        str(get_repacked_path(archive_path)),
+        "-C",
+        str(directory),
+        "--strip-components=1",
+    ]
+    return run_command(args, verbose=verbose, dry_run=dry_run)
+
+
+def repack_cached_archives(
+    download_dir, jobs=None, force=False, verbose=False, dry_run=False
+) -> List[Path]:
+    """Re-pack all .tar.xz archives in download_dir"""
+    result = []
+    if not is_repack_supported():
+        print_error("Re-packing archives requires zstd (not on windows)")
+        return result
+
+    for archive_path in sorted(Path(download_dir).glob("*.tar.xz")):
+        if dry_run:
+            print_error(f"Re-pack {archive_path}", dry_run=dry_run)
+            continue
+        repacked_path = repack_archive(
+            archive_path, jobs=jobs, force=force, verbose=verbose
+        )
+        if repacked_path is not None:
+            result.append(repacked_path)
+
+    return result
@@ -2,6 +2,8 @@ import os
 import re
 import shutil
 import time
+import urllib.parse
+import urllib.request
 import zipfile
 from contextlib import suppress
 from functools import total_ordering
@@ -16,8 +18,16 @@ from bl_notebook.blender.app import BlenderApp
 from bl_notebook.blender.arch import Architecture
 from bl_notebook.blender.filename import BlenderFileName
 from bl_notebook.blender.ostype import OSType
+from bl_notebook.blender.repack import (
+    extract_repacked,
+    get_repacked_path,
+    is_repack_supported,
+    load_index,
+    verify_source,
+)
 from bl_notebook.blender.version import Version
 from bl_notebook.util import (
+    copy_file,
     is_win32,
     make_executable_filename,
     normalize_path,
@@ -26,7 +36,45 @@ from bl_notebook.util import (
 )
 
 
+def is_local_url(url):
+    return urllib.parse.urlparse(url).scheme == "file"
+
+
+def normalize_mirror_url(url):
+    """Convert a local directory into a file:// URL"""
+    if url and not re.match(r"^[a-z][a-z0-9+.-]+://", url, re.I):
+        url = Path(normalize_path(url)).resolve().as_uri()
+    if url and is_local_url(url) and not url.endswith("/"):
+        url += "/"
+    return url
+
+
+def url_to_path(url) -> Path:
+    return Path(urllib.request.url2pathname(urllib.parse.urlparse(url).path))
+
+
+def get_index_html(url):
+    """Get the HTML index of url
+
+    For file:// URLs, the index is made from the directory listing.
+    """
+    if not is_local_url(url):
+        r = requests.get(url, allow_redirects=False)
+        return r.text
+
+    lines = []
+    for entry in sorted(url_to_path(url).iterdir()):
+        name = entry.name + ("/" if entry.is_dir() else "")
+        href = urllib.parse.quote(name)
+        lines.append(f'<a href="{href}">{name}</a>')
+    return "\n".join(lines)
+
+
 def download_file(url, filename):
+    if is_local_url(url):
+        copy_file(url_to_path(url), filename)
+        return
+
     # make an HTTP request within a context manager
     delete = True
     try:
@@ -57,6 +105,7 @@ class BlenderRemoteFile:
     arch: Architecture
     ostype: OSType
     sort_key: List[float]
+    copy: bool = attr.ib(default=True)
 
     def __attrs_post_init__(self):
         self.apps_root = normalize_path(self.apps_root)
@@ -73,6 +122,17 @@ class BlenderRemoteFile:
         directory = Path(self.download_dir)
         return directory / self.name
 
+    @property
+    def source_path(self):
+        """The archive to extract
+
+        An archive on a local mirror is extracted in place unless copy is
+        true.
+        """
+        if not self.copy and is_local_url(self.href):
+            return url_to_path(self.href)
+        return self.archive_path
+
     @property
     def blender_directory(self):
         s, n = re.subn(r"\.zip$", "", str(self.archive_path), 1, re.I)
@@ -92,9 +152,38 @@ class BlenderRemoteFile:
             self.blender_directory / "blender", self.ostype
         )
 
+    @property
+    def is_repacked(self):
+        return (
+            is_repack_supported() and load_index(self.archive_path) is not None
+        )
+
+    def verify_repacked(self):
+        """Check if the re-packed archive can be extracted instead
+
+        The original archive, if it is still kept, must match the checksum
+        recorded when it was re-packed.
+        """
+        if not is_repack_supported():
+            return False
+        index = load_index(self.archive_path)
+        if index is None:
+            return False
+        if self.archive_path.exists() and not verify_source(
+            self.archive_path, index
+        ):
+            print_error(
+                f"warning: {self.archive_path} does not match"
+                f" {get_repacked_path(self.archive_path)}, extracting it"
+            )
+            return False
+        return True
+
     def download(self, force=False):
         archive_path = self.archive_path
-        if force or not archive_path.exists():
+        if self.source_path != archive_path:
+            return
+        if force or not (archive_path.exists() or self.is_repacked):
             print_error(f"Downloading {self.href}...")
             archive_path.parent.mkdir(parents=True, exist_ok=True)
             download_file(self.href, archive_path)
@@ -153,32 +242,47 @@ class BlenderRemoteFile:
         else:
             if directory.exists():
                 return directory
-        if re.search(r"\.zip$", str(self.archive_path), re.I):
-            with zipfile.ZipFile(self.archive_path, "r") as archive:
+        source_path = self.source_path
+        if re.search(r"\.zip$", str(source_path), re.I):
+            with zipfile.ZipFile(source_path, "r") as archive:
                 try:
                     members = self._get_zipfile_members_without_root(archive)
                 except ValueError as exc:
                     print_error(f"warning: {exc}")
                     members = None
                 if verbose:
-                    print_error(
-                        f"Extracting {self.archive_path} into {directory}"
-                    )
+                    print_error(f"Extracting {source_path} into {directory}")
                 archive.extractall(path=directory, members=members)
                 return directory
-        if re.search(r"\.tar.xz$", str(self.archive_path), re.I):
+        if re.search(r"\.tar.xz$", str(source_path), re.I):
             # tar xaf FILENAME -C DIRECTORY --strip-components=1
             directory.mkdir(parents=True, exist_ok=True)
             if verbose:
-                print_error(f"Extracting {self.archive_path} into {directory}")
+                print_error(f"Extracting {source_path} into {directory}")
             try:
+                if self.verify_repacked():
+                    code = extract_repacked(
+                        self.archive_path,
+                        directory,
+                        verbose=verbose,
+                        dry_run=dry_run,
+                    )
+                    if code:
+                        # Do not leave a partial installation
+                        shutil.rmtree(directory, ignore_errors=True)
+                        raise OSError(
+                            "Can not extract"
+                            f" {get_repacked_path(self.archive_path)}"
+                            f" (exited by {code})"
+                        )
+                    return directory
                 if is_win32():
                     args = [
                         "wsl",
                         "--exec",
                         "bash",
                         "-c",
-                        f'tar -xaf $(wslpath "{str(self.archive_path)}")'
+                        f'tar -xaf $(wslpath "{str(source_path)}")'
                         f' -C $(wslpath "{str(directory)}")'
                         " --strip-components=1",
                     ]
@@ -186,7 +290,7 @@ class BlenderRemoteFile:
                     args = [
                         "tar",
                         "-xaf",
-                        str(self.archive_path),
+                        str(source_path),
                         "-C",
                         str(directory),
                         "--strip-components=1",
@@ -198,7 +302,7 @@ class BlenderRemoteFile:
                     directory.rmdir()
         else:
             raise NotImplementedError(
-                f"Not implemented to extract file for {self.archive_path}"
+                f"Not implemented to extract file for {source_path}"
             )
 
 
@@ -209,6 +313,7 @@ class BlenderRemoteVersionFolder:
     apps_root: Path
     download_dir: Path = attr.ib()
     version: str = attr.ib(init=False, converter=Version)
+    copy: bool = attr.ib(default=True)
 
     def __attrs_post_init__(self):
         version, n = re.subn(r"^blender(\d.*)", r"\1", self.name, 1, re.I)
@@ -242,7 +347,7 @@ class BlenderRemoteVersionFolder:
         if version is not None:
             version = Version(version)
 
-        r = requests.get(self.version_url, allow_redirects=False)
+        html = get_index_html(self.version_url)
 
         pattern = re.compile(
             r'<a\s+href\s*=\s*"(blender[-_ ]?([^\"]+))"[^>]*>\s*([^<\s]+)',
@@ -251,7 +356,7 @@ class BlenderRemoteVersionFolder:
 
         result = []
 
-        for line in r.text.split("\n"):
+        for line in html.split("\n"):
             m = pattern.search(line)
             if m:
                 href = m.group(1)
@@ -295,6 +400,7 @@ class BlenderRemoteVersionFolder:
                                 arch_sortkey,
                                 v.elements,
                             ],
+                            copy=self.copy,
                         )
                     )
 
@@ -312,14 +418,17 @@ class BlenderRemoteRepository:
     URL_BASE = "https://download.blender.org/release/"
     CACHE_EXPIRE = 3600 * 24
 
-    def __init__(self, url, apps_root, cache_dir, ext_re, cache_expire=None):
+    def __init__(
+        self, url, apps_root, cache_dir, ext_re, cache_expire=None, copy=True
+    ):
         """
         Create blender remote repository class instance
 
         Parameters
         ----------
         url : str
-            公式またはミラーダウンロード URL
+            公式またはミラーダウンロード URL (ローカルディレクトリまたは
+            file:// URL も可)
         apps_root : str
             ダウンロードおよびインストール先のディレクトリ
         cache_dir : str
@@ -328,11 +437,14 @@ class BlenderRemoteRepository:
             zip 拡張子の正規表現
         cache_expire : Optional[float]
             HTML キャッシュ有効期限
+        copy : bool
+            False の場合ローカルミラーのアーカイブをコピーせずに直接展開する
         """
         if cache_expire is None:
             cache_expire = self.CACHE_EXPIRE
 
-        self.url_base = url or self.URL_BASE
+        self.url_base = normalize_mirror_url(url or self.URL_BASE)
+        self.copy = copy
         self._versions = None
         self.ext_re = ext_re
         self.apps_root = Path(normalize_path(apps_root))
@@ -354,14 +466,16 @@ class BlenderRemoteRepository:
         if cache_filename.exists():
             cache_expire = cache_filename.stat().st_mtime + self.CACHE_EXPIRE
 
-        if cache and time.time() < cache_expire:
+        if is_local_url(self.url_base):
+            # Listing a local directory is cheap, do not cache it
+            html = get_index_html(self.url_base)
+        elif cache and time.time() < cache_expire:
             with open(cache_filename, "r") as fh:
                 html = fh.read()
         else:
-            r = requests.get(self.url_base, allow_redirects=False)
-            html = r.text
+            html = get_index_html(self.url_base)
             with open(cache_filename, "w") as fh:
-                fh.write(r.text)
+                fh.write(html)
 
         arr = []
 
@@ -377,7 +491,7 @@ class BlenderRemoteRepository:
                 url = self.url_base + m.group(1)
                 arr.append(
                     BlenderRemoteVersionFolder(
-                        url, name, apps_root=self.apps_root
+                        url, name, apps_root=self.apps_root, copy=self.copy
                     )
                 )
 
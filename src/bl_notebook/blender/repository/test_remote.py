@@ -0,0 +1,123 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+from bl_notebook.blender.arch import Architecture
+from bl_notebook.blender.ostype import OSType
+from bl_notebook.blender.repack import (
+    get_repacked_path,
+    is_repack_supported,
+    repack_archive,
+)
+
+from .remote import BlenderRemoteFile, BlenderRemoteRepository, url_to_path
+
+
+def make_mirror(root):
+    folder = root / "Blender3.5"
+    folder.mkdir(parents=True)
+    for name in (
+        "blender-3.5.0-linux-x64.tar.xz",
+        "blender-3.5.1-linux-x64.tar.xz",
+        "blender-3.5.1-windows-x64.zip",
+    ):
+        (folder / name).write_bytes(name.encode("utf-8"))
+    (root / "Blender3.4").mkdir()
+    return root
+
+
+def find_file(repository):
+    folder = repository.find_version("3.5")
+    assert folder is not None
+    return folder.find(
+        "3.5", [Architecture.X64], [OSType.LINUX], OSType.LINUX.ext_re
+    )
+
+
+def test_local_mirror(tmp_path):
+    mirror = make_mirror(tmp_path / "mirror")
+    repository = BlenderRemoteRepository(
+        url=str(mirror),
+        apps_root=tmp_path / "apps",
+        cache_dir=tmp_path / "cache",
+        ext_re=OSType.LINUX.ext_re,
+    )
+    assert repository.url_base == mirror.as_uri() + "/"
+    assert [str(x.version) for x in repository.versions] == ["3.5", "3.4"]
+
+    remote_file = find_file(repository)
+    assert remote_file.name == "blender-3.5.1-linux-x64.tar.xz"
+    assert url_to_path(remote_file.href) == (
+        mirror / "Blender3.5" / remote_file.name
+    )
+
+    remote_file.download()
+    assert remote_file.archive_path.read_bytes() == remote_file.name.encode()
+    assert remote_file.source_path == remote_file.archive_path
+
+
+def test_local_mirror_no_copy(tmp_path):
+    mirror = make_mirror(tmp_path / "mirror")
+    repository = BlenderRemoteRepository(
+        url=mirror.as_uri(),
+        apps_root=tmp_path / "apps",
+        cache_dir=tmp_path / "cache",
+        ext_re=OSType.LINUX.ext_re,
+        copy=False,
+    )
+
+    remote_file = find_file(repository)
+    remote_file.download()
+    assert not remote_file.archive_path.exists()
+    assert remote_file.source_path == mirror / "Blender3.5" / remote_file.name
+    assert remote_file.blender_directory == (
+        tmp_path / "apps" / "blender-3.5.1-linux-x64"
+    )
+
+
+def make_archive(path, data):
+    with tarfile.open(path, "w:xz") as tar:
+        info = tarfile.TarInfo("blender-3.5.1-linux-x64/blender")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+
+@pytest.mark.skipif(not is_repack_supported(), reason="zstd is not available")
+def test_install_repacked(tmp_path):
+    remote_file = BlenderRemoteFile(
+        href="https://example.com/blender-3.5.1-linux-x64.tar.xz",
+        name="blender-3.5.1-linux-x64.tar.xz",
+        version="3.5.1",
+        apps_root=tmp_path / "apps",
+        download_dir=tmp_path / "apps",
+        arch=Architecture.X64,
+        ostype=OSType.LINUX,
+        sort_key=[3.5, 1],
+    )
+    archive_path = remote_file.archive_path
+    archive_path.parent.mkdir()
+    make_archive(archive_path, b"repacked")
+    repack_archive(archive_path)
+    assert remote_file.is_repacked
+    executable = remote_file.blender_directory / "blender"
+    remote_file.install()
+    assert executable.read_bytes() == b"repacked"
+
+    # The original archive changed since it was re-packed
+    stat = archive_path.stat()
+    make_archive(archive_path, b"original")
+    os.utime(archive_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert archive_path.stat().st_size == stat.st_size
+    assert not remote_file.verify_repacked()
+    remote_file.install(force=True)
+    assert executable.read_bytes() == b"original"
+
+    # A failed extraction raises and leaves no directory
+    archive_path.unlink()
+    repacked_path = get_repacked_path(archive_path)
+    repacked_path.write_bytes(b"\0" * repacked_path.stat().st_size)
+    with pytest.raises(OSError):
+        remote_file.install(force=True)
+    assert not remote_file.blender_directory.exists()
@@ -0,0 +1,59 @@
+import io
+import subprocess
+import tarfile
+
+import pytest
+
+from .repack import (
+    get_repacked_path,
+    is_repack_supported,
+    load_index,
+    read_member,
+    repack_archive,
+)
+
+pytestmark = pytest.mark.skipif(
+    not is_repack_supported(), reason="zstd is not available"
+)
+
+
+def make_archive(path, files):
+    with tarfile.open(path, "w:xz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def test_repack(tmp_path):
+    files = {
+        "blender-3.5.1-linux-x64/blender": b"x" * 5000,
+        "blender-3.5.1-linux-x64/3.5/a.txt": bytes(range(256)) * 40,
+    }
+    archive_path = tmp_path / "blender-3.5.1-linux-x64.tar.xz"
+    make_archive(archive_path, files)
+
+    repacked_path = repack_archive(archive_path, chunk_size=1024, jobs=2)
+    assert repacked_path == get_repacked_path(archive_path)
+    assert repacked_path.name == "blender-3.5.1-linux-x64.tar.zst"
+
+    index = load_index(archive_path)
+    assert index is not None
+    assert len(index["frames"]) > 1
+    for name, data in files.items():
+        assert read_member(archive_path, name, index) == data
+
+    # Concatenated frames must be a valid zstd stream
+    output = subprocess.check_output(["zstd", "-q", "-d", "-c", repacked_path])
+    with tarfile.open(fileobj=io.BytesIO(output)) as tar:
+        assert sorted(tar.getnames()) == sorted(files)
+
+
+def test_repack_stale(tmp_path):
+    archive_path = tmp_path / "blender-3.5.1-linux-x64.tar.xz"
+    make_archive(archive_path, {"blender-3.5.1-linux-x64/blender": b"x"})
+    repack_archive(archive_path)
+    assert load_index(archive_path) is not None
+
+    make_archive(archive_path, {"blender-3.5.1-linux-x64/blender": b"xy"})
+    assert load_index(archive_path) is None
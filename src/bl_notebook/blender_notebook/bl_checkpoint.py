@@ -0,0 +1,219 @@
+"""
+Checkpoints of the blender kernel.
+
+%bl_checkpoint saves the current scene as an uncompressed .blend file (fast
+to write and to load) and the picklable variables of the namespace.
+%bl_restore in a fresh kernel opens the .blend file and restores the
+variables, instead of re-running the setup cells:
+
+    %bl_checkpoint scene-ready
+    ...  # the kernel crashed or was culled
+    %bl_restore scene-ready
+
+With restore_checkpoint in the kernelspec, a new kernel of a notebook starts
+blender with the .blend file of the notebook's checkpoint (see
+kernel_launcher.py) and restores its variables.
+
+Variables referring to bpy data can not be pickled and are skipped; look
+them up again after restoring. Out of background mode the .blend file opens
+after the cell, and the variables are restored when it has loaded.
+"""
+
+import json
+import os
+import pickle
+import re
+import tempfile
+import time
+import types
+from pathlib import Path
+
+import bpy
+
+CHECKPOINT_DIR_NAME = "bl_notebook-checkpoints"
+NAME_RE = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+SKIPPED_TYPES = (
+    types.ModuleType,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+    type,
+)
+
+
+def get_default_name():
+    """Name of the checkpoint of the current notebook"""
+    session = os.environ.get("JPY_SESSION_NAME")
+    if session:
+        name = re.sub(r"[^A-Za-z0-9_.-]", "-", Path(session).stem)
+        if name:
+            return name
+    return "default"
+
+
+class Checkpoints:
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = Path(tempfile.gettempdir()) / CHECKPOINT_DIR_NAME
+        self.directory = Path(directory)
+
+    def _paths(self, name):
+        if not NAME_RE.match(name):
+            raise ValueError(f"Invalid checkpoint name: {name!r}")
+        return (
+            self.directory / f"{name}.blend",
+            self.directory / f"{name}.pickle",
+            self.directory / f"{name}.json",
+        )
+
+    def list(self):  # noqa: A003
+        result = {}
+        for path in sorted(self.directory.glob("*.json")):
+            try:
+                result[path.stem] = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+        return result
+
+    def save(self, name, namespace, hidden=()):
+        """Save the scene and the picklable variables, return the info"""
+        blend_path, pickle_path, info_path = self._paths(name)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        start = time.perf_counter()
+
+        variables = {}
+        skipped = []
+        for key, value in namespace.items():
+            if key.startswith("_") or key in hidden:
+                continue
+            if isinstance(value, SKIPPED_TYPES):
+                continue
+            try:
+                pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                skipped.append(key)
+            else:
+                variables[key] = value
+        # In one pickle, so that variables sharing objects still share them
+        temp_path = pickle_path.with_name(f".{pickle_path.name}")
+        with temp_path.open("wb") as fh:
+            pickle.dump(variables, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, pickle_path)
+
+        # copy=True keeps the path of the current file
+        bpy.ops.wm.save_as_mainfile(
+            filepath=str(blend_path), compress=False, copy=True
+        )
+
+        info = {
+            "name": name,
+            "created": time.time(),
+            "filepath": bpy.data.filepath,
+            "blender": bpy.app.version_string,
+            "variables": sorted(variables),
+            "skipped": sorted(skipped),
+            "seconds": time.perf_counter() - start,
+        }
+        info_path.write_text(json.dumps(info, indent=2))
+        return info
+
+    def load_variables(self, name, namespace):
+        """Restore the variables of a checkpoint, return the names"""
+        _, pickle_path, _ = self._paths(name)
+        with pickle_path.open("rb") as fh:
+            variables = pickle.load(fh)  # noqa: S301
+        namespace.update(variables)
+        return sorted(variables)
+
+    def load_blend(self, name, loaded=None):
+        """Open the .blend file of a checkpoint, then call loaded()
+
+        Loading a file cancels the modal operator of the kernel loop, so this
+        runs from a timer unless blender runs in background mode. Returns
+        True if the file was opened, False if it opens later.
+        """
+        blend_path, _, _ = self._paths(name)
+        if not blend_path.exists():
+            raise FileNotFoundError(f"No checkpoint: {name}")
+
+        def load():
+            bpy.ops.wm.open_mainfile(filepath=str(blend_path), load_ui=False)
+
+        if bpy.app.background:
+            load()
+            if loaded is not None:
+                loaded()
+            return True
+
+        @bpy.app.handlers.persistent
+        def load_post(*args):
+            bpy.app.handlers.load_post.remove(load_post)
+            if loaded is not None:
+                loaded()
+
+        def load_later():
+            try:
+                load()
+            except RuntimeError as exc:
+                bpy.app.handlers.load_post.remove(load_post)
+                print(f"Can not open checkpoint {name!r}: {exc}")
+
+        bpy.app.handlers.load_post.append(load_post)
+        bpy.app.timers.register(load_later)
+        return False
+
+
+def register(shell, directory=None, restore=None):
+    """Register %bl_checkpoint and %bl_restore
+
+    restore is the checkpoint whose .blend file blender opened at startup,
+    its variables are restored.
+    """
+    checkpoints = Checkpoints(directory)
+    if restore is not None:
+        try:
+            restored = checkpoints.load_variables(restore, shell.user_ns)
+        except Exception as exc:
+            # Do not keep the kernel from starting
+            print(f"Can not restore checkpoint {restore!r}: {exc}")
+        else:
+            print(
+                f"Restored checkpoint {restore!r}"
+                f" ({len(restored)} variables)"
+            )
+
+    def bl_checkpoint(line):
+        """Save a checkpoint of the scene and the variables"""
+        name = line.strip() or get_default_name()
+        info = checkpoints.save(name, shell.user_ns, shell.user_ns_hidden)
+        print(
+            f"Saved checkpoint {name!r} in {info['seconds']:.2f} s"
+            f" ({len(info['variables'])} variables)"
+        )
+        if info["skipped"]:
+            print(f"Not picklable: {', '.join(info['skipped'])}")
+
+    def bl_restore(line):
+        """Restore a checkpoint, or list them with -l"""
+        name = line.strip() or get_default_name()
+        if name == "-l":
+            for name, info in checkpoints.list().items():
+                created = time.strftime(
+                    "%Y-%m-%d %H:%M:%S", time.localtime(info["created"])
+                )
+                print(f"{name:<24s} {created}  {info.get('filepath') or '-'}")
+            return
+
+        def restore():
+            restored = checkpoints.load_variables(name, shell.user_ns)
+            print(f"Restored checkpoint {name!r} ({len(restored)} variables)")
+
+        if not checkpoints.load_blend(name, restore):
+            print(
+                f"Loading checkpoint {name!r}, its variables are restored"
+                " when the file is open"
+            )
+
+    shell.register_magic_function(bl_checkpoint, "line", "bl_checkpoint")
+    shell.register_magic_function(bl_restore, "line", "bl_restore")
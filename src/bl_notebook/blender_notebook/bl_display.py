@@ -0,0 +1,174 @@
+"""
+Image output of the blender kernel.
+
+Pixels are read with foreach_get (see bl_numpy), downscaled and encoded by
+bl_image, and shown in the cell:
+
+    from bl_display import show_image
+
+    show_image(bpy.data.images["texture.png"])
+    show_image(bpy.context.scene)  # render the scene
+
+With ipywidgets the encoded image is sent in a binary buffer of the comm
+message instead of base64 text in the display data. The widget is only
+used if jupyter has the frontend of ipywidgets (see has_frontend()),
+otherwise it would show as a broken widget.
+"""
+
+import base64
+import contextlib
+import os
+
+import bpy
+import numpy as np
+from bl_image import MAX_BYTES, PREVIEW_SIZE, downscale, encode_image, to_uint8
+from bl_numpy import to_numpy
+from IPython.display import display
+
+try:
+    import ipywidgets
+except ImportError:
+    ipywidgets = None
+
+VIEWER_IMAGE_NAME = "Viewer Node"
+
+# Widget libraries whose frontend jupyter has, set by kernel.py from the
+# kernelspec (see get_widget_frontends in installer.py)
+WIDGETS_ENV = "BL_NOTEBOOK_WIDGETS"
+
+MIME_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+}
+
+
+def has_frontend(library):
+    """Whether jupyter can show the widgets of library"""
+    return library in os.environ.get(WIDGETS_ENV, "").split(",")
+
+
+@contextlib.contextmanager
+def viewer_node(scene):
+    """Find or add a compositor viewer node connected to the render layers
+
+    Render results have no pixels in python, the viewer node image has.
+    The nodes added and use_nodes are restored on exit.
+    """
+    use_nodes = scene.use_nodes
+    scene.use_nodes = True
+    tree = scene.node_tree
+    added = []
+    try:
+        viewer = None
+        for node in tree.nodes:
+            if node.type == "VIEWER":
+                viewer = node
+                break
+        if viewer is None:
+            layers = None
+            for node in tree.nodes:
+                if node.type == "R_LAYERS":
+                    layers = node
+                    break
+            if layers is None:
+                layers = tree.nodes.new("CompositorNodeRLayers")
+                added.append(layers)
+            viewer = tree.nodes.new("CompositorNodeViewer")
+            added.append(viewer)
+            tree.links.new(layers.outputs["Image"], viewer.inputs["Image"])
+        yield viewer
+    finally:
+        # Removing a node removes its links
+        for node in reversed(added):
+            tree.nodes.remove(node)
+        scene.use_nodes = use_nodes
+
+
+def render_to_array(scene=None):
+    """Render a still and return linear (height, width, 4) float32 pixels"""
+    if scene is None:
+        scene = bpy.context.scene
+    with viewer_node(scene):
+        bpy.ops.render.render(scene=scene.name)
+        return to_numpy(bpy.data.images[VIEWER_IMAGE_NAME])
+
+
+def image_to_array(image):
+    """Return pixels of an image and whether they are linear"""
+    # Float buffers are linear, byte buffers are in the image colorspace
+    return to_numpy(image), image.is_float
+
+
+class ImageDisplay:
+    """An image output which can be updated in place"""
+
+    def __init__(self, fmt="auto", max_size=PREVIEW_SIZE, max_bytes=MAX_BYTES):
+        self.fmt = fmt
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.widget = None
+        self.handle = None
+
+    def encode(self, pixels, linear=True, flip=True):
+        """Encode float or uint8 pixels, return (data, format)
+
+        Pixels are bottom-up like blender's unless flip is false.
+        """
+        if pixels.dtype == np.uint8:
+            pixels = pixels.astype(np.float32) / 255.0
+            linear = False
+        if self.max_size:
+            pixels = downscale(pixels, self.max_size)
+        image = to_uint8(pixels, linear=linear, flip=flip)
+        return encode_image(image, self.fmt, self.max_bytes)
+
+    def update(self, pixels, linear=True, flip=True):
+        data, fmt = self.encode(pixels, linear=linear, flip=flip)
+        if ipywidgets is not None and has_frontend("ipywidgets"):
+            self._update_widget(data, fmt)
+        else:
+            self._update_display_data(data, fmt)
+
+    def _update_widget(self, data, fmt):
+        if self.widget is None:
+            self.widget = ipywidgets.Image(value=data, format=fmt)
+            display(self.widget)
+            return
+        with self.widget.hold_sync():
+            self.widget.format = fmt
+            self.widget.value = data
+
+    def _update_display_data(self, data, fmt):
+        bundle = {MIME_TYPES[fmt]: base64.b64encode(data).decode("ascii")}
+        if self.handle is None:
+            self.handle = display(bundle, raw=True, display_id=True)
+        else:
+            self.handle.update(bundle, raw=True)
+
+
+def show_image(
+    source=None, fmt="auto", max_size=PREVIEW_SIZE, max_bytes=MAX_BYTES
+):
+    """Show an image, a render of a scene or an array in the cell
+
+    source is a bpy.types.Image, a bpy.types.Scene (rendered with the
+    compositor viewer node), a (height, width, channels) array of linear
+    floats or uint8, or None for the current scene. Images are downscaled to
+    max_size (None for the full size) and encoded as PNG, or WebP/JPEG if
+    the PNG exceeds max_bytes. Returns the ImageDisplay to update.
+    """
+    linear = True
+    flip = True
+    if source is None or isinstance(source, bpy.types.Scene):
+        pixels = render_to_array(source)
+    elif isinstance(source, bpy.types.Image):
+        pixels, linear = image_to_array(source)
+    else:
+        # Arrays are top-down
+        pixels = np.asarray(source)
+        flip = False
+
+    output = ImageDisplay(fmt=fmt, max_size=max_size, max_bytes=max_bytes)
+    output.update(pixels, linear=linear, flip=flip)
+    return output
@@ -0,0 +1,400 @@
+"""
+Geometry viewer of the blender kernel.
+
+Sends vertex and index arrays of meshes as binary buffers of widget messages
+to a small WebGL viewer (requires anywidget in blender's python and in the
+frontend, otherwise a static image of the vertices is shown):
+
+    from bl_geometry import show_geometry
+
+    viewer = show_geometry(bpy.data.objects["Suzanne"])
+    ...  # edit the mesh
+    viewer.refresh()
+
+Large meshes are decimated to max_vertices. Refreshing extracts only the
+objects updated by the depsgraph since the last refresh and sends only the
+arrays whose content changed.
+"""
+
+import weakref
+
+import bpy
+import numpy as np
+from bl_display import ImageDisplay, has_frontend
+from bl_mesh import decimate, render_points, transform_points, vertex_normals
+from bl_numpy import get_array
+from bpy.app.handlers import persistent
+
+try:
+    import anywidget
+    import traitlets
+except ImportError:
+    anywidget = None
+
+# Maximum number of vertices sent to the viewer
+MAX_VERTICES = 500000
+
+VIEWER_ESM = """
+const VERTEX_SHADER = `#version 300 es
+in vec3 position;
+in vec3 normal;
+uniform mat4 mvp;
+out vec3 vNormal;
+void main() {
+  vNormal = normal;
+  gl_Position = mvp * vec4(position, 1.0);
+}`;
+
+const FRAGMENT_SHADER = `#version 300 es
+precision mediump float;
+in vec3 vNormal;
+out vec4 color;
+void main() {
+  float light = abs(dot(normalize(vNormal), normalize(vec3(0.4, 0.3, 1.0))));
+  color = vec4(vec3(0.15 + 0.75 * light), 1.0);
+}`;
+
+function toArray(Type, view) {
+  if (!view || view.byteLength === 0) {
+    return new Type(0);
+  }
+  // Copy, the offset of the view may not be aligned
+  const end = view.byteOffset + view.byteLength;
+  return new Type(view.buffer.slice(view.byteOffset, end));
+}
+
+function compile(gl, type, source) {
+  const shader = gl.createShader(type);
+  gl.shaderSource(shader, source);
+  gl.compileShader(shader);
+  return shader;
+}
+
+function multiply(a, b) {
+  const out = new Float32Array(16);
+  for (let i = 0; i < 4; i++) {
+    for (let j = 0; j < 4; j++) {
+      let sum = 0;
+      for (let k = 0; k < 4; k++) {
+        sum += a[k * 4 + j] * b[i * 4 + k];
+      }
+      out[i * 4 + j] = sum;
+    }
+  }
+  return out;
+}
+
+function render({ model, el }) {
+  const canvas = document.createElement("canvas");
+  canvas.width = model.get("width");
+  canvas.height = model.get("height");
+  el.appendChild(canvas);
+  const gl = canvas.getContext("webgl2");
+  if (!gl) {
+    el.textContent = "WebGL2 is not available.";
+    return;
+  }
+
+  const program = gl.createProgram();
+  gl.attachShader(program, compile(gl, gl.VERTEX_SHADER, VERTEX_SHADER));
+  gl.attachShader(program, compile(gl, gl.FRAGMENT_SHADER, FRAGMENT_SHADER));
+  gl.linkProgram(program);
+  const buffers = {
+    position: gl.createBuffer(),
+    normal: gl.createBuffer(),
+    indices: gl.createBuffer(),
+  };
+  const state = { yaw: 0.6, pitch: 0.4, zoom: 1.0, count: 0 };
+  let center = [0, 0, 0];
+  let radius = 1;
+
+  function upload(name) {
+    if (name === "indices") {
+      const indices = toArray(Uint32Array, model.get("indices"));
+      gl.bindBuffer(gl.ELEMENT_ARRAY_BUFFER, buffers.indices);
+      gl.bufferData(gl.ELEMENT_ARRAY_BUFFER, indices, gl.STATIC_DRAW);
+      state.count = indices.length;
+      return;
+    }
+    const data = toArray(Float32Array, model.get(name));
+    gl.bindBuffer(gl.ARRAY_BUFFER, buffers[name]);
+    gl.bufferData(gl.ARRAY_BUFFER, data, gl.STATIC_DRAW);
+    if (name === "position" && data.length > 0) {
+      const lower = [Infinity, Infinity, Infinity];
+      const upper = [-Infinity, -Infinity, -Infinity];
+      for (let i = 0; i < data.length; i++) {
+        lower[i % 3] = Math.min(lower[i % 3], data[i]);
+        upper[i % 3] = Math.max(upper[i % 3], data[i]);
+      }
+      center = lower.map((x, i) => (x + upper[i]) / 2);
+      radius = Math.max(...upper.map((x, i) => x - lower[i])) || 1;
+    }
+  }
+
+  function draw() {
+    const aspect = canvas.width / canvas.height;
+    const f = 1 / Math.tan(0.4);
+    const distance = 2.0 * radius * state.zoom;
+    const near = distance / 100;
+    const far = distance * 10;
+    const projection = new Float32Array([
+      f / aspect, 0, 0, 0,
+      0, f, 0, 0,
+      0, 0, (far + near) / (near - far), -1,
+      0, 0, (2 * far * near) / (near - far), 0,
+    ]);
+    const cy = Math.cos(state.yaw), sy = Math.sin(state.yaw);
+    const cp = Math.cos(state.pitch), sp = Math.sin(state.pitch);
+    // Z up like blender
+    const rotation = new Float32Array([
+      cy, -sy * sp, sy * cp, 0,
+      sy, cy * sp, -cy * cp, 0,
+      0, cp, sp, 0,
+      0, 0, 0, 1,
+    ]);
+    const translate = new Float32Array([
+      1, 0, 0, 0,
+      0, 1, 0, 0,
+      0, 0, 1, 0,
+      -center[0], -center[1], -center[2], 1,
+    ]);
+    const view = new Float32Array([
+      1, 0, 0, 0,
+      0, 1, 0, 0,
+      0, 0, 1, 0,
+      0, 0, -distance, 1,
+    ]);
+    const model_view = multiply(view, multiply(rotation, translate));
+    const mvp = multiply(projection, model_view);
+
+    gl.viewport(0, 0, canvas.width, canvas.height);
+    gl.clearColor(0.22, 0.22, 0.22, 1);
+    gl.clear(gl.COLOR_BUFFER_BIT | gl.DEPTH_BUFFER_BIT);
+    gl.enable(gl.DEPTH_TEST);
+    gl.useProgram(program);
+    gl.uniformMatrix4fv(gl.getUniformLocation(program, "mvp"), false, mvp);
+    for (const name of ["position", "normal"]) {
+      const location = gl.getAttribLocation(program, name);
+      gl.bindBuffer(gl.ARRAY_BUFFER, buffers[name]);
+      gl.enableVertexAttribArray(location);
+      gl.vertexAttribPointer(location, 3, gl.FLOAT, false, 0, 0);
+    }
+    gl.bindBuffer(gl.ELEMENT_ARRAY_BUFFER, buffers.indices);
+    gl.drawElements(gl.TRIANGLES, state.count, gl.UNSIGNED_INT, 0);
+  }
+
+  for (const name of ["position", "normal", "indices"]) {
+    upload(name);
+    model.on(`change:${name}`, () => {
+      upload(name);
+      draw();
+    });
+  }
+
+  let drag = null;
+  canvas.addEventListener("pointerdown", (e) => {
+    drag = [e.clientX, e.clientY];
+    canvas.setPointerCapture(e.pointerId);
+  });
+  canvas.addEventListener("pointerup", () => (drag = null));
+  canvas.addEventListener("pointermove", (e) => {
+    if (!drag) {
+      return;
+    }
+    state.yaw += (e.clientX - drag[0]) * 0.01;
+    state.pitch += (e.clientY - drag[1]) * 0.01;
+    drag = [e.clientX, e.clientY];
+    draw();
+  });
+  canvas.addEventListener("wheel", (e) => {
+    e.preventDefault();
+    state.zoom *= Math.exp(e.deltaY * 0.001);
+    draw();
+  });
+  draw();
+}
+
+export default { render };
+"""
+
+
+def mesh_arrays(obj, depsgraph=None):
+    """Triangles of an evaluated mesh object in world space
+
+    Returns (positions, triangles) as float32 and uint32 arrays.
+    """
+    if depsgraph is None:
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+    evaluated = obj.evaluated_get(depsgraph)
+    mesh = evaluated.to_mesh()
+    try:
+        mesh.calc_loop_triangles()
+        positions = get_array(mesh.vertices, "co", 3, np.float32)
+        triangles = get_array(mesh.loop_triangles, "vertices", 3, np.int32)
+    finally:
+        evaluated.to_mesh_clear()
+    positions = transform_points(positions, evaluated.matrix_world)
+    return positions, triangles.astype(np.uint32)
+
+
+def merge_arrays(meshes, max_vertices=MAX_VERTICES):
+    """Merge meshes into (positions, normals, triangles)"""
+    all_positions = []
+    all_triangles = []
+    offset = 0
+    for positions, triangles in meshes:
+        all_positions.append(positions)
+        all_triangles.append(triangles + offset)
+        offset += len(positions)
+    if not all_positions:
+        empty = np.empty((0, 3), dtype=np.float32)
+        return empty, empty, np.empty((0, 3), dtype=np.uint32)
+
+    positions = np.concatenate(all_positions)
+    triangles = np.concatenate(all_triangles)
+    if max_vertices:
+        positions, triangles = decimate(positions, triangles, max_vertices)
+    return positions, vertex_normals(positions, triangles), triangles
+
+
+def scene_arrays(objects, max_vertices=MAX_VERTICES):
+    """Merge meshes of objects into (positions, normals, triangles)"""
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    meshes = [mesh_arrays(x, depsgraph) for x in objects if x.type == "MESH"]
+    return merge_arrays(meshes, max_vertices)
+
+
+# Caches notified of the objects updated by the depsgraph
+_caches = weakref.WeakSet()
+
+
+@persistent
+def _depsgraph_update_post(scene, depsgraph):
+    names = set()
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Object) and (
+            update.is_updated_geometry or update.is_updated_transform
+        ):
+            names.add(update.id.original.name)
+    for cache in list(_caches):
+        cache.dirty |= names
+
+
+class MeshCache:
+    """Arrays of mesh objects, extracted again only when they are updated"""
+
+    def __init__(self, objects):
+        self.objects = [x for x in objects if x.type == "MESH"]
+        self.meshes = {}
+        self.dirty = {x.name for x in self.objects}
+        self.merged = None
+        _caches.add(self)
+        handlers = bpy.app.handlers.depsgraph_update_post
+        if _depsgraph_update_post not in handlers:
+            handlers.append(_depsgraph_update_post)
+
+    def update(self, max_vertices=MAX_VERTICES):
+        """Return (changed, (positions, normals, triangles))"""
+        # Evaluating pending changes runs _depsgraph_update_post
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        dirty, self.dirty = self.dirty, set()
+        names = []
+        for obj in list(self.objects):
+            try:
+                name = obj.name
+            except ReferenceError:
+                # Deleted
+                self.objects.remove(obj)
+                dirty.add(None)
+                continue
+            names.append(name)
+            if name in dirty or name not in self.meshes:
+                self.meshes[name] = mesh_arrays(obj, depsgraph)
+                dirty.add(name)
+        if self.merged is not None and not dirty & (set(names) | {None}):
+            return False, self.merged
+        self.merged = merge_arrays(
+            [self.meshes[x] for x in names], max_vertices
+        )
+        return True, self.merged
+
+
+class GeometryImage:
+    """Static view of meshes when jupyter can not show the WebGL viewer"""
+
+    def __init__(
+        self, objects, max_vertices=MAX_VERTICES, width=640, height=480
+    ):
+        self.cache = MeshCache(objects)
+        self.max_vertices = max_vertices
+        self.width = width
+        self.height = height
+        self.output = ImageDisplay(max_size=None)
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        changed, arrays = self.cache.update(self.max_vertices)
+        if not changed and not force:
+            return
+        positions, normals, _ = arrays
+        pixels = render_points(positions, normals, self.width, self.height)
+        self.output.update(pixels, linear=False, flip=False)
+
+
+if anywidget is not None:
+
+    class GeometryViewer(anywidget.AnyWidget):
+        """WebGL viewer of triangle meshes"""
+
+        _esm = VIEWER_ESM
+        position = traitlets.Bytes(b"").tag(sync=True)
+        normal = traitlets.Bytes(b"").tag(sync=True)
+        indices = traitlets.Bytes(b"").tag(sync=True)
+        width = traitlets.Int(640).tag(sync=True)
+        height = traitlets.Int(480).tag(sync=True)
+
+        def __init__(self, objects, max_vertices=MAX_VERTICES, **kwargs):
+            super().__init__(**kwargs)
+            self.cache = MeshCache(objects)
+            self.max_vertices = max_vertices
+            self.refresh()
+
+        def refresh(self):
+            """Send the arrays which changed
+
+            Only the objects updated since the last refresh are extracted
+            again, and only the buffers whose content changed are sent.
+            """
+            changed, arrays = self.cache.update(self.max_vertices)
+            if not changed:
+                return
+            with self.hold_sync():
+                for name, array in zip(
+                    ("position", "normal", "indices"), arrays
+                ):
+                    data = array.tobytes()
+                    if data != getattr(self, name):
+                        setattr(self, name, data)
+
+
+def show_geometry(objects=None, max_vertices=MAX_VERTICES, **kwargs):
+    """Show meshes in a WebGL viewer, return the viewer to refresh
+
+    objects is an object or a list of them (default: the selected objects).
+    Meshes are evaluated with modifiers and decimated to max_vertices (None
+    to send all vertices). Without anywidget in blender's python or in
+    jupyter, a static image of the vertices is shown instead (GeometryImage).
+    """
+    from IPython.display import display
+
+    if objects is None:
+        objects = bpy.context.selected_objects
+    elif isinstance(objects, bpy.types.Object):
+        objects = [objects]
+    if anywidget is None or not has_frontend("anywidget"):
+        return GeometryImage(
+            list(objects), max_vertices=max_vertices, **kwargs
+        )
+    viewer = GeometryViewer(list(objects), max_vertices=max_vertices, **kwargs)
+    display(viewer)
+    return viewer
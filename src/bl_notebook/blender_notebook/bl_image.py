@@ -0,0 +1,159 @@
+"""
+Image encoding for notebook output.
+
+Converts float pixels of blender (bottom-up, linear or sRGB) to 8 bit
+images and encodes them as PNG, or as JPEG/WebP when Pillow is available and
+PNG exceeds the size cap. Does not depend on bpy.
+"""
+
+import io
+import struct
+import zlib
+
+import numpy as np
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+# Longest side of previews in pixels
+PREVIEW_SIZE = 1024
+# Size cap of encoded images in bytes
+MAX_BYTES = 2 * 1024 * 1024
+# Lossy formats in order of preference and their qualities to try
+LOSSY_FORMATS = ["webp", "jpeg"]
+LOSSY_QUALITIES = [90, 80, 65, 50]
+
+
+def linear_to_srgb(pixels):
+    """Apply the sRGB transfer function to linear RGB(A) values"""
+    rgb = np.clip(pixels[..., :3], 0.0, 1.0)
+    rgb = np.where(
+        rgb <= 0.0031308,
+        rgb * 12.92,
+        1.055 * np.power(rgb, 1.0 / 2.4) - 0.055,
+    )
+    if pixels.shape[-1] > 3:
+        return np.concatenate([rgb, pixels[..., 3:]], axis=-1)
+    return rgb
+
+
+def to_uint8(pixels, linear=False, flip=True):
+    """Convert (height, width, channels) float pixels to uint8
+
+    Blender stores pixels bottom-up, so the rows are flipped by default.
+    """
+    if linear:
+        pixels = linear_to_srgb(pixels)
+    if flip:
+        pixels = pixels[::-1]
+    return (np.clip(pixels, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+
+def downscale(pixels, max_size=PREVIEW_SIZE):
+    """Shrink pixels so that the longest side is at most max_size
+
+    Uses a box filter of an integer factor, then nearest sampling for the
+    remainder.
+    """
+    height, width = pixels.shape[:2]
+    longest = max(height, width)
+    if longest <= max_size:
+        return pixels
+
+    factor = longest // max_size
+    if factor > 1:
+        h, w = height // factor * factor, width // factor * factor
+        boxes = pixels[:h, :w].reshape(
+            h // factor, factor, w // factor, factor, -1
+        )
+        pixels = boxes.mean(axis=(1, 3), dtype=np.float32)
+        height, width = pixels.shape[:2]
+
+    scale = max_size / max(height, width)
+    if scale < 1.0:
+        rows = (np.arange(int(height * scale)) / scale).astype(np.intp)
+        cols = (np.arange(int(width * scale)) / scale).astype(np.intp)
+        pixels = pixels[rows][:, cols]
+    return pixels
+
+
+def _png_chunk(kind, data):
+    chunk = kind + data
+    return (
+        struct.pack(">I", len(data))
+        + chunk
+        + struct.pack(">I", zlib.crc32(chunk) & 0xFFFFFFFF)
+    )
+
+
+def encode_png(image, level=6):
+    """Encode a (height, width, channels) uint8 array as PNG"""
+    if image.ndim == 2:
+        image = image[..., np.newaxis]
+    height, width, channels = image.shape
+    color_type = {1: 0, 2: 4, 3: 2, 4: 6}[channels]
+    # Filter type 0 (none) for each row
+    raw = np.empty((height, width * channels + 1), dtype=np.uint8)
+    raw[:, 0] = 0
+    raw[:, 1:] = image.reshape(height, -1)
+    header = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(raw.tobytes(), level))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+def encode_lossy(image, fmt, quality):
+    """Encode a uint8 array with Pillow, return None if unsupported"""
+    if PILImage is None:
+        return None
+    if fmt == "jpeg" and image.shape[-1] == 4:
+        image = image[..., :3]
+    buffer = io.BytesIO()
+    try:
+        PILImage.fromarray(np.squeeze(image)).save(
+            buffer, format=fmt.upper(), quality=quality
+        )
+    except (KeyError, OSError):
+        # Pillow was built without the format
+        return None
+    return buffer.getvalue()
+
+
+def encode_image(image, fmt="auto", max_bytes=MAX_BYTES):
+    """Encode a uint8 array adaptively
+
+    Returns (data, format). With fmt "auto", PNG is used if it fits in
+    max_bytes. Otherwise lossy formats are tried with decreasing quality,
+    and the image is halved until it fits.
+    """
+    while True:
+        if fmt in ("auto", "png"):
+            data = encode_png(image)
+            if fmt == "png" or len(data) <= max_bytes:
+                return data, "png"
+
+        formats = LOSSY_FORMATS if fmt == "auto" else [fmt]
+        supported = False
+        for lossy in formats:
+            for quality in LOSSY_QUALITIES:
+                data = encode_lossy(image, lossy, quality)
+                if data is None:
+                    break
+                supported = True
+                if len(data) <= max_bytes:
+                    return data, lossy
+
+        if not supported and fmt != "auto":
+            # Can not encode the format, fall back to PNG
+            fmt = "auto"
+            continue
+
+        height, width = image.shape[:2]
+        if max(height, width) <= 1:
+            return encode_png(image), "png"
+        image = image[::2, ::2]
@@ -0,0 +1,113 @@
+"""
+Triangle mesh arrays for the geometry viewer.
+
+Decimation by vertex clustering, vertex normals and a static point splat
+view in numpy. Does not depend on bpy.
+"""
+
+import numpy as np
+
+# Iterations to find the clustering grid for decimate()
+DECIMATE_ITERATIONS = 8
+
+
+def transform_points(points, matrix):
+    """Apply a 4x4 matrix to (n, 3) points"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    return points @ matrix[:3, :3].T + matrix[:3, 3]
+
+
+def vertex_normals(positions, triangles):
+    """Area weighted vertex normals of a triangle mesh"""
+    corners = positions[triangles]
+    face_normals = np.cross(
+        corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]
+    )
+    normals = np.zeros_like(positions)
+    for i in range(3):
+        np.add.at(normals, triangles[:, i], face_normals)
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, lengths, out=normals, where=lengths > 0)
+    return normals.astype(np.float32)
+
+
+def _cluster(positions, triangles, resolution):
+    lower = positions.min(axis=0)
+    extent = float((positions.max(axis=0) - lower).max()) or 1.0
+    cells = np.floor((positions - lower) * (resolution / extent))
+    cells = np.minimum(cells, resolution - 1).astype(np.int64)
+    keys = (cells[:, 0] * resolution + cells[:, 1]) * resolution + cells[:, 2]
+    _, inverse, counts = np.unique(
+        keys, return_inverse=True, return_counts=True
+    )
+    inverse = inverse.reshape(-1)
+
+    clustered = np.zeros((len(counts), 3), dtype=np.float64)
+    np.add.at(clustered, inverse, positions)
+    clustered /= counts[:, np.newaxis]
+
+    remapped = inverse[triangles]
+    keep = (
+        (remapped[:, 0] != remapped[:, 1])
+        & (remapped[:, 1] != remapped[:, 2])
+        & (remapped[:, 2] != remapped[:, 0])
+    )
+    return clustered.astype(np.float32), remapped[keep].astype(np.uint32)
+
+
+def decimate(positions, triangles, max_vertices):
+    """Reduce a mesh to at most max_vertices by vertex clustering
+
+    Vertices in the same cell of a uniform grid are merged and degenerate
+    triangles are dropped. Returns (positions, triangles).
+    """
+    if len(positions) <= max_vertices:
+        return positions, triangles
+
+    # The vertices of a surface occupy about resolution ** 2 cells
+    resolution = max(2, int(np.sqrt(max_vertices)))
+    for _ in range(DECIMATE_ITERATIONS):
+        result = _cluster(positions, triangles, resolution)
+        if len(result[0]) <= max_vertices or resolution <= 2:
+            return result
+        resolution = max(2, int(resolution * 0.8))
+    return result
+
+
+def render_points(
+    positions, normals, width=640, height=480, yaw=0.6, pitch=0.4
+):
+    """Shade vertices as point splats, the static view of the viewer
+
+    The view looks along +y (z up), rotated by yaw and pitch, like the
+    initial view of the WebGL viewer. Returns top-down (height, width, 4)
+    float32 pixels in display space.
+    """
+    pixels = np.zeros((height, width, 4), dtype=np.float32)
+    if not len(positions):
+        return pixels
+    cy, sy, cp, sp = np.cos(yaw), np.sin(yaw), np.cos(pitch), np.sin(pitch)
+    rotation = np.array(
+        [[cy, -sy, 0], [sy, cy, 0], [0, 0, 1]], dtype=np.float32
+    )
+    rotation = (
+        np.array([[1, 0, 0], [0, cp, -sp], [0, sp, cp]], dtype=np.float32)
+        @ rotation
+    )
+    lower, upper = positions.min(axis=0), positions.max(axis=0)
+    points = (positions - (lower + upper) / 2) @ rotation.T
+    radius = float(np.linalg.norm(upper - lower)) / 2 or 1.0
+    scale = 0.9 * min(width, height) / (2 * radius)
+    xs = (width / 2 + points[:, 0] * scale).astype(np.int64)
+    ys = (height / 2 - points[:, 2] * scale).astype(np.int64)
+    light = normals @ rotation.T @ np.array([0.4, -1.0, 0.3], dtype=np.float32)
+    light = 0.15 + 0.75 * np.abs(light) / np.linalg.norm([0.4, -1.0, 0.3])
+
+    # Far points first, so that near points overwrite them
+    order = np.argsort(-points[:, 1])
+    for dx, dy in ((0, 0), (1, 0), (0, 1), (1, 1)):
+        x, y = xs[order] + dx, ys[order] + dy
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        pixels[y[inside], x[inside], :3] = light[order][inside, None]
+        pixels[y[inside], x[inside], 3] = 1.0
+    return pixels
@@ -0,0 +1,201 @@
+"""
+NumPy bridges for bpy data.
+
+Installed next to kernel.py, so cells of the blender kernel can import it:
+
+    from bl_numpy import to_numpy, from_numpy
+
+    co = to_numpy(bpy.data.objects["Cube"], "vertices")
+    co[:, 2] += 1.0
+    from_numpy(bpy.data.objects["Cube"], co, "vertices")
+
+Data is copied with foreach_get/foreach_set into (preallocated) contiguous
+arrays, which is orders of magnitude faster than python loops over bpy
+collections.
+"""
+
+import bpy
+import numpy as np
+
+# Mesh arrays by name: (collection, property, width, dtype)
+MESH_ARRAYS = {
+    "vertices": ("vertices", "co", 3, np.float32),
+    "normals": ("vertices", "normal", 3, np.float32),
+    "edges": ("edges", "vertices", 2, np.int32),
+    "loops": ("loops", "vertex_index", 1, np.int32),
+    "loop_starts": ("polygons", "loop_start", 1, np.int32),
+    "loop_totals": ("polygons", "loop_total", 1, np.int32),
+    "polygon_normals": ("polygons", "normal", 3, np.float32),
+    "polygon_centers": ("polygons", "center", 3, np.float32),
+    "materials": ("polygons", "material_index", 1, np.int32),
+}
+
+# Attribute data types: (property, width, dtype)
+ATTRIBUTE_TYPES = {
+    "FLOAT": ("value", 1, np.float32),
+    "INT": ("value", 1, np.int32),
+    "INT8": ("value", 1, np.int8),
+    "BOOLEAN": ("value", 1, np.bool_),
+    "FLOAT2": ("vector", 2, np.float32),
+    "INT32_2D": ("value", 2, np.int32),
+    "FLOAT_VECTOR": ("vector", 3, np.float32),
+    "FLOAT_COLOR": ("color", 4, np.float32),
+    "BYTE_COLOR": ("color", 4, np.float32),
+    "QUATERNION": ("value", 4, np.float32),
+}
+
+
+def _check_out(out, size, dtype):
+    """Raise ValueError unless foreach_get can fill out in place"""
+    if out.size != size or out.dtype != dtype:
+        raise ValueError(
+            f"out must have {size} items of {np.dtype(dtype)},"
+            f" not {out.size} items of {out.dtype}"
+        )
+    # reshape(-1) of a non-contiguous array is a copy, which foreach_get
+    # would fill instead of out
+    if not out.flags.c_contiguous:
+        raise ValueError("out must be C-contiguous")
+
+
+def get_array(collection, prop, width=1, dtype=np.float32, out=None):
+    """Copy prop of all items of a bpy collection into an array
+
+    The array has the shape (len(collection), width), or (len(collection),)
+    if width is 1. If out is given, it must be a C-contiguous array of that
+    size and dtype.
+    """
+    count = len(collection)
+    if out is None:
+        out = np.empty(count * width, dtype=dtype)
+    else:
+        _check_out(out, count * width, dtype)
+    collection.foreach_get(prop, out.reshape(-1))
+    if width == 1:
+        return out.reshape(count)
+    return out.reshape(count, width)
+
+
+def set_array(collection, prop, array, dtype=np.float32):
+    """Copy an array into prop of all items of a bpy collection"""
+    array = np.ascontiguousarray(array, dtype=dtype).reshape(-1)
+    collection.foreach_set(prop, array)
+
+
+def _get_mesh(data):
+    if isinstance(data, bpy.types.Object):
+        data = data.data
+    if not isinstance(data, bpy.types.Mesh):
+        raise TypeError(f"Not a mesh: {data!r}")
+    return data
+
+
+def _get_accessor(data, name):
+    """Return (collection, property, width, dtype) of data and name"""
+    if isinstance(data, bpy.types.Attribute):
+        prop, width, dtype = ATTRIBUTE_TYPES[data.data_type]
+        return data.data, prop, width, dtype
+
+    if isinstance(data, bpy.types.FCurve):
+        return data.keyframe_points, "co", 2, np.float32
+
+    mesh = _get_mesh(data)
+    if name in MESH_ARRAYS:
+        collection, prop, width, dtype = MESH_ARRAYS[name]
+        return getattr(mesh, collection), prop, width, dtype
+    if name in mesh.uv_layers:
+        return mesh.uv_layers[name].data, "uv", 2, np.float32
+    if name in mesh.attributes:
+        return _get_accessor(mesh.attributes[name], None)
+    raise KeyError(f"No array named {name!r} in {mesh.name}")
+
+
+def to_numpy(data, name=None, out=None):
+    """Copy bpy data into a numpy array
+
+    data is one of:
+
+    - a mesh object or mesh with name in MESH_ARRAYS ("vertices",
+      "normals", ...), a UV map name or an attribute name.
+    - a mesh attribute (bpy.types.Attribute).
+    - an image, returned as (height, width, channels) float32 pixels.
+    - an animation curve (bpy.types.FCurve), returned as (n, 2) keyframe
+      (frame, value) pairs.
+
+    If out is given, it must be a C-contiguous array with as many items
+    and the dtype of the result, otherwise ValueError is raised.
+    """
+    if isinstance(data, bpy.types.Image):
+        width, height = data.size
+        shape = (height, width, data.channels)
+        if out is None:
+            out = np.empty(shape, dtype=np.float32)
+        else:
+            _check_out(out, width * height * data.channels, np.float32)
+        data.pixels.foreach_get(out.reshape(-1))
+        return out.reshape(shape)
+
+    collection, prop, width, dtype = _get_accessor(data, name)
+    return get_array(collection, prop, width, dtype, out=out)
+
+
+def from_numpy(data, array, name=None):
+    """Copy a numpy array into bpy data, the reverse of to_numpy()
+
+    The array must have as many items as the bpy data, except for animation
+    curves, whose keyframes are added or removed to match the array.
+    """
+    if isinstance(data, bpy.types.FCurve):
+        points = data.keyframe_points
+        count = len(array)
+        while len(points) > count:
+            points.remove(points[-1], fast=True)
+        if len(points) < count:
+            points.add(count - len(points))
+        set_array(points, "co", array)
+        data.update()
+        return
+
+    if isinstance(data, bpy.types.Image):
+        data.pixels.foreach_set(
+            np.ascontiguousarray(array, dtype=np.float32).reshape(-1)
+        )
+        data.update()
+        return
+
+    collection, prop, width, dtype = _get_accessor(data, name)
+    set_array(collection, prop, array, dtype)
+    if not isinstance(data, bpy.types.Attribute):
+        _get_mesh(data).update()
+
+
+def to_numpy_batch(objects, name="vertices"):
+    """Copy an array of many meshes into a single array
+
+    Returns the concatenated array and the offsets of each object, so that
+    array[offsets[i]:offsets[i + 1]] belongs to objects[i].
+    """
+    offsets = np.zeros(len(objects) + 1, dtype=np.int64)
+    if not objects:
+        return np.empty(0, dtype=np.float32), offsets
+
+    accessors = [_get_accessor(x, name) for x in objects]
+    counts = [len(collection) for collection, _, _, _ in accessors]
+    np.cumsum(counts, out=offsets[1:])
+
+    _, _, width, dtype = accessors[0]
+    result = np.empty(int(offsets[-1]) * width, dtype=dtype)
+    for i, (collection, prop, _, _) in enumerate(accessors):
+        # Slices of a contiguous array are contiguous
+        view = result[offsets[i] * width : offsets[i + 1] * width]
+        collection.foreach_get(prop, view)
+
+    if width == 1:
+        return result, offsets
+    return result.reshape(-1, width), offsets
+
+
+def from_numpy_batch(objects, array, offsets, name="vertices"):
+    """Copy the array made by to_numpy_batch() back to the meshes"""
+    for i, obj in enumerate(objects):
+        from_numpy(obj, array[offsets[i] : offsets[i + 1]], name)
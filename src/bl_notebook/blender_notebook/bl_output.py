@@ -0,0 +1,263 @@
+"""
+Coalescing of the output of the blender kernel.
+
+Operators and add-ons may print thousands of lines per second. The streams
+of the kernel are wrapped so that writes are batched by time and size
+before they reach the iopub stream, and the output of a cell is truncated
+above max_lines. A truncated cell shows its first max_lines lines, a
+summary and its last tail_lines lines; the full output is written to a log
+file of the cell.
+
+The module does not depend on bpy.
+"""
+
+import collections
+import threading
+import time
+from pathlib import Path
+
+# Output settings. These can be overridden by the "output" entry of the
+# runtime config.
+OUTPUT_CONFIG = {
+    # Seconds to batch writes before forwarding them
+    "flush_interval": 0.05,
+    # Forward the batch when it reaches this many characters
+    "flush_size": 65536,
+    # Lines of a cell forwarded before truncating its output (0: never)
+    "max_lines": 1000,
+    # Last lines of a truncated cell shown at the end of the cell
+    "tail_lines": 50,
+}
+
+
+class CoalescedStream:
+    """File-like object batching writes to a target stream
+
+    Call begin_cell() and end_cell() around cells to truncate their output
+    and spill it to log_dir. Other attributes (e.g., set_parent() of
+    ipykernel's OutStream) are those of the target.
+    """
+
+    def __init__(
+        self, target, name, log_dir=None, clock=time.monotonic, **config
+    ):
+        self.target = target
+        self.name = name
+        self.log_dir = Path(log_dir) if log_dir is not None else None
+        self.clock = clock
+        self.config = dict(OUTPUT_CONFIG, **config)
+        self._lock = threading.RLock()
+        self._wakeup = threading.Condition(self._lock)
+        self._buffer = []
+        self._buffer_size = 0
+        self._buffer_start = None
+        self._thread = None
+        self._cell = None
+        self._reset_cell()
+
+    def _reset_cell(self):
+        self._lines = 0
+        self._omitted = 0
+        self._partial = ""
+        # Output of the cell until it is truncated
+        self._head = []
+        self._tail = collections.deque(maxlen=self.config["tail_lines"])
+        self._log = None
+        self.log_path = None
+
+    # File-like interface
+
+    @property
+    def encoding(self):
+        return getattr(self.target, "encoding", "utf-8")
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        return self.target.fileno()
+
+    def set_parent(self, parent):
+        """Forward the pending output, then set the parent of the target
+
+        ipykernel sets the parent message of sys.stdout and sys.stderr, so
+        that their output goes to the cell of the message.
+        """
+        self.flush()
+        self.target.set_parent(parent)
+
+    def __getattr__(self, name):
+        if name == "target":
+            raise AttributeError(name)
+        return getattr(self.target, name)
+
+    def write(self, text):
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text)}")
+        with self._lock:
+            self._write_cell(text)
+            if self._buffer_size >= self.config["flush_size"]:
+                self._forward()
+            elif (
+                self._buffer_start is not None
+                and self.clock() - self._buffer_start
+                >= self.config["flush_interval"]
+            ):
+                self._forward()
+        return len(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        with self._lock:
+            self._forward()
+            if self._log is not None:
+                self._log.flush()
+        self.target.flush()
+
+    # Cells
+
+    def begin_cell(self, cell_id):
+        with self._lock:
+            self._forward()
+            self._reset_cell()
+            self._cell = cell_id
+
+    def end_cell(self):
+        """Forward the summary and the tail of a truncated cell"""
+        with self._lock:
+            if self.truncated:
+                if self._partial:
+                    self._tail.append(self._partial + "\n")
+                    self._omitted += 1
+                omitted = self._omitted - len(self._tail)
+                if omitted:
+                    summary = f"... {omitted} lines omitted"
+                    if self.log_path is not None:
+                        summary += f", full output in {self.log_path}"
+                    self._buffer_text(f"[{summary}]\n")
+                self._buffer_text("".join(self._tail))
+            if self._log is not None:
+                self._log.close()
+            self._forward()
+            self._cell = None
+            self._reset_cell()
+        self.target.flush()
+
+    @property
+    def truncated(self):
+        return self._head is None
+
+    def _write_cell(self, text):
+        max_lines = self.config["max_lines"]
+        if self._cell is None or not max_lines:
+            self._buffer_text(text)
+            return
+
+        if self._lines < max_lines:
+            self._head.append(text)
+            remaining = max_lines - self._lines
+            newlines = text.count("\n")
+            if newlines < remaining:
+                self._lines += newlines
+                self._buffer_text(text)
+                return
+            # The line budget ends in this text
+            cut = 0
+            for _ in range(remaining):
+                cut = text.index("\n", cut) + 1
+            self._lines = max_lines
+            self._buffer_text(text[:cut])
+            text = text[cut:]
+            if not text:
+                return
+            self._open_log()
+        elif self._head is not None:
+            self._head.append(text)
+            self._open_log()
+        elif self._log is not None:
+            self._log.write(text)
+
+        lines = (self._partial + text).splitlines(keepends=True)
+        if lines and not lines[-1].endswith("\n"):
+            self._partial = lines.pop()
+        else:
+            self._partial = ""
+        self._omitted += len(lines)
+        self._tail.extend(lines)
+
+    def _open_log(self):
+        """Start truncating, write the output of the cell to its log"""
+        head, self._head = "".join(self._head), None
+        if self.log_dir is None:
+            return
+        path = self.log_dir / f"cell-{self._cell}-{self.name}.log"
+        try:
+            self.log_dir.mkdir(parents=True, exist_ok=True)
+            self._log = path.open("w", encoding="utf-8")
+        except OSError:
+            return
+        self._log.write(head)
+        self.log_path = path
+
+    def _buffer_text(self, text):
+        if not text:
+            return
+        if self._buffer_start is None:
+            self._buffer_start = self.clock()
+            # Cells may block without writing more
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._flush_loop,
+                    name=f"bl_output-{self.name}",
+                    daemon=True,
+                )
+                self._thread.start()
+            self._wakeup.notify()
+        self._buffer.append(text)
+        self._buffer_size += len(text)
+
+    def _flush_loop(self):
+        """Forward batches flush_interval seconds after they start"""
+        while True:
+            with self._lock:
+                while True:
+                    if self._buffer_start is None:
+                        self._wakeup.wait()
+                        continue
+                    delay = (
+                        self._buffer_start
+                        + self.config["flush_interval"]
+                        - self.clock()
+                    )
+                    if delay <= 0:
+                        break
+                    self._wakeup.wait(delay)
+                self._forward()
+            self.target.flush()
+
+    def _forward(self):
+        if not self._buffer:
+            return
+        text = "".join(self._buffer)
+        self._buffer = []
+        self._buffer_size = 0
+        self._buffer_start = None
+        self.target.write(text)
+
+
+def install(sys_module, log_dir=None, **config):
+    """Wrap sys.stdout and sys.stderr, return the wrapped streams"""
+    streams = []
+    for name in ("stdout", "stderr"):
+        stream = CoalescedStream(
+            getattr(sys_module, name), name, log_dir=log_dir, **config
+        )
+        setattr(sys_module, name, stream)
+        streams.append(stream)
+    return streams
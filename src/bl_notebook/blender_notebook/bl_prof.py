@@ -0,0 +1,413 @@
+"""
+Profiling magics of the blender kernel.
+
+    %bl_prof bpy.ops.mesh.primitive_monkey_add()
+
+    %%bl_prof -s tottime -n 20
+    for obj in bpy.data.objects:
+        bpy.ops.object.shade_smooth({"selected_editable_objects": [obj]})
+
+The code runs under cProfile (or only a sampling profiler with -m sample).
+The result shows the calls of bpy.ops with their context overrides and the
+time spent in depsgraph evaluation during each operator, then the functions.
+Click a column header of the tables to sort them. The stacks are sampled in
+sample mode or when -f is given, and written in the folded format of
+flamegraph.pl and speedscope.
+"""
+
+import argparse
+import collections
+import contextlib
+import cProfile
+import html
+import os
+import pstats
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Seconds between samples of the sampling profiler
+SAMPLE_INTERVAL = 0.001
+
+SORT_KEYS = ["cumtime", "tottime", "ncalls", "name"]
+
+# Columns of the sampled functions by sort key. Samples have no call
+# counts, so ncalls sorts by the total samples.
+SAMPLE_SORT_KEYS = {
+    "cumtime": "total",
+    "tottime": "self",
+    "ncalls": "total",
+    "name": "name",
+}
+
+TABLE_SCRIPT = """
+<script>
+(function () {
+  const table = document.currentScript.previousElementSibling;
+  table.querySelectorAll("th").forEach((th, column) => {
+    th.style.cursor = "pointer";
+    th.addEventListener("click", () => {
+      const rows = Array.from(table.tBodies[0].rows);
+      const value = (row) => {
+        const text = row.cells[column].textContent;
+        const number = parseFloat(text);
+        return isNaN(number) ? text : -number;
+      };
+      rows.sort((a, b) => (value(a) > value(b) ? 1 : -1));
+      rows.forEach((row) => table.tBodies[0].appendChild(row));
+    });
+  });
+})();
+</script>
+"""
+
+
+class OpStats:
+    """Time of bpy.ops calls by operator"""
+
+    def __init__(self):
+        self.ops = {}
+
+    def add(self, idname, elapsed, depsgraph, overrides):
+        op = self.ops.setdefault(
+            idname,
+            {"calls": 0, "time": 0.0, "depsgraph": 0.0, "overrides": set()},
+        )
+        op["calls"] += 1
+        op["time"] += elapsed
+        op["depsgraph"] += depsgraph
+        op["overrides"].update(overrides)
+
+    def rows(self):
+        rows = [
+            {
+                "operator": f"bpy.ops.{name}",
+                "calls": op["calls"],
+                "time": op["time"],
+                "depsgraph": op["depsgraph"],
+                "overrides": ", ".join(sorted(op["overrides"])),
+            }
+            for name, op in self.ops.items()
+        ]
+        return sorted(rows, key=lambda row: -row["time"])
+
+
+def describe_overrides(args):
+    """Context override keys and execution context of an operator call"""
+    result = []
+    for arg in args:
+        if isinstance(arg, dict):
+            result += sorted(arg)
+        elif isinstance(arg, str):
+            result.append(arg)
+    try:
+        import bpy
+
+        area = bpy.context.area
+    except (ImportError, AttributeError):
+        area = None
+    if area is not None:
+        result.append(f"area={area.type}")
+    return result
+
+
+@contextlib.contextmanager
+def trace_ops(stats):
+    """Record the calls of bpy.ops and the depsgraph updates during them"""
+    import bpy
+    from bpy.ops import _BPyOpsSubModOp
+
+    original = _BPyOpsSubModOp.__call__
+    depsgraph = {"total": 0.0, "start": None}
+
+    def depsgraph_pre(*args):
+        depsgraph["start"] = time.perf_counter()
+
+    def depsgraph_post(*args):
+        if depsgraph["start"] is not None:
+            depsgraph["total"] += time.perf_counter() - depsgraph["start"]
+            depsgraph["start"] = None
+
+    def call_op(op, *args, **kwargs):
+        idname = op.idname_py()
+        overrides = describe_overrides(args)
+        depsgraph_before = depsgraph["total"]
+        start = time.perf_counter()
+        try:
+            return original(op, *args, **kwargs)
+        finally:
+            stats.add(
+                idname,
+                time.perf_counter() - start,
+                depsgraph["total"] - depsgraph_before,
+                overrides,
+            )
+
+    handlers = bpy.app.handlers
+    _BPyOpsSubModOp.__call__ = call_op
+    handlers.depsgraph_update_pre.append(depsgraph_pre)
+    handlers.depsgraph_update_post.append(depsgraph_post)
+    try:
+        yield
+    finally:
+        _BPyOpsSubModOp.__call__ = original
+        handlers.depsgraph_update_pre.remove(depsgraph_pre)
+        handlers.depsgraph_update_post.remove(depsgraph_post)
+
+
+def frame_label(frame):
+    code = frame.f_code
+    if code.co_name == "call_op" and "idname" in frame.f_locals:
+        return f"bpy.ops.{frame.f_locals['idname']}"
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(
+        ";", ":"
+    )
+
+
+class Sampler:
+    """Sample the stacks of a thread below a root function"""
+
+    def __init__(self, root_code, interval=SAMPLE_INTERVAL, thread_id=None):
+        self.root_code = root_code
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame.f_code is not self.root_code:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            if frame is not None and stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def rows(self):
+        """Self and total samples of functions"""
+        functions = {}
+        for stack, count in self.stacks.items():
+            for name in set(stack):
+                row = functions.setdefault(
+                    name, {"name": name, "self": 0, "total": 0}
+                )
+                row["total"] += count
+            functions[stack[-1]]["self"] += count
+        return sorted(functions.values(), key=lambda row: -row["total"])
+
+    def write_folded(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(";".join(stack) + f" {count}\n")
+
+
+def pstats_rows(stats):
+    rows = []
+    for (filename, lineno, name), values in stats.stats.items():
+        _, ncalls, tottime, cumtime, _ = values
+        if filename == "~":
+            # Built-in functions
+            label = name
+        else:
+            label = f"{name} ({os.path.basename(filename)}:{lineno})"
+        rows.append(
+            {
+                "name": label,
+                "ncalls": ncalls,
+                "tottime": tottime,
+                "cumtime": cumtime,
+            }
+        )
+    return rows
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return f"{value:.4f}"
+    return str(value)
+
+
+def format_text(rows):
+    if not rows:
+        return ""
+    columns = list(rows[0])
+    cells = [[format_value(row[c]) for c in columns] for row in rows]
+    widths = [
+        max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)
+    ]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(columns, widths))]
+    for row in cells:
+        lines.append("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+    return "\n".join(lines)
+
+
+def format_html(rows):
+    if not rows:
+        return ""
+    columns = list(rows[0])
+    header = "".join(f"<th>{html.escape(c)}</th>" for c in columns)
+    body = "".join(
+        "<tr>"
+        + "".join(
+            f"<td>{html.escape(format_value(row[c]))}</td>" for c in columns
+        )
+        + "</tr>"
+        for row in rows
+    )
+    table = (
+        f"<table><thead><tr>{header}</tr></thead>"
+        f"<tbody>{body}</tbody></table>"
+    )
+    return table + TABLE_SCRIPT
+
+
+class ProfileResult:
+    """Tables of a profiled cell"""
+
+    def __init__(self, elapsed, ops, functions, folded_path=None, stats=None):
+        self.elapsed = elapsed
+        self.ops = ops
+        self.functions = functions
+        self.folded_path = folded_path
+        # pstats.Stats of cProfile
+        self.stats = stats
+
+    def _summary(self):
+        text = f"Wall time: {self.elapsed:.3f} s"
+        if self.folded_path is not None:
+            text += f", flamegraph stacks: {self.folded_path}"
+        return text
+
+    def __repr__(self):
+        parts = [self._summary()]
+        if self.ops:
+            parts.append(format_text(self.ops))
+        parts.append(format_text(self.functions))
+        return "\n\n".join(parts)
+
+    def _repr_html_(self):
+        parts = [f"<p>{html.escape(self._summary())}</p>"]
+        if self.ops:
+            parts.append(format_html(self.ops))
+        parts.append(format_html(self.functions))
+        return "\n".join(parts)
+
+
+def _run(code, namespace):
+    # Root frame of the sampled stacks
+    exec(code, namespace)  # noqa: S102
+
+
+def profile(
+    code,
+    namespace,
+    mode="cprofile",
+    sort="cumtime",
+    limit=30,
+    folded_path=None,
+    interval=SAMPLE_INTERVAL,
+    trace=True,
+):
+    """Profile code, return a ProfileResult
+
+    The stacks are sampled in sample mode or when folded_path is given.
+    trace records the calls of bpy.ops (requires bpy).
+    """
+    code = compile(code, "<bl_prof>", "exec")
+    ops = OpStats()
+    profiler = cProfile.Profile() if mode == "cprofile" else None
+    context = trace_ops(ops) if trace else contextlib.nullcontext()
+    sampler = None
+    if profiler is None or folded_path is not None:
+        sampler = Sampler(_run.__code__, interval)
+    start = time.perf_counter()
+    with context, sampler or contextlib.nullcontext():
+        if profiler is not None:
+            profiler.runcall(_run, code, namespace)
+        else:
+            _run(code, namespace)
+    elapsed = time.perf_counter() - start
+
+    if folded_path is not None:
+        sampler.write_folded(folded_path)
+    stats = None
+    if sort not in SORT_KEYS:
+        sort = "cumtime"
+    if profiler is not None:
+        stats = pstats.Stats(profiler)
+        functions = pstats_rows(stats)
+        key = sort
+    else:
+        functions = sampler.rows()
+        key = SAMPLE_SORT_KEYS[sort]
+    functions.sort(key=lambda row: row[key], reverse=sort != "name")
+    return ProfileResult(
+        elapsed, ops.rows(), functions[:limit], folded_path, stats
+    )
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog="%bl_prof", add_help=False)
+    parser.add_argument("-m", "--mode", choices=["cprofile", "sample"])
+    parser.add_argument("-s", "--sort", choices=SORT_KEYS, default="cumtime")
+    parser.add_argument("-n", "--limit", type=int, default=30)
+    parser.add_argument("-f", "--folded", help="Output file of the stacks")
+    parser.add_argument("-i", "--interval", type=float)
+    return parser
+
+
+def split_options(line):
+    """Split the leading options of a line magic from the statement"""
+    options = []
+    rest = line.strip()
+    while rest.startswith("-"):
+        parts = rest.split(None, 2)
+        options += parts[:2]
+        rest = parts[2] if len(parts) > 2 else ""
+    return options, rest
+
+
+def register(shell, log_dir=None):
+    """Register %bl_prof and %%bl_prof
+
+    In sample mode, the stacks are written to log_dir unless -f is given.
+    """
+
+    def bl_prof(line, cell=None):
+        """Profile a statement or a cell, see bl_prof.py"""
+        options, statement = split_options(line)
+        parser = make_parser()
+        try:
+            args = parser.parse_args(options)
+        except SystemExit:
+            return None
+        code = cell if cell is not None else statement
+        mode = args.mode or "cprofile"
+        folded = args.folded
+        if folded is None and mode == "sample" and log_dir is not None:
+            folded = Path(log_dir) / f"cell-{shell.execution_count}.folded"
+        return profile(
+            shell.transform_cell(code),
+            shell.user_ns,
+            mode=mode,
+            sort=args.sort,
+            limit=args.limit,
+            folded_path=folded,
+            interval=args.interval or SAMPLE_INTERVAL,
+        )
+
+    shell.register_magic_function(bl_prof, "line_cell", "bl_prof")
@@ -0,0 +1,190 @@
+"""
+Progressive renders in the blender kernel.
+
+Cycles renders block blender until they finish, and render results have no
+pixels in python until then. render_progressive() splits the samples into
+chunks with different seeds, renders them one by one and shows the running
+mean in the cell, which converges to the render with all samples:
+
+    from bl_render import render_progressive
+
+    pixels = await render_progressive(samples=256)
+
+Between chunks the coroutine yields to the kernel loop, so blender's UI and
+the kernel (e.g., interrupts) keep responding. The chunks keep the render
+data (BVH etc.) with use_persistent_data, and the mean is denoised at the
+end if denoising is enabled in the scene.
+"""
+
+import time
+
+import bpy
+from bl_display import (
+    VIEWER_IMAGE_NAME,
+    ImageDisplay,
+    render_to_array,
+    viewer_node,
+)
+from bl_image import PREVIEW_SIZE
+from bl_numpy import to_numpy
+from bl_scheduler import bl_yield
+
+# Seconds each chunk should take
+CHUNK_TIME = 0.5
+# Minimum seconds between preview updates
+PREVIEW_INTERVAL = 0.5
+# Smallest longest side of previews in pixels
+MIN_PREVIEW_SIZE = 128
+
+
+class PreviewThrottle:
+    """Throttle updates of an ImageDisplay
+
+    The interval between updates and the preview size adapt to the time it
+    takes to encode and send an update, so that previews do not flood the
+    kernel's iopub channel.
+    """
+
+    def __init__(self, output, interval=PREVIEW_INTERVAL):
+        self.output = output
+        self.min_interval = interval
+        self.interval = interval
+        self.max_size = output.max_size
+        self.last = 0.0
+        self.updates = 0
+
+    def push(self, pixels, force=False):
+        """Update the output if the interval has passed"""
+        start = time.perf_counter()
+        if not force and start - self.last < self.interval:
+            return False
+        self.output.update(pixels)
+        cost = time.perf_counter() - start
+        self.last = time.perf_counter()
+        self.updates += 1
+
+        # Spend at most a quarter of the time on previews
+        self.interval = max(self.min_interval, 4.0 * cost)
+        size = self.output.max_size
+        if size and cost > 0.25 * self.min_interval:
+            self.output.max_size = max(MIN_PREVIEW_SIZE, size // 2)
+        elif size and cost < 0.05 * self.min_interval:
+            if self.max_size is None or size < self.max_size:
+                self.output.max_size = size * 2
+        return True
+
+
+def denoise(scene, pixels):
+    """Denoise linear pixels with the Denoise node of the compositor
+
+    The compositor only runs in a render, so the scene is rendered with one
+    sample while the viewer node shows the denoised pixels.
+    """
+    height, width = pixels.shape[:2]
+    image = bpy.data.images.new(
+        "bl_render-denoise", width, height, alpha=True, float_buffer=True
+    )
+    image.pixels.foreach_set(pixels.ravel())
+    image.update()
+    cycles = scene.cycles
+    saved = cycles.samples, cycles.use_denoising
+    try:
+        with viewer_node(scene) as viewer:
+            tree = scene.node_tree
+            links = [x.from_socket for x in viewer.inputs["Image"].links]
+            source = tree.nodes.new("CompositorNodeImage")
+            source.image = image
+            node = tree.nodes.new("CompositorNodeDenoise")
+            try:
+                tree.links.new(source.outputs["Image"], node.inputs["Image"])
+                tree.links.new(node.outputs["Image"], viewer.inputs["Image"])
+                cycles.samples = 1
+                cycles.use_denoising = False
+                bpy.ops.render.render(scene=scene.name)
+                return to_numpy(bpy.data.images[VIEWER_IMAGE_NAME])
+            finally:
+                tree.nodes.remove(node)
+                tree.nodes.remove(source)
+                for socket in links:
+                    tree.links.new(socket, viewer.inputs["Image"])
+    finally:
+        cycles.samples, cycles.use_denoising = saved
+        bpy.data.images.remove(image)
+
+
+async def render_progressive(
+    scene=None,
+    samples=None,
+    chunk_time=CHUNK_TIME,
+    max_size=PREVIEW_SIZE,
+    interval=PREVIEW_INTERVAL,
+    output=None,
+):
+    """Render a still with previews, return the pixels
+
+    samples defaults to the samples of the scene. The chunk size follows
+    the measured time per sample, aiming at chunk_time seconds per chunk.
+    The previews are not denoised; the result is if denoising is enabled.
+    Engines other than Cycles are rendered at once.
+    Returns linear (height, width, 4) float32 pixels.
+    """
+    if scene is None:
+        scene = bpy.context.scene
+    if output is None:
+        output = ImageDisplay(max_size=max_size)
+    throttle = PreviewThrottle(output, interval=interval)
+
+    if scene.render.engine != "CYCLES":
+        pixels = render_to_array(scene)
+        throttle.push(pixels, force=True)
+        return pixels
+
+    cycles = scene.cycles
+    total = samples or cycles.samples
+    saved = {
+        name: getattr(cycles, name)
+        for name in ("samples", "seed", "use_denoising", "use_animated_seed")
+    }
+    persistent = scene.render.use_persistent_data
+
+    accumulated = None
+    done = 0
+    chunk = 1
+    try:
+        # Sync the scene and build the BVH once for all chunks
+        scene.render.use_persistent_data = True
+        cycles.use_denoising = False
+        cycles.use_animated_seed = False
+        # Keep the viewer node of render_to_array() for all chunks
+        with viewer_node(scene):
+            while done < total:
+                count = min(chunk, total - done)
+                cycles.samples = count
+                # Independent noise in each chunk
+                cycles.seed = saved["seed"] + done
+
+                start = time.perf_counter()
+                pixels = render_to_array(scene)
+                elapsed = time.perf_counter() - start
+
+                if accumulated is None:
+                    accumulated = pixels * count
+                else:
+                    accumulated += pixels * count
+                done += count
+
+                if done < total:
+                    throttle.push(accumulated / done)
+                chunk = max(1, int(count * chunk_time / max(elapsed, 1e-3)))
+                await bl_yield()
+
+            pixels = accumulated / done
+            if saved["use_denoising"]:
+                pixels = denoise(scene, pixels)
+        throttle.push(pixels, force=True)
+    finally:
+        for name, value in saved.items():
+            setattr(cycles, name, value)
+        scene.render.use_persistent_data = persistent
+
+    return pixels
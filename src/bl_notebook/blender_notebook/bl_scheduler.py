@@ -0,0 +1,105 @@
+"""
+Cooperative scheduling of long-running cells in the blender kernel.
+
+The kernel loop (see JupyterKernelLoop in kernel.py) runs the asyncio event
+loop in slices of blender ticks. Coroutines yield back to blender with
+bl_yield() when the slice is used up.
+"""
+
+import asyncio
+import time
+
+
+class FrameScheduler:
+    """Hands out slices of blender ticks to coroutines
+
+    Long-running async cells call bl_yield() to give control back to
+    blender when the slice of the current tick is used up. Interrupt
+    requests from jupyter take effect at those yield points.
+    """
+
+    def __init__(self):
+        self.deadline = 0.0
+        self.slice_end = 0.0
+        self.interrupted = False
+        self.loop = None
+        self._waiters = []
+
+    def get_budget(self, config):
+        """Time budget of the next slice"""
+        # Leave the rest of the frame to the UI, measured by the time since
+        # the previous slice ended.
+        frame = 1.0 / config["target_fps"]
+        ui_time = time.perf_counter() - self.slice_end
+        budget = min(config["budget"], frame - ui_time)
+        return max(budget, config["min_budget"])
+
+    def begin_slice(self, budget):
+        self.deadline = time.perf_counter() + budget
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def end_slice(self):
+        self.deadline = 0.0
+        self.slice_end = time.perf_counter()
+
+    def interrupt(self):
+        """Request an interrupt, called from the control thread"""
+        self.interrupted = True
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._interrupt_waiters)
+
+    def _interrupt_waiters(self):
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_exception(KeyboardInterrupt())
+
+    def reset(self):
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            waiter.cancel()
+        self.interrupted = False
+
+    def check_interrupt(self):
+        if self.interrupted:
+            self.interrupted = False
+            raise KeyboardInterrupt()
+
+    async def yield_(self):
+        self.check_interrupt()
+        if time.perf_counter() < self.deadline:
+            return
+        self.loop = asyncio.get_event_loop()
+        waiter = self.loop.create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except KeyboardInterrupt:
+            self.interrupted = False
+            raise
+        self.check_interrupt()
+
+
+scheduler = FrameScheduler()
+
+
+async def bl_yield():
+    """Yield to blender if the time slice of the current tick is used up
+
+    Use in long loops of async cells to keep blender's UI responsive:
+
+        for obj in bpy.data.objects:
+            ...
+            await bl_yield()
+    """
+    await scheduler.yield_()
+
+
+async def bl_iter(iterable):
+    """Iterate over iterable, yielding to blender between items"""
+    for item in iterable:
+        yield item
+        await scheduler.yield_()
@@ -0,0 +1,300 @@
+"""
+Shared-memory arrays between blender kernels and other processes.
+
+Arrays are .npy files in /dev/shm (the temporary directory where there is
+no /dev/shm) mapped into memory, so attaching an array does not copy it.
+The module does not depend on bpy and is importable both in the blender
+kernel and in host python:
+
+    # blender kernel
+    from bl_shared import create
+    shared = create("points", (n, 3), "float32")
+    to_numpy(obj, "vertices", out=shared.array)
+
+    # host python
+    from bl_notebook.blender_notebook.bl_shared import attach
+    with attach("points") as shared:
+        simulate(shared.array)
+
+Lifetimes are explicit. An array is removed by unlink(), by its owner when
+the owner closes it or exits (unless persistent), or by cleanup() when its
+ttl has expired or its owner died.
+
+Each array is written to a new data file, <name>.<id>.npy, and published by
+renaming its <name>.json into place, so files which others have mapped are
+never replaced. Removing a mapped file fails on windows; such files are
+removed by a later cleanup().
+"""
+
+import atexit
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+SHM_DIR_NAME = "bl_notebook-shm"
+NAME_RE = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+# Seconds before cleanup() removes data files no array refers to
+ORPHAN_GRACE = 60.0
+# Attempts to publish or attach while another process replaces the array
+RETRIES = 5
+
+# Arrays created by this process, unlinked at exit
+_owned = {}
+
+
+def get_root():
+    """Directory of the shared arrays"""
+    root = os.environ.get("BL_NOTEBOOK_SHM_DIR")
+    if root is None:
+        base = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        root = Path(base or tempfile.gettempdir()) / SHM_DIR_NAME
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    return root
+
+
+def _check_name(name):
+    if not NAME_RE.match(name):
+        raise ValueError(f"Invalid shared array name: {name!r}")
+
+
+def _info_path(name):
+    _check_name(name)
+    return get_root() / f"{name}.json"
+
+
+def _remove(path):
+    """Remove a file, return False if it is in use (windows)"""
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+    except PermissionError:
+        return False
+    return True
+
+
+def _publish(temp_path, path, overwrite):
+    """Move a file into place, failing if it exists unless overwrite"""
+    if not overwrite:
+        # Fails atomically if another process created it first
+        try:
+            os.link(temp_path, path)
+        finally:
+            os.unlink(temp_path)
+        return
+    for attempt in range(RETRIES):
+        try:
+            os.replace(temp_path, path)
+            return
+        except PermissionError:
+            # Being read by another process (windows)
+            if attempt == RETRIES - 1:
+                os.unlink(temp_path)
+                raise
+            time.sleep(0.01 * 2**attempt)
+
+
+def _is_alive(pid):
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedArray:
+    """A numpy array mapped from shared memory"""
+
+    def __init__(self, name, array, owner=False, filename=None):
+        self.name = name
+        self.array = array
+        self.owner = owner
+        # Data file of this array, the name may be published again
+        self.filename = filename
+
+    def close(self):
+        """Unmap the array, and unlink it if this process owns it
+
+        Persistent arrays and arrays published again under the name are
+        kept.
+        """
+        self.array = None
+        if self.owner:
+            if _owned.get(self.name) is self:
+                del _owned[self.name]
+            info = get_info(self.name)
+            if (
+                info is not None
+                and info.get("file") == self.filename
+                and not info.get("persistent")
+            ):
+                unlink(self.name)
+            self.owner = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        if self.array is None:
+            return f"<SharedArray {self.name!r} (closed)>"
+        return (
+            f"<SharedArray {self.name!r}"
+            f" {self.array.dtype}{list(self.array.shape)}>"
+        )
+
+
+def create(
+    name, shape, dtype=np.float32, ttl=None, persistent=False, overwrite=False
+):
+    """Create a shared array, return the owned SharedArray
+
+    Write into SharedArray.array directly to avoid copies. ttl is the
+    lifetime in seconds after which cleanup() removes the array.
+    """
+    info_path = _info_path(name)
+    if info_path.exists() and not overwrite:
+        raise FileExistsError(f"Shared array exists: {name}")
+    previous = get_info(name)
+
+    # A new file, so that mappings of the previous array stay valid
+    filename = f"{name}.{uuid.uuid4().hex}.npy"
+    array = np.lib.format.open_memmap(
+        info_path.with_name(filename),
+        mode="w+",
+        dtype=dtype,
+        shape=tuple(shape),
+    )
+    info = {
+        "pid": os.getpid(),
+        "created": time.time(),
+        "ttl": ttl,
+        "persistent": persistent,
+        "shape": list(array.shape),
+        "dtype": array.dtype.str,
+        "file": filename,
+    }
+    temp_path = info_path.with_name(f".{name}.{uuid.uuid4().hex}.json")
+    with open(temp_path, "w") as fh:
+        json.dump(info, fh)
+    try:
+        _publish(temp_path, info_path, overwrite)
+    except OSError as exc:
+        array = None
+        _remove(info_path.with_name(filename))
+        if isinstance(exc, FileExistsError):
+            raise FileExistsError(f"Shared array exists: {name}")
+        raise
+    if previous is not None and previous.get("file"):
+        _remove(info_path.with_name(previous["file"]))
+
+    shared = SharedArray(name, array, owner=True, filename=filename)
+    if not persistent:
+        _owned[name] = shared
+    return shared
+
+
+def publish(name, array, **kwargs):
+    """Copy an array into a new shared array, see create()"""
+    array = np.asarray(array)
+    shared = create(name, array.shape, array.dtype, **kwargs)
+    shared.array[...] = array
+    return shared
+
+
+def attach(name, writable=False):
+    """Map an existing shared array without copying it"""
+    info_path = _info_path(name)
+    for attempt in range(RETRIES):
+        info = get_info(name)
+        if info is None:
+            raise FileNotFoundError(f"No shared array: {name}")
+        try:
+            array = np.load(
+                info_path.with_name(info["file"]),
+                mmap_mode="r+" if writable else "r",
+            )
+        except FileNotFoundError:
+            # Replaced by another process meanwhile
+            if attempt == RETRIES - 1:
+                raise
+            continue
+        return SharedArray(name, array, filename=info["file"])
+
+
+def unlink(name):
+    """Remove a shared array
+
+    Processes which attached it keep their mapping until they close it.
+    """
+    info = get_info(name)
+    info_path = _info_path(name)
+    _remove(info_path)
+    if info is not None and info.get("file"):
+        _remove(info_path.with_name(info["file"]))
+
+
+def get_info(name):
+    info_path = _info_path(name)
+    try:
+        with open(info_path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def list_arrays():
+    """Return the registry of shared arrays, {name: info}"""
+    result = {}
+    for path in sorted(get_root().glob("*.json")):
+        if path.name.startswith("."):
+            continue
+        result[path.stem] = get_info(path.stem)
+    return result
+
+
+def cleanup():
+    """Remove expired arrays and arrays of dead owners, return the names"""
+    removed = []
+    now = time.time()
+    for name, info in list_arrays().items():
+        if info is None:
+            continue
+        ttl = info.get("ttl")
+        expired = ttl is not None and now > info["created"] + ttl
+        orphaned = not info.get("persistent") and not _is_alive(info["pid"])
+        if expired or orphaned:
+            unlink(name)
+            removed.append(name)
+
+    # Data files of replaced or removed arrays which were in use
+    used = {x["file"] for x in list_arrays().values() if x and "file" in x}
+    for path in get_root().glob("*.npy"):
+        if path.name in used:
+            continue
+        try:
+            if now - path.stat().st_mtime > ORPHAN_GRACE:
+                _remove(path)
+        except OSError:
+            pass
+    return removed
+
+
+@atexit.register
+def _unlink_owned():
+    for shared in list(_owned.values()):
+        shared.close()
@@ -0,0 +1,234 @@
+"""
+Two-way binding of bpy properties and ipywidgets in the blender kernel.
+
+Each widget change arrives as a comm message. Instead of applying and
+redrawing for each of them, changes are coalesced within a frame and
+applied in one batch, then only the bound values which changed (e.g.,
+dependent values updated by drivers) are sent back:
+
+    from bl_sync import PropertySync
+
+    sync = PropertySync(coalesce=1 / 30)
+    sync.bind(bpy.data.objects["Cube"], "location", index=2)
+    sync.bind(bpy.data.objects["Cube"], "scale")
+    sync.bind(bpy.data.objects["Cube"], "modifiers['Subdivision'].levels")
+    sync.show()
+    sync.stats()
+"""
+
+import asyncio
+import math
+import statistics
+import time
+from collections import deque
+
+import bpy
+import ipywidgets
+from IPython.display import display
+
+# Seconds to collect changes after the first one before applying them
+COALESCE = 1.0 / 30.0
+# Seconds without changes before applying them
+DEBOUNCE = 0.0
+# Number of latency samples kept for stats()
+STATS_SIZE = 1000
+# Tolerance of float values, widgets hold float64 and properties float32
+FLOAT_TOLERANCE = 1e-6
+
+
+def resolve(owner, path):
+    """Split a data path into the owner of the last property and its name"""
+    prefix, sep, name = path.rpartition(".")
+    if sep:
+        owner = owner.path_resolve(prefix)
+    return owner, name
+
+
+def array_length(owner, name):
+    """Number of items of a vector property, 0 for other properties"""
+    prop = owner.bl_rna.properties[name]
+    if not getattr(prop, "is_array", False):
+        return 0
+    return prop.array_length
+
+
+def differs(a, b):
+    """Whether a widget value and a property value differ"""
+    if isinstance(a, float) or isinstance(b, float):
+        try:
+            return not math.isclose(
+                a, b, rel_tol=FLOAT_TOLERANCE, abs_tol=FLOAT_TOLERANCE
+            )
+        except TypeError:
+            pass
+    return a != b
+
+
+def make_widget(owner, name, index=None):
+    """Make a widget suited to an RNA property"""
+    prop = owner.bl_rna.properties[name]
+    description = prop.name if index is None else f"{prop.name}[{index}]"
+    kwargs = {"description": description}
+    if prop.type == "FLOAT":
+        step = prop.step / 100
+        return ipywidgets.FloatSlider(
+            min=prop.soft_min, max=prop.soft_max, step=step, **kwargs
+        )
+    if prop.type == "INT":
+        return ipywidgets.IntSlider(
+            min=prop.soft_min, max=prop.soft_max, **kwargs
+        )
+    if prop.type == "BOOLEAN":
+        return ipywidgets.Checkbox(**kwargs)
+    if prop.type == "ENUM":
+        options = [item.identifier for item in prop.enum_items]
+        return ipywidgets.Dropdown(options=options, **kwargs)
+    return ipywidgets.Text(**kwargs)
+
+
+class Binding:
+    def __init__(self, owner, path, widget, index=None):
+        self.owner, self.name = resolve(owner, path)
+        self.path = path
+        self.widget = widget
+        self.index = index
+
+    def get(self):
+        value = getattr(self.owner, self.name)
+        if self.index is not None:
+            value = value[self.index]
+        return value
+
+    def set(self, value):  # noqa: A003
+        if self.index is None:
+            setattr(self.owner, self.name, value)
+        else:
+            getattr(self.owner, self.name)[self.index] = value
+
+
+class PropertySync:
+    """Bindings of bpy properties and widgets with batched updates
+
+    Changes from widgets are applied when coalesce seconds have passed
+    since the first pending change and debounce seconds since the last one.
+    """
+
+    def __init__(self, coalesce=COALESCE, debounce=DEBOUNCE):
+        self.coalesce = coalesce
+        self.debounce = debounce
+        self.bindings = []
+        self.widgets = []
+        self.pending = {}
+        self._first = None
+        self._last = None
+        self._handle = None
+        self._updating = False
+        self._changes = 0
+        self._batches = 0
+        self._latencies = deque(maxlen=STATS_SIZE)
+
+    def bind(self, owner, path, index=None, widget=None):
+        """Bind a property of owner (e.g., an object) to a widget
+
+        path is a data path relative to owner. index selects an item of
+        vector properties; without it, vector properties get a widget per
+        item in an HBox. Returns the widget.
+        """
+        if index is None and widget is None:
+            length = array_length(*resolve(owner, path))
+            if length:
+                box = ipywidgets.HBox(
+                    [self._bind(owner, path, i) for i in range(length)]
+                )
+                self.widgets.append(box)
+                return box
+        widget = self._bind(owner, path, index, widget)
+        self.widgets.append(widget)
+        return widget
+
+    def _bind(self, owner, path, index=None, widget=None):
+        binding = Binding(owner, path, widget, index=index)
+        if widget is None:
+            binding.widget = make_widget(binding.owner, binding.name, index)
+        binding.widget.value = binding.get()
+        binding.widget.observe(
+            lambda change: self._on_change(binding, change["new"]),
+            names="value",
+        )
+        self.bindings.append(binding)
+        return binding.widget
+
+    def show(self):
+        display(ipywidgets.VBox(self.widgets))
+
+    def _on_change(self, binding, value):
+        if self._updating:
+            # Our own update of the widget
+            return
+        now = time.perf_counter()
+        self.pending[id(binding)] = (binding, value)
+        self._changes += 1
+        if self._first is None:
+            self._first = now
+        self._last = now
+        self._schedule()
+
+    def _schedule(self):
+        flush_at = max(self._first + self.coalesce, self._last + self.debounce)
+        if self._handle is not None:
+            self._handle.cancel()
+        loop = asyncio.get_event_loop()
+        delay = max(0.0, flush_at - time.perf_counter())
+        self._handle = loop.call_later(delay, self.flush)
+
+    def flush(self):
+        """Apply the pending changes in one batch and send back changes"""
+        self._handle = None
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        first, self._first = self._first, None
+
+        for binding, value in pending.values():
+            try:
+                binding.set(value)
+            except (AttributeError, TypeError, ValueError) as exc:
+                print(f"Can not set {binding.path}: {exc}")
+        bpy.context.view_layer.update()
+        self._batches += 1
+
+        self.refresh()
+        self._tag_redraw()
+        self._latencies.append(time.perf_counter() - first)
+
+    def refresh(self):
+        """Send the bound values which differ from the widgets"""
+        self._updating = True
+        try:
+            for binding in self.bindings:
+                value = binding.get()
+                if differs(binding.widget.value, value):
+                    binding.widget.value = value
+        finally:
+            self._updating = False
+
+    @staticmethod
+    def _tag_redraw():
+        wm = bpy.context.window_manager
+        if wm is None:
+            return
+        for window in wm.windows:
+            for area in window.screen.areas:
+                area.tag_redraw()
+
+    def stats(self):
+        """Latency from the first change of a batch to applying it (ms)"""
+        latencies = sorted(x * 1000 for x in self._latencies)
+        result = {"changes": self._changes, "batches": self._batches}
+        if latencies:
+            result.update(
+                mean=statistics.mean(latencies),
+                p95=latencies[int(len(latencies) * 0.95)],
+                max=latencies[-1],
+            )
+        return result
@@ -0,0 +1,138 @@
+"""
+Thread budgets and CPU sets of blender processes.
+
+Each blender process assumes it has the whole machine: blender's threads,
+OpenMP and the BLAS of numpy oversubscribe the CPUs when several kernels or
+renders run on one host. A budget is a number of threads and a set of CPUs.
+Blender gets --threads, OpenMP and BLAS get their environment variables and
+the process is pinned to the CPUs (linux only).
+
+"auto" divides the CPUs among the running blender processes in the usage
+log (see bl_usage.py), preferring the CPUs least used by them.
+
+The module only depends on the standard library, so that the kernel
+launcher can import it.
+"""
+
+import collections
+import os
+
+THREAD_ENV_VARS = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+]
+
+AUTO = "auto"
+
+
+def parse_cpus(spec):
+    """Parse a CPU list such as "0-3,8" into a sorted list"""
+    cpus = set()
+    for part in str(spec).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition("-")
+        if sep:
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(first))
+    return sorted(cpus)
+
+
+def format_cpus(cpus):
+    """Format CPUs as a list of ranges, the reverse of parse_cpus()"""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(
+        str(first) if first == last else f"{first}-{last}"
+        for first, last in ranges
+    )
+
+
+def get_cpus():
+    """CPUs this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def auto_cpus(cpus, records):
+    """Share of the CPUs for a new process next to the running ones
+
+    records are the usage records of the running processes.
+    """
+    load = collections.Counter({cpu: 0 for cpu in cpus})
+    for record in records:
+        for cpu in record.get("cpus") or cpus:
+            if cpu in load:
+                load[cpu] += 1
+    count = max(1, len(cpus) // (len(records) + 1))
+    least_used = sorted(cpus, key=lambda cpu: (load[cpu], cpu))
+    return sorted(least_used[:count])
+
+
+class Budget(collections.namedtuple("Budget", ["threads", "cpus"])):
+    """Threads and CPUs of a process, see run_command() in util.py"""
+
+    __slots__ = ()
+
+    def env(self):
+        """Environment variables limiting OpenMP and BLAS threads"""
+        return thread_env(self.threads)
+
+    def preexec(self):
+        """Pin the process to the CPUs, called in the child before exec"""
+        set_affinity(self.cpus)
+
+
+def get_budget(threads=0, cpus=None, records=()):
+    """Return the Budget (threads, cpus) of a new blender process
+
+    threads is a number (0 for the number of CPUs) or "auto". cpus is a CPU
+    list, "auto" or None (not pinned). cpus of the result is None when the
+    process is not pinned, and threads is 0 when it is not limited.
+    """
+    available = get_cpus()
+    if AUTO in (str(threads), str(cpus)):
+        selected = auto_cpus(available, records)
+    elif cpus:
+        selected = [x for x in parse_cpus(cpus) if x in available]
+        if not selected:
+            raise ValueError(f"No CPUs available in {cpus!r}")
+    else:
+        selected = None
+
+    if str(threads) != AUTO and int(threads) > 0:
+        threads = int(threads)
+    elif selected is not None:
+        threads = len(selected)
+    else:
+        threads = 0
+    return Budget(threads, selected)
+
+
+def blender_args(threads):
+    return ["--threads", str(threads)] if threads else []
+
+
+def thread_env(threads):
+    """Environment variables limiting OpenMP and BLAS threads"""
+    if not threads:
+        return {}
+    return {name: str(threads) for name in THREAD_ENV_VARS}
+
+
+def set_affinity(cpus, pid=0):
+    """Pin a process to CPUs, return False if not supported"""
+    if not cpus or not hasattr(os, "sched_setaffinity"):
+        return False
+    os.sched_setaffinity(pid, cpus)
+    return True
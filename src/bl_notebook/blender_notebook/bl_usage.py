@@ -0,0 +1,270 @@
+"""
+Resource accounting of blender sessions and kernels.
+
+Each blender process appends a record to a usage log (JSON lines) when it
+starts and when it exits, with the same id. The kernel records its own
+usage at exit, since the launcher execs blender. Sessions started by `bl`
+are measured by the command from the rusage of its children.
+
+The module does not depend on bpy and is importable both in the blender
+kernel and in host python.
+"""
+
+import collections
+import contextlib
+import getpass
+import json
+import os
+import sys
+import time
+import uuid
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+USAGE_LOG_NAME = "usage.jsonl"
+
+
+def _is_alive(pid):
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _maxrss_bytes(maxrss):
+    # Kilobytes except on macOS
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def rusage(who="self"):
+    """CPU time and peak RSS from getrusage, or None on windows"""
+    if resource is None:
+        return None
+    if who == "self":
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+    else:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "cpu_user": usage.ru_utime,
+        "cpu_system": usage.ru_stime,
+        "max_rss": _maxrss_bytes(usage.ru_maxrss),
+    }
+
+
+def proc_usage(pid):
+    """Current usage of a running process from /proc (linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as fh:
+            status = dict(
+                line.split(":", 1) for line in fh.read().splitlines()
+            )
+        with open(f"/proc/{pid}/stat") as fh:
+            # The command name may contain spaces
+            stat = fh.read().rpartition(")")[2].split()
+    except (OSError, ValueError):
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+
+    def kilobytes(name):
+        return int(status.get(name, "0 kB").split()[0]) * 1024
+
+    return {
+        "rss": kilobytes("VmRSS"),
+        "max_rss": kilobytes("VmHWM"),
+        "cpu_user": int(stat[11]) / ticks,
+        "cpu_system": int(stat[12]) / ticks,
+        "threads": int(status.get("Threads", "0")),
+    }
+
+
+def new_record(kind, **fields):
+    record = {
+        "id": uuid.uuid4().hex,
+        "kind": kind,
+        "pid": os.getpid(),
+        "user": getpass.getuser(),
+        "start": time.time(),
+        "end": None,
+    }
+    record.update(fields)
+    return record
+
+
+def append_record(path, record):
+    """Append a record to the usage log
+
+    A line is written by a single write to the file opened for appending, so
+    concurrent processes do not interleave their records.
+    """
+    line = json.dumps(record) + "\n"
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode("utf-8"))
+        finally:
+            os.close(fd)
+    except OSError as exc:
+        print(f"Can not write the usage log {path}: {exc}", file=sys.stderr)
+
+
+@contextlib.contextmanager
+def locked(path):
+    """Hold an exclusive lock of the usage log (not on windows)"""
+    if fcntl is None:
+        yield
+        return
+    path = os.fspath(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def reserve(path, get_budget, kind="blender", **fields):
+    """Choose the budget of a new process and record its start
+
+    get_budget(records) returns (threads, cpus) next to the running
+    records. Both are done under a lock, so that processes launched at the
+    same time see each other. Returns the budget and the record.
+    """
+    with locked(path):
+        budget = get_budget(running_records(read_records(path)))
+        threads, cpus = budget
+        record = new_record(kind, threads=threads, cpus=cpus, **fields)
+        append_record(path, record)
+    return budget, record
+
+
+def finish_record(path, record, exit_status, usage):
+    record = dict(record)
+    record["end"] = time.time()
+    record["wall"] = record["end"] - record["start"]
+    record["exit"] = exit_status
+    if usage is not None:
+        record.update(usage)
+    append_record(path, record)
+    return record
+
+
+def read_records(path):
+    """Return the latest record of each session
+
+    Sessions which have not ended and whose process is gone are marked
+    with exit "lost".
+    """
+    records = {}
+    try:
+        with open(path) as fh:
+            for line in fh:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record["id"]] = record
+    except FileNotFoundError:
+        return []
+    for record in records.values():
+        if record["end"] is None and not _is_alive(record["pid"]):
+            record["exit"] = "lost"
+    return list(records.values())
+
+
+def running_records(records):
+    return [x for x in records if x["end"] is None and x.get("exit") != "lost"]
+
+
+@contextlib.contextmanager
+def measure(path, kind="blender", record=None, **fields):
+    """Record the usage of the children started in the block
+
+    record is the start record written by reserve(), if any. The exit
+    status is the code of SystemExit (e.g., run_command with
+    fail_on_exit=True) or 0.
+    """
+    if record is None:
+        record = new_record(kind, **fields)
+        append_record(path, record)
+    before = rusage("children")
+    exit_status = 0
+    try:
+        yield record
+    except SystemExit as exc:
+        exit_status = exc.code
+        raise
+    except KeyboardInterrupt:
+        exit_status = "interrupted"
+        raise
+    finally:
+        usage = rusage("children")
+        if usage is not None:
+            usage["cpu_user"] -= before["cpu_user"]
+            usage["cpu_system"] -= before["cpu_system"]
+        finish_record(path, record, exit_status, usage)
+
+
+def summarize(records, key):
+    """Sum up the usage of the sessions grouped by a record key"""
+    groups = collections.OrderedDict()
+    for record in sorted(records, key=lambda x: str(x.get(key))):
+        group = groups.setdefault(
+            record.get(key) or "-",
+            {
+                key: record.get(key) or "-",
+                "sessions": 0,
+                "running": 0,
+                "failed": 0,
+                "wall_h": 0.0,
+                "cpu_h": 0.0,
+                "max_rss_mb": 0.0,
+            },
+        )
+        group["sessions"] += 1
+        if record["end"] is None and record.get("exit") != "lost":
+            group["running"] += 1
+            continue
+        if record.get("exit") not in (0, None):
+            group["failed"] += 1
+        group["wall_h"] += record.get("wall", 0.0) / 3600
+        cpu = record.get("cpu_user", 0.0) + record.get("cpu_system", 0.0)
+        group["cpu_h"] += cpu / 3600
+        group["max_rss_mb"] = max(
+            group["max_rss_mb"], record.get("max_rss", 0) / 2**20
+        )
+    return list(groups.values())
+
+
+def format_table(rows):
+    if not rows:
+        return ""
+
+    def format_value(value):
+        if isinstance(value, float):
+            return f"{value:.2f}"
+        return str(value)
+
+    columns = list(rows[0])
+    cells = [[format_value(row[c]) for c in columns] for row in rows]
+    widths = [
+        max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)
+    ]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(columns, widths))]
+    for row in cells:
+        lines.append("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+    return "\n".join(lines)
@@ -4,14 +4,157 @@ Blender kernel installer.
 Copy and modified from https://github.com/cheng-chi/blender_notebook.
 """
 
+import hashlib
+import importlib.util
 import json
 import pathlib
+import re
 import shutil
 import subprocess
 import sys
 import textwrap
 
 import click
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.version import InvalidVersion
+
+# Files copied to the kernel directory. Modules other than the kernel and the
+# launcher can be imported in the kernel.
+KERNEL_FILES = [
+    "kernel.py",
+    "kernel_launcher.py",
+    "bl_scheduler.py",
+    "bl_numpy.py",
+    "bl_image.py",
+    "bl_display.py",
+    "bl_render.py",
+    "bl_mesh.py",
+    "bl_geometry.py",
+    "bl_shared.py",
+    "bl_sync.py",
+    "bl_output.py",
+    "bl_prof.py",
+    "bl_usage.py",
+    "bl_threads.py",
+    "bl_checkpoint.py",
+]
+
+# Written after the kernelspec and the packages are installed
+FINGERPRINT_NAME = "fingerprint.json"
+
+
+def normalize_package_name(name):
+    """Name of a requirement as in the *.dist-info directory names"""
+    name = re.split(r"[\s<>=!~;\[@]", name.strip(), maxsplit=1)[0]
+    return re.sub(r"[-_.]+", "_", name).lower()
+
+
+def get_site_packages(python_exec):
+    """site-packages directories of blender's python"""
+    prefix = pathlib.Path(python_exec).parent.parent
+    result = []
+    for pattern in ("lib/site-packages", "lib/python3*/site-packages"):
+        result += sorted(prefix.glob(pattern))
+    return result
+
+
+def get_distributions(site_packages):
+    """Map normalized package names to their *.dist-info directories"""
+    result = {}
+    for entry in pathlib.Path(site_packages).glob("*.dist-info"):
+        name = entry.name[: -len(".dist-info")].partition("-")[0]
+        result[normalize_package_name(name)] = entry
+    return result
+
+
+def match_requirement(requirement, version):
+    """Check if an installed version satisfies a requirement string
+
+    Markers are not evaluated, they are for blender's python. Requirements
+    which can not be parsed never match, so pip decides about them.
+    """
+    try:
+        specifier = Requirement(requirement).specifier
+        return specifier.contains(version, prereleases=True)
+    except (InvalidRequirement, InvalidVersion):
+        return False
+
+
+def find_package_versions(python_exec, packages):
+    """Versions of packages in site-packages of a python
+
+    The version is None if a package is missing or its version does not
+    satisfy the version specifiers of the requirement (e.g.,
+    "ipykernel>=6.29"). Reads the *.dist-info directories instead of
+    running the python.
+    """
+    installed = {}
+    for site_packages in get_site_packages(python_exec):
+        for name, entry in get_distributions(site_packages).items():
+            version = entry.name[: -len(".dist-info")].partition("-")[2]
+            installed[name] = version
+    result = {}
+    for requirement in packages:
+        version = installed.get(normalize_package_name(requirement))
+        if version is not None and match_requirement(requirement, version):
+            result[requirement] = version
+        else:
+            result[requirement] = None
+    return result
+
+
+def get_fingerprint(blender_exec, python_exec, packages, options):
+    """Hash of everything a kernelspec is made from
+
+    Covers the kernel files, this installer, the blender and python
+    executables, the versions of the packages of blender's python and the
+    options of write_kernel().
+    """
+    digest = hashlib.sha256()
+    here = pathlib.Path(__file__).parent
+    for name in KERNEL_FILES + [pathlib.Path(__file__).name]:
+        digest.update(name.encode())
+        digest.update(here.joinpath(name).read_bytes())
+    for path in (blender_exec, python_exec):
+        stat = pathlib.Path(path).stat()
+        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    inputs = {
+        "host_python": sys.executable,
+        "packages": find_package_versions(python_exec, packages),
+        "options": options,
+    }
+    digest.update(json.dumps(inputs, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def read_fingerprint(kernel_install_path):
+    path = pathlib.Path(kernel_install_path) / FINGERPRINT_NAME
+    try:
+        return json.loads(path.read_text()).get("fingerprint")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def write_fingerprint(kernel_install_path, fingerprint):
+    path = pathlib.Path(kernel_install_path) / FINGERPRINT_NAME
+    path.write_text(json.dumps({"fingerprint": fingerprint}, indent=2))
+
+
+def get_widget_frontends():
+    """Widget libraries whose frontend is installed for jupyter
+
+    Blender's python may have ipywidgets or anywidget while jupyter can not
+    show their widgets; the kernel modules fall back to plain output then.
+    """
+    frontends = {
+        "ipywidgets": ["jupyterlab_widgets", "widgetsnbextension"],
+        "anywidget": ["anywidget"],
+    }
+    return [
+        name
+        for name, modules in frontends.items()
+        if any(importlib.util.find_spec(x) is not None for x in modules)
+    ]
 
 
 def get_kernel_path(kernel_dir):
@@ -31,6 +174,128 @@ def get_kernel_path(kernel_dir):
     return kernel_path
 
 
+def write_kernel(
+    kernel_install_path,
+    blender_exec,
+    tag=None,
+    pool_size=0,
+    preload=(),
+    soft_restart=False,
+    restart_template=None,
+    factory_startup=False,
+    background=False,
+    addon=(),
+    disable_addon=(),
+    threads="0",
+    cpus=None,
+    usage_log=None,
+    cull_idle_timeout=0,
+    idle_purge=0,
+    memory_limit=0,
+    checkpoint_dir=None,
+    restore_checkpoint=False,
+    prewarm_profile=None,
+    widgets=None,
+):
+    """Write the kernelspec, replacing the existing one
+
+    Takes the options of the install command, so that bl-notebook can write
+    kernelspecs without running this script.
+    """
+    kernel_install_path = pathlib.Path(kernel_install_path)
+
+    # check files to copy
+    kernel_file_paths = [
+        pathlib.Path(__file__).parent.joinpath(x) for x in KERNEL_FILES
+    ]
+    for path in kernel_file_paths:
+        assert path.exists()
+
+    # start dumping files
+    if kernel_install_path.exists():
+        shutil.rmtree(kernel_install_path)
+    kernel_install_path.mkdir(parents=True)
+
+    # copy python files
+    for path in kernel_file_paths:
+        shutil.copyfile(path, kernel_install_path.joinpath(path.name))
+
+    kernel_launcher_py_dst = kernel_install_path.joinpath("kernel_launcher.py")
+    kernel_launcher_py_dst.chmod(0o755)
+
+    # dump jsons
+    kernel_dict = {
+        "argv": [
+            sys.executable,
+            str(kernel_launcher_py_dst),
+            "-f",
+            r"{connection_file}",
+        ],
+        "display_name": kernel_install_path.name,
+        "language": "python",
+        # SIGINT quits blender, see interrupt_request in kernel.py
+        "interrupt_mode": "message",
+    }
+
+    if tag is not None:
+        kernel_dict["tag"] = tag
+
+    if pool_size > 0 or soft_restart:
+        kernel_dict["metadata"] = {
+            "kernel_provisioner": {
+                "provisioner_name": "blender-pool-provisioner",
+                "config": {
+                    "pool_size": pool_size,
+                    "soft_restart": soft_restart,
+                },
+            }
+        }
+
+    if cull_idle_timeout > 0:
+        # See culling.py
+        metadata = kernel_dict.setdefault("metadata", {})
+        metadata["bl_notebook"] = {"cull_idle_timeout": cull_idle_timeout}
+
+    # Launch profile
+    blender_args = []
+    if background:
+        blender_args += ["--background"]
+    if factory_startup:
+        blender_args += ["--factory-startup"]
+    if addon:
+        blender_args += ["--addons", ",".join(addon)]
+
+    blender_config_dict = {
+        "blender_executable": str(blender_exec),
+        "blender_args": blender_args,
+        "python_path": [],
+        "preload_modules": list(preload),
+        "disable_addons": list(disable_addon),
+        "soft_restart": soft_restart,
+        "restart_template": restart_template,
+        "usage_log": usage_log,
+        "checkpoint_dir": checkpoint_dir,
+        # Open the checkpoint of the notebook on launch
+        "restore_checkpoint": restore_checkpoint,
+        # Startup files read ahead by kernel_launcher.py
+        "prewarm_profile": prewarm_profile,
+        "widgets": get_widget_frontends() if widgets is None else widgets,
+        # Applied by kernel_launcher.py when the kernel starts
+        "threads": threads,
+        "cpus": cpus,
+        "memory": {"idle_purge": idle_purge, "cull_rss_mb": memory_limit},
+    }
+    kernel_json_dst = kernel_install_path.joinpath("kernel.json")
+    blender_config_json_dst = kernel_install_path.joinpath(
+        "blender_config.json"
+    )
+
+    with kernel_json_dst.open("w") as f:
+        json.dump(kernel_dict, f, indent=2)
+    with blender_config_json_dst.open("w") as f:
+        json.dump(blender_config_dict, f, indent=2)
+
+
 @click.group()
 def cli():
     """
@@ -64,7 +329,127 @@ def cli():
     type=str,
     help="Tag name",
 )
-def install(blender_exec, kernel_dir, kernel_name, tag):
+@click.option(
+    "--pool-size",
+    default=0,
+    type=int,
+    help="Number of pre-started kernels to keep (0 to disable)",
+)
+@click.option(
+    "--preload",
+    multiple=True,
+    type=str,
+    help="Module to import when the kernel starts",
+)
+@click.option(
+    "--soft-restart/--no-soft-restart",
+    default=False,
+    help="Restart the kernel without quitting blender",
+)
+@click.option(
+    "--restart-template",
+    default=None,
+    type=str,
+    help=".blend file loaded on soft restart (default: factory startup)",
+)
+@click.option(
+    "--factory-startup",
+    is_flag=True,
+    help="Run blender with --factory-startup",
+)
+@click.option(
+    "--background",
+    is_flag=True,
+    help="Run blender in background (headless) mode",
+)
+@click.option(
+    "--addon",
+    multiple=True,
+    type=str,
+    help="Add-on to enable when blender starts",
+)
+@click.option(
+    "--disable-addon",
+    multiple=True,
+    type=str,
+    help="Add-on to disable when the kernel starts",
+)
+@click.option(
+    "--threads",
+    default="0",
+    type=str,
+    help='Number of threads of blender (0 for all cores, or "auto")',
+)
+@click.option(
+    "--cpus",
+    default=None,
+    type=str,
+    help='CPUs to run blender on (e.g., "0-3", or "auto")',
+)
+@click.option(
+    "--usage-log",
+    default=None,
+    type=str,
+    help="Usage log recording the resources of the kernels",
+)
+@click.option(
+    "--cull-idle-timeout",
+    default=0,
+    type=int,
+    help="Seconds before jupyter culls the idle kernel (0 to disable)",
+)
+@click.option(
+    "--idle-purge",
+    default=0,
+    type=int,
+    help="Idle seconds before the kernel purges orphan data (0 to disable)",
+)
+@click.option(
+    "--memory-limit",
+    default=0,
+    type=int,
+    help="RSS in MB above which the idle kernel asks to be culled",
+)
+@click.option(
+    "--checkpoint-dir",
+    default=None,
+    type=str,
+    help="Directory of %bl_checkpoint",
+)
+@click.option(
+    "--restore-checkpoint",
+    is_flag=True,
+    help="Open the checkpoint of the notebook when the kernel starts",
+)
+@click.option(
+    "--prewarm-profile",
+    default=None,
+    type=str,
+    help="Startup files of blender to read ahead on launch",
+)
+def install(
+    blender_exec,
+    kernel_dir,
+    kernel_name,
+    tag,
+    pool_size,
+    preload,
+    soft_restart,
+    restart_template,
+    factory_startup,
+    background,
+    addon,
+    disable_addon,
+    threads,
+    cpus,
+    usage_log,
+    cull_idle_timeout,
+    idle_purge,
+    memory_limit,
+    checkpoint_dir,
+    restore_checkpoint,
+    prewarm_profile,
+):
     """
     Install kernel to jupyter notebook
     """
@@ -98,60 +483,31 @@ problem launching the jupyter kernel. Are you sure to continue?
             )
         ):
             return
-        shutil.rmtree(kernel_install_path)
-
-    # check files to copy
-    kernel_py_path = pathlib.Path(__file__).parent.joinpath("kernel.py")
-    kernel_launcher_py_path = pathlib.Path(__file__).parent.joinpath(
-        "kernel_launcher.py"
-    )
-    assert kernel_py_path.exists()
-    assert kernel_launcher_py_path.exists()
 
-    # start dumping files
     click.echo("Saving files to {}".format(kernel_install_path))
-    # create directory
-    kernel_install_path.mkdir()
-
-    # copy python files
-    kernel_py_dst = kernel_install_path.joinpath(kernel_py_path.name)
-    kernel_launcher_py_dst = kernel_install_path.joinpath(
-        kernel_launcher_py_path.name
-    )
-
-    shutil.copyfile(kernel_py_path, kernel_py_dst)
-    shutil.copyfile(kernel_launcher_py_path, kernel_launcher_py_dst)
-    kernel_launcher_py_dst.chmod(0o755)
-
-    # dump jsons
-    kernel_dict = {
-        "argv": [
-            sys.executable,
-            str(kernel_launcher_py_dst),
-            "-f",
-            r"{connection_file}",
-        ],
-        "display_name": kernel_name,
-        "language": "python",
-    }
-
-    if tag is not None:
-        kernel_dict["tag"] = tag
-
-    blender_config_dict = {
-        "blender_executable": str(blender_exec),
-        "python_path": [],
-    }
-    kernel_json_dst = kernel_install_path.joinpath("kernel.json")
-    blender_config_json_dst = kernel_install_path.joinpath(
-        "blender_config.json"
+    write_kernel(
+        kernel_install_path,
+        blender_exec,
+        tag=tag,
+        pool_size=pool_size,
+        preload=preload,
+        soft_restart=soft_restart,
+        restart_template=restart_template,
+        factory_startup=factory_startup,
+        background=background,
+        addon=addon,
+        disable_addon=disable_addon,
+        threads=threads,
+        cpus=cpus,
+        usage_log=usage_log,
+        cull_idle_timeout=cull_idle_timeout,
+        idle_purge=idle_purge,
+        memory_limit=memory_limit,
+        checkpoint_dir=checkpoint_dir,
+        restore_checkpoint=restore_checkpoint,
+        prewarm_profile=prewarm_profile,
     )
 
-    with kernel_json_dst.open("w") as f:
-        json.dump(kernel_dict, f, indent=2)
-    with blender_config_json_dst.open("w") as f:
-        json.dump(blender_config_dict, f, indent=2)
-
 
 @cli.command()
 @click.option(
@@ -4,28 +4,100 @@ Blender kernel.
 Copy and modified from https://github.com/cheng-chi/blender_notebook.
 """
 
+import _thread
 import asyncio
+import atexit
+import contextlib
+import ctypes
+import gc
+import importlib
 import json
+import math
+import os
 import pathlib
 import sys
+import time
 
 import bpy
 from bpy.app.handlers import persistent
 
+# Helper modules (e.g., bl_numpy) are installed next to this file
+sys.path.append(str(pathlib.Path(__file__).parent))
+
+import bl_checkpoint  # noqa: E402
+import bl_output  # noqa: E402
+import bl_prof  # noqa: E402
+import bl_usage  # noqa: E402
+from bl_scheduler import bl_iter, bl_yield, scheduler  # noqa: E402
+
+# Timestamps of the kernel startup. The launcher adds its own to the runtime
+# config.
+startup_times = {"kernel_py": time.time()}
+
+# Events ending each phase of the kernel startup and the phase names
+STARTUP_EVENTS = [
+    ("launcher_start", None),
+    ("blender_exec", "Launcher"),
+    ("kernel_py", "Blender and add-ons"),
+    ("loop_timer", "Timer before the kernel loop"),
+    ("initialized", "IPKernelApp.initialize"),
+    ("preloaded", "Preload modules"),
+    ("first_tick", "First tick of the kernel loop"),
+]
+
 _stdout = sys.stdout
 _stderr = sys.stderr
 
+# Kernel loop timing in seconds. These can be overridden by the "loop" entry
+# of the runtime config.
+LOOP_CONFIG = {
+    # Timer interval while messages are being handled
+    "min_interval": 0.004,
+    # Timer interval after backing off when idle. The first message after an
+    # idle period waits up to this long, so it is kept at the 60 Hz of the
+    # original loop. Blender's timers can not be woken by socket readiness.
+    "max_interval": 0.016,
+    # Idle time before backing off
+    "idle_grace": 0.5,
+    # Time budget for draining ready work in a single tick
+    "budget": 0.01,
+    # Lower bound of the time budget when the UI is slow
+    "min_budget": 0.002,
+    # Frame rate the UI should keep while cells are running
+    "target_fps": 30.0,
+}
+
+# Memory pressure mode. These can be overridden by the "memory" entry of the
+# runtime config.
+MEMORY_CONFIG = {
+    # Seconds between checks
+    "interval": 10.0,
+    # Idle seconds before purging orphan data-blocks and freeing caches
+    # (0: never)
+    "idle_purge": 0.0,
+    # RSS in MB above which the idle kernel asks to be culled (0: never)
+    "cull_rss_mb": 0,
+}
+
+# Written next to the connection file to ask jupyter server for culling,
+# see culling.py
+CULL_REQUEST_NAME = "bl-cull-{pid}.json"
+
 
 def dprint(*args, **kwargs):
     print(*args, file=_stderr, **kwargs)
 
 
 def get_runtime_config():
-    this_file_path = pathlib.Path(__file__)
-    json_path = this_file_path.parent.joinpath("runtime_config.json")
-    config_dict = None
-    with json_path.open("r") as f:
-        config_dict = json.load(f)
+    # Passed by kernel_launcher.py, do not leak it to subprocesses
+    config_json = os.environ.pop("BL_KERNEL_RUNTIME_CONFIG", None)
+    if config_json is not None:
+        config_dict = json.loads(config_json)
+    else:
+        this_file_path = pathlib.Path(__file__)
+        json_path = this_file_path.parent.joinpath("runtime_config.json")
+        with json_path.open("r") as f:
+            config_dict = json.load(f)
 
     # check config
     assert "args" in config_dict
@@ -34,43 +106,442 @@ def get_runtime_config():
     return config_dict
 
 
+def remove_file(path):
+    # Path.unlink(missing_ok=True) needs python 3.8, older blenders lack it
+    with contextlib.suppress(FileNotFoundError):
+        path.unlink()
+
+
+def record_startup(event):
+    startup_times.setdefault(event, time.time())
+
+
+def get_startup_phases():
+    """Durations of the kernel startup phases in seconds"""
+    phases = []
+    previous = None
+    for event, name in STARTUP_EVENTS:
+        timestamp = startup_times.get(event)
+        if timestamp is None:
+            continue
+        if previous is not None:
+            phases.append((name, timestamp - previous))
+        previous = timestamp
+    return phases
+
+
+def format_startup():
+    phases = get_startup_phases()
+    width = max([len(name) for name, _ in phases] + [len("Total")])
+    lines = [f"{name:<{width}}  {sec:8.3f} s" for name, sec in phases]
+    total = sum(sec for _, sec in phases)
+    lines.append(f"{'Total':<{width}}  {total:8.3f} s")
+    return "\n".join(lines)
+
+
+def write_startup_log(connection_file):
+    """Write the startup timestamps next to the connection file"""
+    path = pathlib.Path(connection_file)
+    log_path = path.with_name(path.stem + "-startup.json")
+    content = {
+        "pid": os.getpid(),
+        "times": startup_times,
+        "phases": get_startup_phases(),
+    }
+    try:
+        with log_path.open("w") as f:
+            json.dump(content, f, indent=2)
+    except OSError as exc:
+        dprint(f"Can not write the startup log {log_path}: {exc}")
+
+
+def get_connection_path(app):
+    return pathlib.Path(
+        getattr(app, "abs_connection_file", app.connection_file)
+    )
+
+
+def install_output(app, config):
+    """Coalesce and truncate the output sent to iopub
+
+    The output of truncated cells is written next to the connection file.
+    """
+    config = dict(config)
+    if not config.pop("enabled", True):
+        return []
+    path = get_connection_path(app)
+    log_dir = path.with_name(path.stem + "-output")
+    return bl_output.install(sys, log_dir=log_dir, **config)
+
+
+def finish_startup(app):
+    record_startup("first_tick")
+    write_startup_log(get_connection_path(app))
+    if os.environ.get("BL_KERNEL_VERBOSE"):
+        dprint("Kernel startup:\n" + format_startup())
+
+
+def bl_startup_magic(line):
+    """Show the startup time of this kernel by phase"""
+    print(format_startup())
+
+
+def start_usage(runtime_config):
+    """Record the usage of this kernel in the usage log at exit"""
+    path = runtime_config.get("usage_log")
+    if not path:
+        return
+    budget = runtime_config.get("budget", {})
+    record = bl_usage.new_record("kernel")
+    record["start"] = startup_times.get("launcher_start", record["start"])
+    # Reserved by the launcher, the latest record of an id counts
+    record.update(runtime_config.get("usage_record", {}))
+    record.update(
+        pid=os.getpid(),
+        version=bpy.app.version_string,
+        notebook=os.environ.get("JPY_SESSION_NAME"),
+        threads=budget.get("threads"),
+        cpus=budget.get("cpus"),
+    )
+    bl_usage.append_record(path, record)
+
+    def finish_usage():
+        # Kernels of the pool get JPY_SESSION_NAME when handed out
+        record["notebook"] = os.environ.get("JPY_SESSION_NAME")
+        usage = bl_usage.rusage()
+        children = bl_usage.rusage("children")
+        if usage is not None:
+            usage["cpu_children"] = (
+                children["cpu_user"] + children["cpu_system"]
+            )
+        bl_usage.finish_record(path, record, 0, usage)
+
+    atexit.register(finish_usage)
+
+
+def get_resource_row(name, pid, start):
+    usage = bl_usage.proc_usage(pid)
+    if usage is None and pid == os.getpid():
+        usage = bl_usage.rusage()
+    usage = usage or {}
+    return {
+        "session": name,
+        "pid": pid,
+        "wall_s": time.time() - start,
+        "cpu_s": usage.get("cpu_user", 0.0) + usage.get("cpu_system", 0.0),
+        "rss_mb": usage.get("rss", 0) / 2**20,
+        "max_rss_mb": usage.get("max_rss", 0) / 2**20,
+        "threads": usage.get("threads", "-"),
+    }
+
+
+def bl_resources_magic(line):
+    """Show the resource usage of this kernel
+
+    With "all", also show the other running blender sessions in the usage
+    log.
+    """
+    start = startup_times.get("launcher_start", startup_times["kernel_py"])
+    rows = [get_resource_row("this kernel", os.getpid(), start)]
+    path = JupyterKernelLoop.runtime_config.get("usage_log")
+    if line.strip() == "all" and path:
+        records = bl_usage.running_records(bl_usage.read_records(path))
+        for record in records:
+            if record["pid"] == os.getpid():
+                continue
+            name = record.get("notebook") or record["kind"]
+            rows.append(get_resource_row(name, record["pid"], record["start"]))
+    print(bl_usage.format_table(rows))
+
+
+def trim_malloc():
+    """Return the freed heap memory to the system (glibc only)"""
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def free_memory():
+    """Purge orphan data-blocks and free caches"""
+    if hasattr(bpy.data, "orphans_purge"):
+        bpy.data.orphans_purge(
+            do_local_ids=True, do_linked_ids=True, do_recursive=True
+        )
+    for image in bpy.data.images:
+        if image.has_data:
+            # Reloaded when used again
+            image.buffers_free()
+    gc.collect()
+    trim_malloc()
+
+
+class MemoryMonitor:
+    """Free memory of the idle kernel and ask to be culled above the limit"""
+
+    def __init__(self, app, config):
+        self.app = app
+        self.config = dict(MEMORY_CONFIG, **config)
+        path = get_connection_path(app)
+        self.request_path = path.with_name(
+            CULL_REQUEST_NAME.format(pid=os.getpid())
+        )
+        self._purged_at = None
+
+    def start(self):
+        if self.config["idle_purge"] or self.config["cull_rss_mb"]:
+            atexit.register(remove_file, self.request_path)
+            self._schedule()
+
+    def _schedule(self):
+        loop = asyncio.get_event_loop()
+        loop.call_later(self.config["interval"], self.check)
+
+    def check(self):
+        try:
+            self._check()
+        except Exception as exc:
+            dprint(f"Memory check failed: {exc}")
+        finally:
+            self._schedule()
+
+    def _check(self):
+        if self.app.executing:
+            return
+        idle = time.monotonic() - self.app.last_activity
+        idle_purge = self.config["idle_purge"]
+        if idle_purge and idle >= idle_purge:
+            if self._purged_at != self.app.last_activity:
+                free_memory()
+                self._purged_at = self.app.last_activity
+
+        limit = self.config["cull_rss_mb"]
+        usage = bl_usage.proc_usage(os.getpid())
+        if not limit or usage is None:
+            return
+        if usage["rss"] > limit * 2**20:
+            if not self.request_path.exists():
+                rss_mb = usage["rss"] / 2**20
+                request = {
+                    "pid": os.getpid(),
+                    "rss": usage["rss"],
+                    "reason": f"RSS {rss_mb:.0f} MB > {limit} MB",
+                }
+                self.request_path.write_text(json.dumps(request))
+                dprint(f"Asked to be culled: {request['reason']}")
+        else:
+            # The server removes it when it culls the kernel
+            remove_file(self.request_path)
+
+
+def preload_modules(names):
+    """Import modules in advance so that importing them in cells is fast"""
+    for name in names:
+        try:
+            importlib.import_module(name)
+        except ImportError as exc:
+            dprint(f"Can not preload module {name}: {exc}")
+
+
+def disable_addons(names):
+    """Disable add-ons for this session without saving the preferences"""
+    import addon_utils
+
+    for name in names:
+        try:
+            addon_utils.disable(name, default_set=False)
+        except Exception as exc:
+            dprint(f"Can not disable add-on {name}: {exc}")
+
+
+def is_loop_ready(loop, poll=True):
+    """Check if the asyncio event loop has work to do without running it
+
+    With poll=False, the file descriptors are not polled, which saves a
+    select() call when the loop has just polled them.
+    """
+    try:
+        if loop._ready:
+            return True
+        scheduled = loop._scheduled
+        if scheduled and scheduled[0].when() <= loop.time():
+            return True
+        if scheduler._waiters:
+            return True
+        if not poll:
+            return False
+        # The selector is level-triggered, so this does not consume events.
+        # Readiness of the zmq sockets shows up as readable file descriptors.
+        return bool(loop._selector.select(0))
+    except AttributeError:
+        # Unknown event loop implementation
+        return True
+
+
+def run_loop_once(loop):
+    loop.call_soon(loop.stop)
+    loop.run_forever()
+
+
+def push_user_helpers(shell):
+    shell.push({"bl_yield": bl_yield, "bl_iter": bl_iter})
+
+
+def snapshot_handlers():
+    """Copy the lists of bpy.app.handlers"""
+    result = {}
+    for name in dir(bpy.app.handlers):
+        handlers = getattr(bpy.app.handlers, name)
+        if isinstance(handlers, list):
+            result[name] = list(handlers)
+    return result
+
+
+def unregister_user_handlers(snapshot):
+    """Remove handlers which are not in the snapshot"""
+    for name, original in snapshot.items():
+        handlers = getattr(bpy.app.handlers, name)
+        for handler in list(handlers):
+            if handler not in original:
+                handlers.remove(handler)
+
+
 class JupyterKernelLoop(bpy.types.Operator):
     bl_idname = "asyncio.jupyter_kernel_loop"
     bl_label = "Jupyter Kernel Loop"
 
     _timer = None
+    _interval = None
+    _last_active = 0.0
 
     kernelApp = None
+    runtime_config = None
+    config = dict(LOOP_CONFIG)
+    handler_snapshot = None
+
+    # The modal operator is running
+    running = False
+    # Do not handle messages while the soft restart loads the startup file
+    paused = False
+
+    # Statistics for measuring the loop
+    stats = {"ticks": 0, "runs": 0, "busy_time": 0.0}
+
+    def drain(self):
+        """Run ready work of the event loop within the time budget
+
+        Returns True if any work was done.
+        """
+        loop = asyncio.get_event_loop()
+        stats = JupyterKernelLoop.stats
+        stats["ticks"] += 1
+        if not is_loop_ready(loop):
+            return False
+
+        start = time.perf_counter()
+        budget = scheduler.get_budget(self.config)
+        deadline = start + budget
+        scheduler.begin_slice(budget)
+        try:
+            while True:
+                run_loop_once(loop)
+                stats["runs"] += 1
+                now = time.perf_counter()
+                # run_loop_once has just polled the sockets
+                if now >= deadline or not is_loop_ready(loop, poll=False):
+                    break
+        finally:
+            scheduler.end_slice()
+        stats["busy_time"] += time.perf_counter() - start
+        return True
+
+    def next_interval(self, active):
+        now = time.monotonic()
+        if active:
+            self._last_active = now
+            return self.config["min_interval"]
+        if now - self._last_active < self.config["idle_grace"]:
+            return self.config["min_interval"]
+        # Back off exponentially while idle
+        return min(self._interval * 2, self.config["max_interval"])
+
+    def set_timer(self, context, interval):
+        if interval == self._interval:
+            return
+        wm = context.window_manager
+        if self._timer is not None:
+            wm.event_timer_remove(self._timer)
+        self._timer = wm.event_timer_add(interval, window=context.window)
+        self._interval = interval
 
     def modal(self, context, event):
-        if event.type == "TIMER":
-            # Run event loop shortly
-            loop = asyncio.get_event_loop()
-            loop.call_soon(loop.stop)
-            loop.run_forever()
+        if event.type == "TIMER" and "first_tick" not in startup_times:
+            finish_startup(self.kernelApp)
+
+        if event.type == "TIMER" and not self.paused:
+            active = self.drain()
+            self.set_timer(context, self.next_interval(active))
 
         return {"PASS_THROUGH"}
 
+    @classmethod
+    def initialize(cls):
+        runtime_config = get_runtime_config()
+        startup_times.update(runtime_config.get("startup", {}))
+        cls.runtime_config = runtime_config
+        cls.config.update(runtime_config.get("loop", {}))
+        start_usage(runtime_config)
+        # See bl_display.has_frontend()
+        os.environ["BL_NOTEBOOK_WIDGETS"] = ",".join(
+            runtime_config.get("widgets", [])
+        )
+        cls.kernelApp = BlenderIPKernelApp.instance()
+        cls.kernelApp.initialize(["python"] + runtime_config["args"])
+        # doesn't start event loop, kernelApp.start() does
+        cls.kernelApp.kernel.start()
+        cls.kernelApp.output_streams = install_output(
+            cls.kernelApp, runtime_config.get("output", {})
+        )
+        record_startup("initialized")
+        disable_addons(runtime_config.get("disable_addons", []))
+        preload_modules(runtime_config.get("preload_modules", []))
+        record_startup("preloaded")
+        shell = cls.kernelApp.shell
+        shell.register_magic_function(bl_startup_magic, "line", "bl_startup")
+        shell.register_magic_function(
+            bl_resources_magic, "line", "bl_resources"
+        )
+        bl_checkpoint.register(
+            shell,
+            runtime_config.get("checkpoint_dir"),
+            restore=runtime_config.get("checkpoint"),
+        )
+        cls.memory_monitor = MemoryMonitor(
+            cls.kernelApp, runtime_config.get("memory", {})
+        )
+        cls.memory_monitor.start()
+        push_user_helpers(shell)
+        cls.handler_snapshot = snapshot_handlers()
+
     def execute(self, context):
+        if not JupyterKernelLoop.kernelApp:
+            record_startup("loop_timer")
+            JupyterKernelLoop.initialize()
+
         # Register timer
         wm = context.window_manager
-        self._timer = wm.event_timer_add(0.016, window=context.window)
+        self._last_active = time.monotonic()
+        self.set_timer(context, self.config["min_interval"])
         wm.modal_handler_add(self)
-
-        if not JupyterKernelLoop.kernelApp:
-            runtime_config = get_runtime_config()
-            JupyterKernelLoop.kernelApp = BlenderIPKernelApp.instance()
-            JupyterKernelLoop.kernelApp.initialize(
-                ["python"] + runtime_config["args"]
-            )
-            # doesn't start event loop, kernelApp.start() does
-            JupyterKernelLoop.kernelApp.kernel.start()
+        JupyterKernelLoop.running = True
 
         return {"RUNNING_MODAL"}
 
     def cancel(self, context):
+        # Called when loading a file removes the modal handler
         wm = context.window_manager
         wm.event_timer_remove(self._timer)
+        JupyterKernelLoop.running = False
 
 
 try:
@@ -88,24 +559,172 @@ else:
     def quit_blender():
         bpy.ops.wm.quit_blender()
 
+    @persistent
+    def load_startup_file():
+        """Load the startup file of the soft restart
+
+        This runs from a timer because loading a file cancels the modal
+        operator of the kernel loop.
+        """
+        template = JupyterKernelLoop.runtime_config.get("restart_template")
+        try:
+            if template:
+                bpy.ops.wm.open_mainfile(filepath=template, load_ui=False)
+            else:
+                bpy.ops.wm.read_homefile(use_factory_startup=True)
+        except Exception as exc:
+            dprint(f"Soft restart failed, quit blender: {exc}")
+            quit_blender()
+
+    def soft_restart():
+        """Restart the kernel without quitting blender"""
+        try:
+            JupyterKernelLoop.paused = True
+            scheduler.reset()
+            shell = JupyterKernelLoop.kernelApp.shell
+            shell.reset(new_session=True)
+            push_user_helpers(shell)
+            unregister_user_handlers(JupyterKernelLoop.handler_snapshot)
+        except Exception as exc:
+            dprint(f"Soft restart failed, quit blender: {exc}")
+            if bpy.app.background:
+                asyncio.get_event_loop().stop()
+            else:
+                bpy.app.timers.register(quit_blender)
+        else:
+            if bpy.app.background:
+                # No modal operator to be cancelled by loading the file
+                load_startup_file()
+                JupyterKernelLoop.paused = False
+            else:
+                bpy.app.timers.register(load_startup_file)
+
+    def replace_handler(kernel, msg_type, handler):
+        setattr(kernel, msg_type, handler)
+        for handlers in (kernel.shell_handlers, kernel.control_handlers):
+            if msg_type in handlers:
+                handlers[msg_type] = handler
+
     class BlenderIPKernelApp(IPKernelApp):
+        # A cell is running
+        executing = False
+        # Streams coalescing the output of cells
+        output_streams = []
+        # Time of the last cell (time.monotonic)
+        last_activity = time.monotonic()
+
         def init_kernel(self):
             super().init_kernel()
+            kernel = self.kernel
+            main_loop = asyncio.get_event_loop()
 
             def do_shutdown(restart):
-                super(self.kernel.__class__, self.kernel).do_shutdown(restart)
+                super(kernel.__class__, kernel).do_shutdown(restart)
                 bpy.app.timers.register(quit_blender)
 
             # dirty hack for quit blender on restart or shutdown kernel
-            setattr(self.kernel, "do_shutdown", do_shutdown)  # noqa: B010
+            setattr(kernel, "do_shutdown", do_shutdown)  # noqa: B010
+
+            shutdown_request = kernel.shutdown_request
+
+            def soft_shutdown_request(stream, ident, parent):
+                restart = parent["content"].get("restart", False)
+                runtime_config = JupyterKernelLoop.runtime_config
+                if not (restart and runtime_config.get("soft_restart")):
+                    return shutdown_request(stream, ident, parent)
+
+                # Keep the process and the zmq sockets alive. The provisioner
+                # reuses this process for the restarted kernel.
+                content = {"status": "ok", "restart": True}
+                kernel.session.send(
+                    stream, "shutdown_reply", content, parent, ident
+                )
+                # This runs in the control thread
+                main_loop.call_soon_threadsafe(soft_restart)
+
+            replace_handler(kernel, "shutdown_request", soft_shutdown_request)
+
+            def interrupt_request(stream, ident, parent):
+                if bpy.app.background:
+                    # Cells run in the main thread without the UI, so raise
+                    # KeyboardInterrupt there like SIGINT in ipykernel.
+                    if self.executing:
+                        _thread.interrupt_main()
+                else:
+                    # SIGINT would quit blender. Raise KeyboardInterrupt at
+                    # the next bl_yield() instead.
+                    scheduler.interrupt()
+                kernel.session.send(
+                    stream, "interrupt_reply", {"status": "ok"}, parent, ident
+                )
+
+            replace_handler(kernel, "interrupt_request", interrupt_request)
+
+        def init_shell(self):
+            super().init_shell()
+
+            def pre_run_cell(*args):
+                # Forget interrupts that arrived while no cell was running
+                scheduler.interrupted = False
+                self.executing = True
+                self.last_activity = time.monotonic()
+                for stream in self.output_streams:
+                    stream.begin_cell(self.shell.execution_count)
+
+            def post_run_cell(*args):
+                self.executing = False
+                self.last_activity = time.monotonic()
+                for stream in self.output_streams:
+                    stream.end_cell()
+
+            self.shell.events.register("pre_run_cell", pre_run_cell)
+            self.shell.events.register("post_run_cell", post_run_cell)
+
+            # Stacks of %bl_prof are written next to the connection file
+            path = get_connection_path(self)
+            bl_prof.register(self.shell, path.with_name(path.stem + "-prof"))
 
     bpy.utils.register_class(JupyterKernelLoop)
 
     @persistent
     def loadHandler():
-        bpy.ops.asyncio.jupyter_kernel_loop()
+        if not JupyterKernelLoop.running:
+            bpy.ops.asyncio.jupyter_kernel_loop()
+
+    @persistent
+    def restart_kernel_loop(*args):
+        # Loading a file cancels the modal operator of the kernel loop
+        JupyterKernelLoop.paused = False
+        bpy.app.timers.register(loadHandler, first_interval=0.0)
+
+    def run_background():
+        """Run the kernel without a window manager (blender --background)
+
+        There are neither wm timers nor modal operators in background mode.
+        The event loop of the kernel runs natively until the kernel shuts
+        down, which stops the loop.
+        """
+        JupyterKernelLoop.initialize()
+        # Nothing to yield to
+        scheduler.deadline = math.inf
+        loop = asyncio.get_event_loop()
+        loop.call_soon(finish_startup, JupyterKernelLoop.kernelApp)
+        while True:
+            try:
+                loop.run_forever()
+                break
+            except KeyboardInterrupt:
+                # An interrupt arrived after the cell finished
+                continue
 
-    bpy.app.timers.register(loadHandler, first_interval=0.0, persistent=True)
+    if bpy.app.background:
+        # Blender exits when this script returns
+        run_background()
+    else:
+        bpy.app.handlers.load_post.append(restart_kernel_loop)
+        bpy.app.timers.register(
+            loadHandler, first_interval=0.0, persistent=True
+        )
 
     # Need the timer hack because if immediately call registered operation, get
     # self.user_global_ns is None error in IPython/core/interactiveshell.py
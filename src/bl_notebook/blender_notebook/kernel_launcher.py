@@ -8,14 +8,26 @@ Copy and modified from https://github.com/cheng-chi/blender_notebook.
 import json
 import os
 import pathlib
+import re
 import shlex
-import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+
+# Start of the kernel startup, see STARTUP_EVENTS in kernel.py
+LAUNCHER_START = time.time()
+
+# Next to this script in the kernel directory
+import bl_threads  # noqa: E402
+import bl_usage  # noqa: E402
 
 DEFAULT_BL_KERNEL_ARGS = ""
 
+# Environment variable passing the runtime config to kernel.py
+RUNTIME_CONFIG_ENV = "BL_KERNEL_RUNTIME_CONFIG"
+
 
 def get_blender_config():
     this_file_path = pathlib.Path(__file__)
@@ -36,29 +48,134 @@ def get_kernel_args():
     )
 
 
+def apply_budget(blender_config):
+    """Limit the threads and pin the CPUs of blender, see bl_threads.py
+
+    Return the arguments of blender.
+    """
+
+    def get_budget(records=()):
+        return bl_threads.get_budget(
+            blender_config.get("threads", 0),
+            blender_config.get("cpus"),
+            records,
+        )
+
+    usage_log = blender_config.get("usage_log")
+    if usage_log:
+        # Recorded before exec, kernel.py completes the record
+        budget, record = bl_usage.reserve(usage_log, get_budget, "kernel")
+        blender_config["usage_record"] = record
+    else:
+        budget = get_budget()
+    threads, cpus = budget
+    os.environ.update(bl_threads.thread_env(threads))
+    # Inherited by blender
+    bl_threads.set_affinity(cpus)
+    blender_config["budget"] = {"threads": threads, "cpus": cpus}
+    return bl_threads.blender_args(threads)
+
+
+def get_checkpoint_args(blender_config):
+    """Open the checkpoint of the notebook, see bl_checkpoint.py
+
+    Only kernels started for a notebook (not those of the pool) know it.
+    Return the arguments of blender.
+    """
+    session = os.environ.get("JPY_SESSION_NAME")
+    if not blender_config.get("restore_checkpoint") or not session:
+        return []
+    # As get_default_name() and Checkpoints in bl_checkpoint.py
+    name = re.sub(r"[^A-Za-z0-9_.-]", "-", pathlib.Path(session).stem)
+    directory = blender_config.get("checkpoint_dir") or os.path.join(
+        tempfile.gettempdir(), "bl_notebook-checkpoints"
+    )
+    path = pathlib.Path(directory, f"{name}.blend")
+    if not name or not path.exists():
+        return []
+    # kernel.py restores the variables
+    blender_config["checkpoint"] = name
+    return [str(path)]
+
+
+def prewarm(blender_config):
+    """Read ahead the startup files of blender, see blender/prewarm.py
+
+    posix_fadvise() starts the readahead in the OS, which goes on after
+    exec. Elsewhere the files are read in a thread of this process, which
+    waits for blender.
+    """
+    path = blender_config.get("prewarm_profile")
+    if not path:
+        return
+    try:
+        with open(path) as fh:
+            profile = json.load(fh)
+    except (OSError, ValueError):
+        # Not recorded yet
+        return
+    if profile.get("executable") != blender_config["blender_executable"]:
+        return
+
+    def read(files):
+        for name in files:
+            try:
+                with open(name, "rb") as fh:
+                    while fh.read(1024 * 1024):
+                        pass
+            except OSError:
+                pass
+
+    if not hasattr(os, "posix_fadvise"):
+        threading.Thread(
+            target=read, args=(profile["files"],), daemon=True
+        ).start()
+        return
+    for name in profile["files"]:
+        try:
+            fd = os.open(name, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
 def main():
     blender_config = get_blender_config()
     blender_config["args"] = sys.argv[1:]
 
+    # kernel.py is loaded from the kernel directory
     kernel_path = pathlib.Path(__file__).parent.joinpath("kernel.py")
     assert kernel_path.exists()
 
-    with tempfile.TemporaryDirectory() as tempdirname:
-        tempdir = pathlib.Path(tempdirname)
-        runtime_config_path = tempdir.joinpath("runtime_config.json")
-        with runtime_config_path.open("w") as f:
-            json.dump(blender_config, f)
-
-        runtime_kernel_path = tempdir.joinpath("kernel.py")
-        shutil.copyfile(kernel_path, runtime_kernel_path)
-
-        blender_executable = blender_config["blender_executable"]
-
-        args = [blender_executable]
-        args += get_kernel_args()
-        args += ["-P", str(runtime_kernel_path)]
-
-        subprocess.run(args)
+    blender_executable = blender_config["blender_executable"]
+    prewarm(blender_config)
+
+    args = [blender_executable]
+    args += blender_config.get("blender_args", [])
+    args += apply_budget(blender_config)
+    args += get_kernel_args()
+    # Blender opens the file before running kernel.py
+    args += get_checkpoint_args(blender_config)
+    args += ["-P", str(kernel_path)]
+
+    blender_config["startup"] = {
+        "launcher_start": LAUNCHER_START,
+        "blender_exec": time.time(),
+    }
+    os.environ[RUNTIME_CONFIG_ENV] = json.dumps(blender_config)
+
+    if os.name == "nt":
+        # os.execv does not replace the process on windows
+        sys.exit(subprocess.run(args).returncode)
+
+    # Replace this process with blender, so that no idle python process is
+    # left per kernel and signals are delivered to blender directly.
+    os.execv(blender_executable, args)
 
 
 main()
@@ -0,0 +1,365 @@
+"""
+Kernel provisioner with a warm pool of pre-started blender kernels.
+
+Starting a blender kernel spawns blender, loads kernel.py and imports
+ipykernel, which takes several seconds. The provisioner keeps idle, fully
+initialised kernels per kernelspec and hands one out when a kernel is
+started. It also keeps the blender process alive when the kernel restarts
+itself in-process (soft restart). It is enabled for a kernelspec by its
+metadata:
+
+    "metadata": {
+        "kernel_provisioner": {
+            "provisioner_name": "blender-pool-provisioner",
+            "config": {"pool_size": 2, "soft_restart": true}
+        }
+    }
+"""
+
+import asyncio
+import atexit
+import os
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+
+from jupyter_client.asynchronous import AsyncKernelClient
+from jupyter_client.connect import LocalPortCache, write_connection_file
+from jupyter_client.launcher import launch_kernel
+from jupyter_client.provisioning import LocalProvisioner
+from jupyter_core.paths import jupyter_runtime_dir
+from traitlets import Bool, Float, Int
+
+POOL_MAINTAIN_INTERVAL = 5.0
+POOL_READY_TIMEOUT = 120.0
+PORT_NAMES = (
+    "shell_port",
+    "iopub_port",
+    "stdin_port",
+    "hb_port",
+    "control_port",
+)
+
+
+def get_available_memory():
+    """Available memory in bytes, or None if unknown"""
+    try:
+        with open("/proc/meminfo") as fh:
+            for line in fh:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class PoolMember:
+    def __init__(self, process, connection_file, connection_info, env=None):
+        self.process = process
+        self.connection_file = connection_file
+        self.connection_info = connection_info
+        # Environment the kernel was started with
+        self.env = env or {}
+        self.ready = False
+        self.started = time.monotonic()
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def make_client(self):
+        client = AsyncKernelClient()
+        client.load_connection_info(self.connection_info)
+        return client
+
+    async def wait_for_ready(self, timeout=POOL_READY_TIMEOUT):
+        client = self.make_client()
+        client.start_channels()
+        try:
+            await client.wait_for_ready(timeout=timeout)
+        finally:
+            client.stop_channels()
+        self.ready = True
+
+    async def adopt(self, cwd=None, env=None):
+        """Apply the working directory and environment of a launch
+
+        The kernel was started before the launch, so the variables the
+        kernel manager sets for the kernel (e.g., JPY_SESSION_NAME) are
+        set in the running kernel.
+        """
+        env = {
+            key: value
+            for key, value in (env or {}).items()
+            if self.env.get(key) != value
+        }
+        code = ""
+        if env:
+            code += f"_os.environ.update({env!r}); "
+        if cwd is not None:
+            code += f"_os.chdir({str(cwd)!r}); "
+        if not code:
+            return
+        client = self.make_client()
+        client.start_channels()
+        try:
+            await client.execute_interactive(
+                f"import os as _os; {code}del _os",
+                silent=True,
+                store_history=False,
+                timeout=10,
+            )
+        finally:
+            client.stop_channels()
+        self.env.update(env)
+
+    def terminate(self):
+        if self.is_alive():
+            self.process.terminate()
+        if self.connection_file is not None:
+            Path(self.connection_file).unlink(missing_ok=True)
+
+
+class KernelPool:
+    """Idle blender kernels of a kernelspec"""
+
+    pools = {}
+
+    def __init__(self, kernel_spec, size, demand_window, min_available_memory):
+        self.kernel_spec = kernel_spec
+        self.size = size
+        self.demand_window = demand_window
+        self.min_available_memory = min_available_memory
+        self.members = []
+        self.demand = deque()
+        self._task = None
+        self._wakeup = None
+
+    @classmethod
+    def get(cls, kernel_spec, **kwargs):
+        key = kernel_spec.resource_dir
+        pool = cls.pools.get(key)
+        if pool is None:
+            pool = cls.pools[key] = cls(kernel_spec, **kwargs)
+        return pool
+
+    @property
+    def target_size(self):
+        """Pool size following the recent demand
+
+        The pool is emptied when no kernel was started in the demand window.
+        """
+        now = time.monotonic()
+        while self.demand and self.demand[0] < now - self.demand_window:
+            self.demand.popleft()
+        return min(self.size, len(self.demand))
+
+    def is_memory_tight(self):
+        available = get_available_memory()
+        return available is not None and available < self.min_available_memory
+
+    def acquire(self):
+        self.demand.append(time.monotonic())
+        self.start()
+        for member in self.members:
+            if member.ready and member.is_alive():
+                self.members.remove(member)
+                return member
+        return None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._maintain())
+        else:
+            # Refill without waiting for the next interval
+            self._wakeup.set()
+
+    def spawn(self):
+        connection_file = Path(jupyter_runtime_dir()) / (
+            f"kernel-pool-{uuid.uuid4()}.json"
+        )
+        connection_file.parent.mkdir(parents=True, exist_ok=True)
+        _, connection_info = write_connection_file(
+            str(connection_file),
+            ip="127.0.0.1",
+            key=uuid.uuid4().hex.encode("ascii"),
+            kernel_name=Path(self.kernel_spec.resource_dir).name,
+        )
+        cmd = [
+            x.replace("{connection_file}", str(connection_file))
+            for x in self.kernel_spec.argv
+        ]
+        env = os.environ.copy()
+        env.update(self.kernel_spec.env or {})
+        process = launch_kernel(cmd, env=env)
+        member = PoolMember(process, connection_file, connection_info, env)
+        self.members.append(member)
+        return member
+
+    def reap(self):
+        for member in list(self.members):
+            if not member.is_alive():
+                self.members.remove(member)
+                member.terminate()
+
+        # Reap idle members, newest first, while memory is tight
+        while self.members and self.is_memory_tight():
+            self.members.pop().terminate()
+
+        while len(self.members) > self.target_size:
+            self.members.pop().terminate()
+
+    async def _maintain(self):
+        while True:
+            self.reap()
+            while (
+                len(self.members) < self.target_size
+                and not self.is_memory_tight()
+            ):
+                member = self.spawn()
+                try:
+                    await member.wait_for_ready()
+                except (RuntimeError, asyncio.TimeoutError):
+                    member.terminate()
+                    break
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), POOL_MAINTAIN_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+        for member in self.members:
+            member.terminate()
+        self.members = []
+
+
+@atexit.register
+def _shutdown_pools():
+    for pool in KernelPool.pools.values():
+        pool.shutdown()
+
+
+class BlenderPoolProvisioner(LocalProvisioner):
+    """Local provisioner handing out pre-started blender kernels"""
+
+    pool_size = Int(
+        1, config=True, help="Maximum number of idle pre-started kernels."
+    )
+    demand_window = Float(
+        600.0,
+        config=True,
+        help="Seconds of kernel starts counted for the pool size.",
+    )
+    min_available_memory = Int(
+        1024**3,
+        config=True,
+        help="Reap idle kernels when available memory is below this.",
+    )
+    soft_restart = Bool(
+        False,
+        config=True,
+        help="Keep the blender process when the kernel restarts.",
+    )
+    soft_restart_timeout = Float(
+        60.0,
+        config=True,
+        help="Seconds to wait for the kernel to finish the soft restart.",
+    )
+
+    _restarting = None
+
+    async def shutdown_requested(self, restart=False):
+        await super().shutdown_requested(restart=restart)
+        if restart and self.soft_restart and self.process is not None:
+            # The kernel keeps running, see soft_shutdown_request in kernel.py
+            self._restarting = PoolMember(
+                self.process, None, self.connection_info
+            )
+
+    async def poll(self):
+        if self._restarting is not None:
+            # Pretend the kernel exited, so it is not terminated
+            return 0
+        return await super().poll()
+
+    async def wait(self):
+        if self._restarting is not None:
+            self.process = None
+            return 0
+        return await super().wait()
+
+    async def _resume_restarted(self):
+        """Wait for the soft restart, return the kernel if it succeeded"""
+        member, self._restarting = self._restarting, None
+        try:
+            await member.wait_for_ready(timeout=self.soft_restart_timeout)
+        except (RuntimeError, asyncio.TimeoutError):
+            pass
+        if member.ready and member.is_alive():
+            return member
+        # Fall back to the hard restart
+        if member.is_alive():
+            member.process.kill()
+        return None
+
+    @property
+    def pool(self):
+        return KernelPool.get(
+            self.kernel_spec,
+            size=self.pool_size,
+            demand_window=self.demand_window,
+            min_available_memory=self.min_available_memory,
+        )
+
+    def release_ports(self, member):
+        """Return the ports pre_launch allocated for this launch
+
+        The kernel handed out keeps the ports it was started with. After a
+        soft restart those are the cached ports, which stay in use.
+        """
+        if not self.ports_cached or not self.connection_info:
+            return
+        cache = LocalPortCache.instance()
+        released = False
+        for name in PORT_NAMES:
+            port = self.connection_info.get(name)
+            if port and port != member.connection_info.get(name):
+                cache.return_port(port)
+                released = True
+        if released:
+            self.ports_cached = False
+
+    async def launch_kernel(self, cmd, **kwargs):
+        member = None
+        if self._restarting is not None:
+            member = await self._resume_restarted()
+        if member is None and self.pool_size > 0:
+            member = self.pool.acquire()
+        if member is None:
+            return await super().launch_kernel(cmd, **kwargs)
+
+        cwd = kwargs.get("cwd")
+        await member.adopt(cwd, kwargs.get("env"))
+        self.release_ports(member)
+
+        self.process = member.process
+        self.pid = member.process.pid
+        self.pgid = None
+        if hasattr(os, "getpgid"):
+            try:
+                self.pgid = os.getpgid(self.pid)
+            except OSError:
+                pass
+        self.cwd = cwd or Path.cwd()
+        if member.connection_file is not None:
+            Path(member.connection_file).unlink(missing_ok=True)
+
+        # The kernel manager rewrites its connection file with this.
+        self.connection_info = member.connection_info
+        return self.connection_info
@@ -0,0 +1,51 @@
+import struct
+import zlib
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from .bl_image import downscale, encode_image, encode_png, to_uint8  # noqa
+
+
+def decode_png(data):
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    pos = 8
+    chunks = {}
+    while pos < len(data):
+        (length,) = struct.unpack(">I", data[pos : pos + 4])
+        kind = data[pos + 4 : pos + 8]
+        chunks[kind] = data[pos + 8 : pos + 8 + length]
+        pos += length + 12
+    width, height = struct.unpack(">II", chunks[b"IHDR"][:8])
+    raw = np.frombuffer(zlib.decompress(chunks[b"IDAT"]), dtype=np.uint8)
+    rows = raw.reshape(height, -1)
+    assert (rows[:, 0] == 0).all()
+    return rows[:, 1:].reshape(height, width, -1)
+
+
+def test_encode_png():
+    image = np.arange(2 * 3 * 4, dtype=np.uint8).reshape(2, 3, 4)
+    assert (decode_png(encode_png(image)) == image).all()
+
+
+def test_to_uint8():
+    pixels = np.array([[[0.0, 0.5, 1.0, 1.0]], [[1.0, 1.0, 1.0, 2.0]]])
+    image = to_uint8(pixels)
+    # Bottom-up rows are flipped
+    assert image.tolist() == [[[255, 255, 255, 255]], [[0, 128, 255, 255]]]
+
+
+def test_downscale():
+    pixels = np.ones((300, 200, 4), dtype=np.float32)
+    assert downscale(pixels, 100).shape == (100, 66, 4)
+    assert downscale(pixels, 1000) is pixels
+
+
+def test_encode_image_size_cap():
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 255, (256, 256, 3), dtype=np.uint8)
+    data, fmt = encode_image(image, max_bytes=20000)
+    assert len(data) <= 20000
+    if fmt == "png":
+        assert decode_png(data).shape[0] < 256
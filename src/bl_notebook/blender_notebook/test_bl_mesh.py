@@ -0,0 +1,65 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from .bl_mesh import (  # noqa
+    decimate,
+    render_points,
+    transform_points,
+    vertex_normals,
+)
+
+
+def make_grid(size):
+    xs, ys = np.meshgrid(np.arange(size), np.arange(size))
+    positions = np.stack(
+        [xs.ravel(), ys.ravel(), np.zeros(size * size)], axis=1
+    ).astype(np.float32)
+    quads = np.arange(size - 1)[None, :] + size * np.arange(size - 1)[:, None]
+    quads = quads.ravel()
+    triangles = np.concatenate(
+        [
+            np.stack([quads, quads + 1, quads + size], axis=1),
+            np.stack([quads + 1, quads + size + 1, quads + size], axis=1),
+        ]
+    )
+    return positions, triangles
+
+
+def test_vertex_normals():
+    positions, triangles = make_grid(4)
+    normals = vertex_normals(positions, triangles)
+    assert np.allclose(normals, [0, 0, 1])
+
+
+def test_decimate():
+    positions, triangles = make_grid(100)
+    result, result_triangles = decimate(positions, triangles, 1000)
+    assert len(result) <= 1000
+    assert len(result_triangles) > 0
+    assert result_triangles.max() < len(result)
+
+    same = decimate(positions, triangles, len(positions))
+    assert same[0] is positions
+
+
+def test_transform_points():
+    matrix = np.eye(4)
+    matrix[:3, 3] = [1, 2, 3]
+    points = np.zeros((2, 3), dtype=np.float32)
+    assert np.allclose(transform_points(points, matrix), [1, 2, 3])
+
+
+def test_render_points():
+    positions, triangles = make_grid(8)
+    # Stand the grid up, facing the view
+    positions = positions[:, [0, 2, 1]]
+    normals = vertex_normals(positions, triangles)
+    pixels = render_points(positions, normals, 64, 48, yaw=0, pitch=0)
+    assert pixels.shape == (48, 64, 4)
+    covered = pixels[..., 3] > 0
+    assert covered.sum() > 8 * 8
+    # A flat grid is shaded evenly
+    shade = pixels[covered, 0]
+    assert np.allclose(shade, shade[0]) and 0.15 < shade[0] <= 0.9
+    assert render_points(positions[:0], normals[:0])[..., 3].max() == 0
@@ -0,0 +1,95 @@
+import io
+import time
+
+from .bl_output import CoalescedStream
+
+
+class Target(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+        self.parent = None
+
+    def write(self, text):
+        self.writes += 1
+        return super().write(text)
+
+    def set_parent(self, parent):
+        self.parent = (parent, self.getvalue())
+
+
+def test_batching():
+    target = Target()
+    stream = CoalescedStream(target, "stdout", flush_interval=60)
+    for i in range(1000):
+        print(i, file=stream)
+    assert target.writes == 0
+    stream.flush()
+    assert target.writes == 1
+    assert target.getvalue().splitlines() == [str(i) for i in range(1000)]
+
+
+def test_flush_size():
+    target = Target()
+    stream = CoalescedStream(
+        target, "stdout", flush_interval=60, flush_size=100
+    )
+    stream.write("x" * 60)
+    assert target.writes == 0
+    stream.write("x" * 60)
+    assert target.writes == 1
+    stream.flush()
+
+
+def test_flush_interval():
+    target = Target()
+    stream = CoalescedStream(target, "stdout", flush_interval=0.01)
+    for i in range(3):
+        stream.write(f"{i}\n")
+        deadline = time.monotonic() + 5
+        while target.writes <= i and time.monotonic() < deadline:
+            time.sleep(0.005)
+        assert target.writes == i + 1
+    # One flush thread for all batches
+    thread = stream._thread
+    stream.write("3\n")
+    stream.flush()
+    assert stream._thread is thread
+    assert target.getvalue() == "0\n1\n2\n3\n"
+
+
+def test_set_parent():
+    target = Target()
+    stream = CoalescedStream(target, "stdout", flush_interval=60)
+    stream.write("before")
+    stream.set_parent({"header": {"msg_id": "1"}})
+    # Pending output belongs to the previous parent
+    assert target.parent == ({"header": {"msg_id": "1"}}, "before")
+    # Other attributes are those of the target
+    assert stream.writes == target.writes
+
+
+def test_truncate(tmp_path):
+    target = Target()
+    stream = CoalescedStream(
+        target, "stdout", log_dir=tmp_path, max_lines=10, tail_lines=3
+    )
+    stream.begin_cell(1)
+    for i in range(100):
+        print(f"line {i}", file=stream)
+    stream.write("partial")
+    stream.end_cell()
+
+    lines = target.getvalue().splitlines()
+    assert lines[:10] == [f"line {i}" for i in range(10)]
+    assert lines[10].startswith("[... 88 lines omitted")
+    assert lines[11:] == ["line 98", "line 99", "partial"]
+
+    log = (tmp_path / "cell-1-stdout.log").read_text()
+    assert log.splitlines() == [f"line {i}" for i in range(100)] + ["partial"]
+
+    # The next cell starts with a new budget
+    stream.begin_cell(2)
+    print("next", file=stream)
+    stream.end_cell()
+    assert target.getvalue().endswith("partial\nnext\n")
@@ -0,0 +1,50 @@
+import time
+
+from . import bl_prof
+from .bl_prof import profile, split_options
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_profile(tmp_path):
+    folded = tmp_path / "cell.folded"
+    result = profile(
+        "busy(0.1)", {"busy": busy}, folded_path=folded, trace=False
+    )
+    assert result.elapsed >= 0.1
+    assert any(row["name"].startswith("busy ") for row in result.functions)
+    assert "busy (test_bl_prof.py" in folded.read_text()
+    assert "<table>" in result._repr_html_()
+
+
+def test_sample_mode():
+    result = profile("busy(0.1)", {"busy": busy}, mode="sample", trace=False)
+    rows = {row["name"].split()[0]: row for row in result.functions}
+    assert rows["<module>"]["total"] > 0
+    assert rows["busy"]["self"] > 0
+
+
+def test_sample_sort():
+    result = profile(
+        "busy(0.1)", {"busy": busy}, mode="sample", sort="name", trace=False
+    )
+    names = [row["name"] for row in result.functions]
+    assert names == sorted(names)
+
+
+def test_no_sampler(monkeypatch):
+    # cProfile without a stacks file does not sample
+    monkeypatch.setattr(bl_prof, "Sampler", None)
+    result = profile("busy(0.01)", {"busy": busy}, trace=False)
+    assert result.folded_path is None
+    assert result.functions
+
+
+def test_split_options():
+    options, statement = split_options('-s tottime f(x, "a b")')
+    assert options == ["-s", "tottime"]
+    assert statement == 'f(x, "a b")'
@@ -0,0 +1,58 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from . import bl_shared  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def shm_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("BL_NOTEBOOK_SHM_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_publish_attach():
+    data = np.arange(12, dtype=np.float32).reshape(4, 3)
+    with bl_shared.publish("points", data) as shared:
+        attached = bl_shared.attach("points")
+        assert (attached.array == data).all()
+        assert not attached.array.flags.writeable
+
+        # The mapping is shared, not copied
+        shared.array[0, 0] = 100.0
+        assert attached.array[0, 0] == 100.0
+        assert bl_shared.list_arrays()["points"]["shape"] == [4, 3]
+
+        with pytest.raises(FileExistsError):
+            bl_shared.create("points", (1,))
+
+    # The owner unlinks it when closed
+    assert "points" not in bl_shared.list_arrays()
+
+
+def test_overwrite_attached(shm_dir):
+    first = bl_shared.publish("grid", np.zeros(3))
+    attached = bl_shared.attach("grid")
+    second = bl_shared.publish("grid", np.ones(3), overwrite=True)
+    # The old mapping stays valid, new attachments see the new array
+    assert (attached.array == 0).all()
+    assert (bl_shared.attach("grid").array == 1).all()
+    assert len(list(shm_dir.glob("*.npy"))) == 1
+    # The previous owner does not remove its successor
+    first.close()
+    assert (bl_shared.attach("grid").array == 1).all()
+    second.close()
+    assert list(shm_dir.iterdir()) == []
+
+
+def test_persistent_and_ttl():
+    shared = bl_shared.create("kept", (2,), persistent=True, ttl=0)
+    shared.close()
+    assert "kept" in bl_shared.list_arrays()
+    assert bl_shared.cleanup() == ["kept"]
+    assert bl_shared.list_arrays() == {}
+
+
+def test_invalid_name():
+    with pytest.raises(ValueError):
+        bl_shared.create("../x", (1,))
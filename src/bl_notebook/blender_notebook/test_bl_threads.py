@@ -0,0 +1,38 @@
+import pytest
+
+from . import bl_threads
+
+
+def test_parse_cpus():
+    assert bl_threads.parse_cpus("0-3, 8,2") == [0, 1, 2, 3, 8]
+    assert bl_threads.format_cpus([0, 1, 2, 3, 8]) == "0-3,8"
+
+
+def test_auto_cpus():
+    cpus = list(range(8))
+    assert bl_threads.auto_cpus(cpus, []) == cpus
+    first = {"cpus": [0, 1, 2, 3]}
+    assert bl_threads.auto_cpus(cpus, [first]) == [4, 5, 6, 7]
+    # Unpinned processes use all CPUs
+    assert len(bl_threads.auto_cpus(cpus, [first, {}])) == 2
+
+
+def test_get_budget(monkeypatch):
+    monkeypatch.setattr(bl_threads, "get_cpus", lambda: list(range(8)))
+    assert bl_threads.get_budget() == (0, None)
+    assert bl_threads.get_budget(4) == (4, None)
+    assert bl_threads.get_budget(0, "2-3") == (2, [2, 3])
+    assert bl_threads.get_budget("auto", None, [{"cpus": [0, 1]}] * 3) == (
+        2,
+        [2, 3],
+    )
+    with pytest.raises(ValueError):
+        bl_threads.get_budget(0, "16-31")
+
+
+def test_budget():
+    budget = bl_threads.Budget(2, [0, 1])
+    threads, cpus = budget
+    assert (threads, cpus) == (2, [0, 1])
+    assert budget.env()["OMP_NUM_THREADS"] == "2"
+    assert bl_threads.Budget(0, None).env() == {}
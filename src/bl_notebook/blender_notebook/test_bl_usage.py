@@ -0,0 +1,60 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from . import bl_usage
+
+
+def test_measure(tmp_path):
+    path = tmp_path / "usage.jsonl"
+    with bl_usage.measure(path, version="3.6.0"):
+        subprocess.run([sys.executable, "-c", "sum(range(10**6))"])
+    with pytest.raises(SystemExit):
+        with bl_usage.measure(path, version="4.0.0"):
+            sys.exit(2)
+
+    # A start record and an end record for each session
+    assert len(path.read_text().splitlines()) == 4
+    records = bl_usage.read_records(path)
+    assert [x["exit"] for x in records] == [0, 2]
+    assert records[0]["wall"] > 0
+    assert records[0]["cpu_user"] + records[0]["cpu_system"] > 0
+
+    rows = bl_usage.summarize(records, "version")
+    assert [(x["version"], x["failed"]) for x in rows] == [
+        ("3.6.0", 0),
+        ("4.0.0", 1),
+    ]
+    assert "sessions" in bl_usage.format_table(rows)
+
+
+def test_lost_session(tmp_path):
+    path = tmp_path / "usage.jsonl"
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    record = bl_usage.new_record("kernel", pid=process.pid)
+    path.write_text(json.dumps(record) + "\n")
+    records = bl_usage.read_records(path)
+    assert records[0]["exit"] == "lost"
+    assert bl_usage.running_records(records) == []
+
+
+def test_reserve(tmp_path):
+    path = tmp_path / "usage.jsonl"
+
+    def get_budget(records):
+        # Next to the previous reservations
+        return 2, [2 * len(records), 2 * len(records) + 1]
+
+    first, record = bl_usage.reserve(path, get_budget)
+    second, _ = bl_usage.reserve(path, get_budget)
+    assert (first, second) == ((2, [0, 1]), (2, [2, 3]))
+    assert record["cpus"] == [0, 1]
+
+    with bl_usage.measure(path, record=record):
+        pass
+    # The start record of measure() is the reserved one
+    assert len(path.read_text().splitlines()) == 3
+    assert len(bl_usage.running_records(bl_usage.read_records(path))) == 1
@@ -0,0 +1,57 @@
+from . import installer
+
+
+def make_python(tmp_path, packages):
+    bindir = tmp_path / "python" / "bin"
+    bindir.mkdir(parents=True)
+    python = bindir / "python3.10"
+    python.write_bytes(b"")
+    site_packages = tmp_path / "python/lib/python3.10/site-packages"
+    site_packages.mkdir(parents=True)
+    for name in packages:
+        (site_packages / f"{name}.dist-info").mkdir()
+    return python
+
+
+def test_find_package_versions(tmp_path):
+    python = make_python(tmp_path, ["ipykernel-6.29.0", "typing_extensions-4"])
+    assert installer.find_package_versions(
+        python, ["ipykernel", "typing-extensions>=4", "numpy"]
+    ) == {"ipykernel": "6.29.0", "typing-extensions>=4": "4", "numpy": None}
+
+    # Installed versions which do not satisfy the specifiers are missing
+    assert installer.find_package_versions(
+        python, ["ipykernel>=6.29,<7", "ipykernel>=7", "ipykernel==6.*"]
+    ) == {
+        "ipykernel>=6.29,<7": "6.29.0",
+        "ipykernel>=7": None,
+        "ipykernel==6.*": "6.29.0",
+    }
+
+
+def test_fingerprint(tmp_path):
+    python = make_python(tmp_path, ["ipykernel-6.29.0"])
+    blender = tmp_path / "blender"
+    blender.write_bytes(b"")
+
+    def fingerprint(**options):
+        return installer.get_fingerprint(
+            blender, python, ["ipykernel"], options
+        )
+
+    first = fingerprint(pool_size=0)
+    assert fingerprint(pool_size=0) == first
+    assert fingerprint(pool_size=2) != first
+
+    kernel_path = tmp_path / "kernel"
+    installer.write_kernel(kernel_path, blender, pool_size=0)
+    assert installer.read_fingerprint(kernel_path) is None
+    installer.write_fingerprint(kernel_path, first)
+    assert installer.read_fingerprint(kernel_path) == first
+
+    # Upgrading ipykernel changes the fingerprint
+    site_packages = python.parent.parent / "lib/python3.10/site-packages"
+    (site_packages / "ipykernel-6.29.0.dist-info").rename(
+        site_packages / "ipykernel-7.0.dist-info"
+    )
+    assert fingerprint(pool_size=0) != first
@@ -0,0 +1,166 @@
+import asyncio
+import types
+
+import pytest
+
+pytest.importorskip("jupyter_client")
+
+from jupyter_client.connect import LocalPortCache  # noqa: E402
+
+from . import provisioner  # noqa: E402
+from .provisioner import (  # noqa: E402
+    PORT_NAMES,
+    BlenderPoolProvisioner,
+    KernelPool,
+    PoolMember,
+)
+
+
+class Process:
+    def __init__(self, pid=1000):
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.returncode = -15
+
+
+class Client:
+    def __init__(self, executed):
+        self.executed = executed
+
+    def start_channels(self):
+        pass
+
+    def stop_channels(self):
+        pass
+
+    async def wait_for_ready(self, timeout):
+        pass
+
+    async def execute_interactive(self, code, **kwargs):
+        self.executed.append(code)
+
+
+class Member(PoolMember):
+    def __init__(self, connection_info=None, env=None):
+        super().__init__(Process(), None, connection_info or {}, env)
+        self.executed = []
+
+    def make_client(self):
+        return Client(self.executed)
+
+
+def ports(first):
+    return {name: first + i for i, name in enumerate(PORT_NAMES)}
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(provisioner, "POOL_MAINTAIN_INTERVAL", 0.01)
+    monkeypatch.setattr(provisioner, "get_available_memory", lambda: None)
+    spec = types.SimpleNamespace(resource_dir="/kernels/blender")
+    pool = KernelPool(spec, size=2, demand_window=600, min_available_memory=0)
+
+    def spawn():
+        member = Member()
+        pool.members.append(member)
+        return member
+
+    pool.spawn = spawn
+    yield pool
+    pool.shutdown()
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0.02)
+
+
+def test_acquire_refill(pool):
+    async def run():
+        # Nothing is ready at the first start, it starts the refill
+        assert pool.acquire() is None
+        await settle()
+        assert len(pool.members) == 1
+
+        member = pool.acquire()
+        assert member is not None and member.ready
+        # The pool follows the demand, up to its size
+        await settle()
+        assert len(pool.members) == 2
+        pool.acquire()
+        pool.acquire()
+        await settle()
+        assert len(pool.members) == 2
+
+        # Dead members are replaced
+        pool.members[0].process.returncode = 1
+        pool.start()
+        await settle()
+        assert all(x.is_alive() for x in pool.members)
+
+        # No demand, no members
+        pool.demand.clear()
+        pool.start()
+        await settle()
+        assert pool.members == []
+
+    asyncio.run(run())
+
+
+def test_adopt():
+    member = Member(env={"JPY_SESSION_NAME": "a.ipynb", "HOME": "/home"})
+
+    async def run():
+        await member.adopt(
+            "/work", {"JPY_SESSION_NAME": "b.ipynb", "HOME": "/home"}
+        )
+        await member.adopt(None, {"JPY_SESSION_NAME": "b.ipynb"})
+
+    asyncio.run(run())
+    # Only the changed variables are set, and only once
+    assert len(member.executed) == 1
+    code = member.executed[0]
+    assert "'JPY_SESSION_NAME': 'b.ipynb'" in code
+    assert "HOME" not in code
+    assert "_os.chdir('/work')" in code
+    assert member.env["JPY_SESSION_NAME"] == "b.ipynb"
+
+
+@pytest.fixture
+def cache():
+    cache = LocalPortCache.instance()
+    saved = set(cache.currently_used_ports)
+    yield cache
+    cache.currently_used_ports = saved
+
+
+def test_release_pre_launch_ports(cache):
+    pre_launch = ports(41000)
+    cache.currently_used_ports.update(pre_launch.values())
+    prov = BlenderPoolProvisioner(kernel_id="k", pool_size=0)
+    prov.connection_info = dict(pre_launch)
+    prov.ports_cached = True
+
+    # A pool member has its own ports, the allocated ones are returned
+    prov.release_ports(Member(ports(42000)))
+    assert not cache.currently_used_ports & set(pre_launch.values())
+    assert not prov.ports_cached
+
+
+def test_keep_ports_of_soft_restart(cache):
+    running = ports(43000)
+    cache.currently_used_ports.update(running.values())
+    prov = BlenderPoolProvisioner(kernel_id="k", pool_size=0)
+    # pre_launch of the restart reuses the cached ports of the kernel
+    prov.connection_info = dict(running)
+    prov.ports_cached = True
+
+    prov.release_ports(Member(dict(running)))
+    assert set(running.values()) <= cache.currently_used_ports
+    # Returned when the provisioner is cleaned up
+    assert prov.ports_cached
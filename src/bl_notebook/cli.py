@@ -1,3 +1,4 @@
+import contextlib
 import platform
 import re
 import sys
@@ -9,11 +10,24 @@ from .blender.arch import Architecture
 from .blender.criteria import Criteria
 from .blender.install_app import BlenderNotFound, get_blender_install
 from .blender.ostype import OSType
+from .blender.prewarm import prewarm
+from .blender.repack import repack_cached_archives
 from .blender.repository import Repository
 from .blender.version import Version
-from .config import Config
+from .blender_notebook.bl_threads import blender_args, get_budget
+from .blender_notebook.bl_usage import (
+    USAGE_LOG_NAME,
+    format_table,
+    measure,
+    read_records,
+    reserve,
+    running_records,
+    summarize,
+)
+from .config import PROFILE_PREFIX, Config
 from .notebook import NotebookManager
 from .util import get_ip_address_win, is_win32, print_error, run_command
+from .wheelhouse import WHEELHOUSE_DIR_NAME, Wheelhouse
 
 config = Config()
 
@@ -80,6 +94,11 @@ def get_parameter_non_default(name):
 )
 @click.option("-r", "--remote", is_flag=True, help="Remote mode (with -l).")
 @click.option("-I", "--install", is_flag=True, help="Only install blender.")
+@click.option(
+    "--warm",
+    is_flag=True,
+    help="Only prewarm the page cache for blender startup.",
+)
 @click.option(
     "-l",
     "--list",
@@ -100,6 +119,11 @@ def get_parameter_non_default(name):
 @click.option(
     "--clean", is_flag=True, help="Remove all kernels created by this command."
 )
+@click.option(
+    "--repack",
+    is_flag=True,
+    help="Re-pack cached archives into seekable zstd for fast reinstall.",
+)
 @click.option(
     "-s",
     "--search-path",
@@ -142,7 +166,23 @@ def get_parameter_non_default(name):
     help="Run jupyter lab or notebook.",
 )
 @click.option("--no-update-kernel", is_flag=True, help="No update kernel.")
+@click.option(
+    "--bench-startup",
+    is_flag=True,
+    help="Measure cold and warm start of the kernels (-a for all versions).",
+)
+@click.option(
+    "--usage",
+    "show_usage",
+    is_flag=True,
+    help="Show resource usage of blender sessions and kernels.",
+)
 @click.option("--only-update-kernel", is_flag=True, help="Only update kernel.")
+@click.option(
+    "--sync-kernels",
+    is_flag=True,
+    help="Update the kernels of all installed blenders, remove the others.",
+)
 @click.option(
     "--lab", "--force-lab", "force_lab", is_flag=True, help="Run jupyter lab."
 )
@@ -157,7 +197,23 @@ def get_parameter_non_default(name):
     "-m",
     "--mirror",
     default=config.get("blender", "mirror"),
-    help="Blender mirror site.",
+    help="Blender mirror site, local directory or file:// URL.",
+)
+@click.option(
+    "--no-mirror-copy",
+    is_flag=True,
+    default=not config.getboolean("blender", "mirror_copy"),
+    help="Extract archives on a local mirror without copying.",
+)
+@click.option(
+    "--threads",
+    default=config.get("blender", "threads"),
+    help='Thread budget of blender (0 for all cores, or "auto").',
+)
+@click.option(
+    "--cpus",
+    default=config.get("blender", "cpus") or None,
+    help='CPUs to run blender on (e.g., "0-3", or "auto").',
 )
 @click.option("--ip", "--listen", "listen_address", help="Listen address.")
 @click.option("-P", "--password", help="Password.")
@@ -181,11 +237,13 @@ def main(
     remote,
     strict,
     install,
+    warm,
     list_blender,
     list_kernel,
     list_all,
     remove_kernel,
     clean,
+    repack,
     search_path,
     architectures,
     ostypes,
@@ -193,10 +251,16 @@ def main(
     run_blender,
     run_jupyter,
     no_update_kernel,
+    bench_startup,
+    show_usage,
     only_update_kernel,
+    sync_kernels,
     force_lab,
     force_notebook,
     mirror,
+    no_mirror_copy,
+    threads,
+    cpus,
     listen_address,
     password,
     no_password,
@@ -269,6 +333,9 @@ def main(
                 run_jupyter = True
                 break
 
+    if bench_startup:
+        run_jupyter = True
+
     run_blender = run_blender or not run_jupyter
     update_kernel = not run_blender and (
         not no_update_kernel or only_update_kernel
@@ -291,7 +358,16 @@ def main(
             blender_version = None
 
     # Jupyter notebook manager
-    notebook = NotebookManager(verbose=verbose, dry_run=dry_run)
+    wheelhouse = None
+    if config.getboolean("main", "wheelhouse"):
+        wheelhouse = Wheelhouse(
+            Path(config.get("main", "cache_dir")) / WHEELHOUSE_DIR_NAME,
+            verbose=verbose,
+            dry_run=dry_run,
+        )
+    notebook = NotebookManager(
+        verbose=verbose, dry_run=dry_run, wheelhouse=wheelhouse
+    )
 
     # Blender repository
     repository = Repository(
@@ -301,8 +377,84 @@ def main(
         cache_dir=config.get("main", "cache_dir"),
         ext_re=ext_re,
         strict=strict,
+        mirror_copy=not no_mirror_copy,
     )
 
+    # Usage log of blender sessions and kernels
+    usage_log = None
+    if config.getboolean("main", "usage_log"):
+        usage_log = Path(config.get("main", "cache_dir")) / USAGE_LOG_NAME
+
+    # Kernel for each launch profile
+    profiles = [None] + config.get_profiles()
+
+    def get_kernel_options(profile):
+        """Options of notebook.install_kernel() for a launch profile"""
+        if profile is None:
+            section = "kernel"
+        else:
+            section = PROFILE_PREFIX + profile
+
+        def get_option(option, method=config.get):
+            # Kernel options of the profile default to [kernel]
+            return method(section, option, fallback=method("kernel", option))
+
+        def get_list(option):
+            return get_option(option).split()
+
+        return dict(
+            pool_size=get_option("pool_size", config.getint),
+            preload_modules=get_list("preload_modules"),
+            soft_restart=get_option("soft_restart", config.getboolean),
+            restart_template=get_option("restart_template"),
+            factory_startup=get_option("factory_startup", config.getboolean),
+            background=get_option("background", config.getboolean),
+            addons=get_list("addons"),
+            disable_addons=get_list("disable_addons"),
+            threads=get_option("threads"),
+            cpus=get_option("cpus"),
+            packages=get_list("packages"),
+            usage_log=usage_log,
+            cull_idle_timeout=get_option("cull_idle_timeout", config.getint),
+            idle_purge=get_option("idle_purge", config.getint),
+            memory_limit=get_option("memory_limit", config.getint),
+            checkpoint_dir=Path(config.get("main", "cache_dir"))
+            / "checkpoints",
+            restore_checkpoint=get_option(
+                "restore_checkpoint", config.getboolean
+            ),
+            prewarm_cache_dir=(
+                config.get("main", "cache_dir")
+                if config.getboolean("blender", "prewarm")
+                else None
+            ),
+        )
+
+    # --sync-kernels
+    if sync_kernels:
+        try:
+            updated = notebook.sync_kernels(
+                [x for x in repository.local.versions if x.is_ok()],
+                get_kernel_options,
+                profiles,
+            )
+        except OSError as exc:
+            print_error(exc)
+            sys.exit(1)
+        print_error(f"{len(updated)} kernels updated.")
+        sys.exit(0)
+
+    # --usage
+    if show_usage:
+        if usage_log is None:
+            print_error("The usage log is disabled (usage_log in [main]).")
+            sys.exit(1)
+        records = read_records(usage_log)
+        for key in ("version", "notebook", "user"):
+            print(format_table(summarize(records, key)))
+            print()
+        sys.exit(0)
+
     # --list-kernel
     if list_kernel:
         for entry in notebook.kernel_directories():
@@ -314,6 +466,13 @@ def main(
         notebook.remove_kernel_all()
         sys.exit(0)
 
+    # --repack
+    if repack:
+        repack_cached_archives(
+            repository.remote.apps_root, verbose=verbose, dry_run=dry_run
+        )
+        sys.exit(0)
+
     if verbose:
         print_error("Blender search path is {}".format(search_path))
 
@@ -424,6 +583,16 @@ def main(
     if verbose:
         print_error(f"Blender found: {blender.executable}")
 
+    # --warm
+    if warm:
+        prewarm(
+            blender,
+            config.get("main", "cache_dir"),
+            verbose=verbose,
+            dry_run=dry_run,
+        )
+        sys.exit(0)
+
     if verbose and (update_kernel or remove_kernel or run_jupyter):
         print_error(
             "Target kernel path is" f" {notebook.kernel_root / blender.name}"
@@ -447,29 +616,94 @@ def main(
 
     # --remove-kernel
     if remove_kernel or only_update_kernel:
-        notebook.remove_kernel(blender.name, ignore_missing=not remove_kernel)
+        for profile in profiles:
+            notebook.remove_kernel(
+                notebook.get_kernel_name(blender, profile),
+                ignore_missing=not remove_kernel or profile is not None,
+            )
         if not only_update_kernel:
             sys.exit(0)
 
     # Install blender kernel
     if update_kernel:
-        try:
-            notebook.install_kernel(
-                blender,
-                interactive=False,
-            )
+        for profile in profiles:
+            try:
+                notebook.install_kernel(
+                    blender,
+                    interactive=False,
+                    profile=profile,
+                    **get_kernel_options(profile),
+                )
 
-        except OSError as exc:
-            print_error(exc)
-            sys.exit(1)
+            except OSError as exc:
+                print_error(exc)
+                sys.exit(1)
 
     if only_update_kernel:
         sys.exit(0)
 
+    # --bench-startup
+    if bench_startup:
+        from .benchmark import bench_startup as run_bench_startup
+
+        if list_all:
+            kernel_dirs = notebook.blender_kernel_directories()
+        else:
+            kernel_dirs = [
+                notebook.kernel_root / notebook.get_kernel_name(blender, x)
+                for x in profiles
+            ]
+        run_bench_startup(
+            kernel_dirs, config.get("main", "cache_dir"), verbose=verbose
+        )
+        sys.exit(0)
+
     # Run blender
     if not run_jupyter:
-        cmd = [str(blender.executable)] + args
-        run_command(cmd, verbose=verbose, dry_run=dry_run, fail_on_exit=True)
+        if config.getboolean("blender", "prewarm"):
+            # Readahead recorded startup files alongside the launch
+            prewarm(
+                blender,
+                config.get("main", "cache_dir"),
+                record=False,
+                background=True,
+                verbose=verbose,
+                dry_run=dry_run,
+            )
+
+        # Share the CPUs with the running blender processes
+        def get_session_budget(records=()):
+            return get_budget(threads, cpus, records)
+
+        try:
+            if usage_log is None:
+                budget = get_session_budget()
+                usage = contextlib.nullcontext()
+            elif dry_run:
+                records = running_records(read_records(usage_log))
+                budget = get_session_budget(records)
+                usage = contextlib.nullcontext()
+            else:
+                # Chosen and recorded at once for concurrent launches
+                budget, record = reserve(
+                    usage_log,
+                    get_session_budget,
+                    version=str(blender.version),
+                )
+                usage = measure(usage_log, record=record)
+        except ValueError as exc:
+            print_error(f"Bad option value for --cpus: {exc}")
+            sys.exit(1)
+        threads, cpus = budget
+        cmd = [str(blender.executable)] + blender_args(threads) + args
+        with usage:
+            run_command(
+                cmd,
+                verbose=verbose,
+                dry_run=dry_run,
+                fail_on_exit=True,
+                budget=budget,
+            )
         sys.exit(0)
 
     # Target frontends
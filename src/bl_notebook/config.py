@@ -6,6 +6,9 @@ from bl_notebook.util import is_win32
 
 PREFIX = "BL_NOTEBOOK_"
 
+# Section name prefix of kernel launch profiles, e.g., [profile:fast]
+PROFILE_PREFIX = "profile:"
+
 
 def get_default_config_path():
     return os.getenv(
@@ -56,12 +59,35 @@ def _get_default_config() -> dict:
     return {
         "main": {
             "cache_dir": path_config.cache_dir,
+            "usage_log": "yes",
+            "wheelhouse": "yes",
         },
         "blender": {
             "version": "",
             "apps_root": path_config.apps_root,
             "search_path": path_config.search_path,
             "mirror": path_config.mirror,
+            "mirror_copy": "yes",
+            "prewarm": "yes",
+            "threads": "0",
+            "cpus": "",
+        },
+        "kernel": {
+            "pool_size": "0",
+            "preload_modules": "",
+            "soft_restart": "no",
+            "restart_template": "",
+            "factory_startup": "no",
+            "background": "no",
+            "addons": "",
+            "disable_addons": "",
+            "threads": "0",
+            "cpus": "",
+            "packages": "ipywidgets anywidget",
+            "cull_idle_timeout": "0",
+            "idle_purge": "0",
+            "memory_limit": "0",
+            "restore_checkpoint": "no",
         },
     }
 
@@ -97,5 +123,17 @@ class Config:
     def getfloat(self, section, option, **kwargs):
         return self.config.getfloat(section, option, **kwargs)
 
+    def getboolean(self, section, option, **kwargs):
+        return self.config.getboolean(section, option, **kwargs)
+
     def set(self, section, option, value):  # noqa: A003
         self.config.set(section, option, value)
+
+    def get_profiles(self):
+        """Names of the kernel launch profiles"""
+        names = []
+        for section in self.config.sections():
+            prefix, _, name = section.partition(PROFILE_PREFIX)
+            if prefix == "" and name:
+                names.append(name)
+        return names
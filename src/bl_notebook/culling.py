@@ -0,0 +1,122 @@
+"""
+Kernel manager of jupyter server with per-kernelspec idle culling.
+
+Jupyter server culls idle kernels with a single timeout for all of them.
+Blender kernels hold hundreds of MB to several GB each, so their
+kernelspecs set their own timeout in the metadata (see installer.py):
+
+    "metadata": {"bl_notebook": {"cull_idle_timeout": 3600}}
+
+Kernels of the other kernelspecs are culled by cull_idle_timeout of the
+manager as usual. Blender kernels above their memory limit ask to be culled
+by writing bl-cull-<pid>.json next to their connection file (see
+MemoryMonitor in kernel.py); they are shut down when they are not busy.
+
+The manager is a jupyter_server one, so culling works in jupyter lab but not
+in the classic notebook (notebook < 7).
+"""
+
+import json
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from jupyter_server.services.kernels.kernelmanager import (
+    AsyncMappingKernelManager,
+)
+
+from .notebook import CULL_INTERVAL
+
+CULL_REQUEST_NAME = "bl-cull-{pid}.json"
+
+
+def get_cull_request_path(connection_file, pid):
+    return Path(connection_file).with_name(CULL_REQUEST_NAME.format(pid=pid))
+
+
+class BlenderKernelManager(AsyncMappingKernelManager):
+    def initialize_culler(self):
+        # The culler also runs for the timeouts of the kernelspecs
+        timeout = self.cull_idle_timeout
+        if timeout <= 0:
+            self.cull_idle_timeout = CULL_INTERVAL
+        try:
+            super().initialize_culler()
+        finally:
+            self.cull_idle_timeout = timeout
+
+    def get_cull_options(self, kernel):
+        """Return (cull_idle_timeout, cull_connected) of a kernel"""
+        try:
+            spec = self.kernel_spec_manager.get_kernel_spec(kernel.kernel_name)
+        except Exception:
+            metadata = {}
+        else:
+            metadata = spec.metadata.get("bl_notebook", {})
+        if "cull_idle_timeout" not in metadata:
+            return self.cull_idle_timeout, self.cull_connected
+        # Forgotten tabs keep blender kernels connected
+        return metadata["cull_idle_timeout"], True
+
+    async def cull_kernel_if_idle(self, kernel_id):
+        kernel = self._kernels.get(kernel_id)
+        if kernel is None:
+            return
+
+        pid = getattr(kernel.provisioner, "pid", None)
+        if pid is not None and kernel.connection_file:
+            path = get_cull_request_path(kernel.connection_file, pid)
+            state = getattr(kernel, "execution_state", None)
+            if path.exists() and state != "busy":
+                try:
+                    request = json.loads(path.read_text())
+                except (OSError, ValueError):
+                    request = {}
+                self.log.warning(
+                    "Culling kernel %s (%s) on request: %s",
+                    kernel.kernel_name,
+                    kernel_id,
+                    request.get("reason", "unknown"),
+                )
+                path.unlink(missing_ok=True)
+                await self.shutdown_kernel(kernel_id)
+                return
+
+        timeout, connected = self.get_cull_options(kernel)
+        if timeout <= 0:
+            return
+        await self.cull_if_idle(kernel_id, kernel, timeout, connected)
+
+    async def cull_if_idle(self, kernel_id, kernel, timeout, connected):
+        """Cull a kernel idle for timeout seconds
+
+        As cull_kernel_if_idle() of jupyter server, with the thresholds of
+        the kernel instead of those of the manager.
+        """
+        state = getattr(kernel, "execution_state", None)
+        if state == "dead":
+            self.log.warning(
+                "Culling dead kernel %s (%s)", kernel.kernel_name, kernel_id
+            )
+            await self.shutdown_kernel(kernel_id)
+            return
+        last_activity = getattr(kernel, "last_activity", None)
+        if last_activity is None:
+            return
+
+        idle = datetime.now(timezone.utc) - last_activity
+        connections = self._kernel_connections.get(kernel_id, 0)
+        if (
+            idle > timedelta(seconds=timeout)
+            and (self.cull_busy or state != "busy")
+            and (connected or not connections)
+        ):
+            self.log.warning(
+                "Culling '%s' kernel %s (%s) with %d connections"
+                " after %d seconds of inactivity",
+                state,
+                kernel.kernel_name,
+                kernel_id,
+                connections,
+                idle.total_seconds(),
+            )
+            await self.shutdown_kernel(kernel_id)
@@ -1,27 +1,50 @@
 import json
 import os
 import re
-import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import suppress
 from pathlib import Path
 from shutil import rmtree
 
 from jupyter_core.paths import jupyter_data_dir
 
+from .blender.prewarm import get_profile_path
+from .blender_notebook.installer import (
+    find_package_versions,
+    get_fingerprint,
+    get_widget_frontends,
+    read_fingerprint,
+    write_fingerprint,
+    write_kernel,
+)
 from .util import make_password, print_command, print_error, run_command, join_path_list
 
+# Seconds between checks of the idle kernel culler
+CULL_INTERVAL = 60
+
 
 class NotebookManager:
-    def __init__(self, data_dir=None, verbose=False, dry_run=False):
+    def __init__(
+        self, data_dir=None, verbose=False, dry_run=False, wheelhouse=None
+    ):
         self.data_dir = Path(data_dir or jupyter_data_dir())
         self.kernel_root = self.data_dir / "kernels"
         self.verbose = verbose
         self.dry_run = dry_run
+        # Installs the packages of blender's python offline (wheelhouse.py)
+        self.wheelhouse = wheelhouse
 
     def kernel_directories(self):
         return self.kernel_root.iterdir()
 
+    def get_kernel_name(self, blender, profile=None):
+        name = blender.name
+        if profile is not None:
+            # One kernel for each launch profile
+            name += "-" + profile
+        return re.sub(r"[^a-zA-Z0-9_.-]", "-", name)
+
     def remove_kernel(self, name, ignore_missing=False):
         kernel_path = self.kernel_root / name
 
@@ -42,15 +65,22 @@ class NotebookManager:
             except OSError as exc:
                 print_error(f"Can not delete {kernel_path}: {exc}")
 
-    def remove_kernel_all(self):
+    def blender_kernel_directories(self):
+        """Kernels created by this command"""
+        result = []
         for entry in self.kernel_directories():
             if re.match(r"blender[\d_-]", entry.name, re.I):
                 path = entry / "kernel.json"
                 with suppress(FileNotFoundError), open(path) as fh:
                     data = json.load(fh)
-                    tag = data.get("tag")
+                    tag = data.get("tag") or ""
                     if "bl_notebook" in tag.split(","):
-                        self.remove_kernel(entry)
+                        result.append(entry)
+        return result
+
+    def remove_kernel_all(self):
+        for entry in self.blender_kernel_directories():
+            self.remove_kernel(entry)
 
     def install_kernel(
         self,
@@ -59,73 +89,177 @@ class NotebookManager:
         # python_executable,
         # blender_executable,
         interactive=False,
+        pool_size=0,
+        preload_modules=(),
+        soft_restart=False,
+        restart_template=None,
+        profile=None,
+        factory_startup=False,
+        background=False,
+        addons=(),
+        disable_addons=(),
+        threads=0,
+        cpus=None,
+        packages=(),
+        usage_log=None,
+        cull_idle_timeout=0,
+        idle_purge=0,
+        memory_limit=0,
+        checkpoint_dir=None,
+        restore_checkpoint=False,
+        prewarm_cache_dir=None,
     ):
-        kernel_name = re.sub(r"[^a-zA-Z0-9_.-]", "-", blender.name)
-        installer = Path(__file__).parent / "blender_notebook" / "installer.py"
-        cmd = [
-            sys.executable,
-            installer,
-            "install",
-            "--kernel-name",
-            kernel_name,
-            "--kernel-dir",
-            str(self.kernel_root),
-            "--blender-exec",
-            str(blender.executable),
-            "--tag",
-            "bl_notebook",
-        ]
-        yes = not interactive
-        run_command(cmd, verbose=self.verbose, dry_run=self.dry_run, yes=yes)
+        """Write the kernelspec and install the packages of the kernel
 
+        Does nothing when the fingerprint of the kernelspec (see installer.py)
+        is unchanged. Returns True if the kernel was updated.
+        """
+        kernel_name = self.get_kernel_name(blender, profile)
+        kernel_path = self.kernel_root / kernel_name
+        options = dict(
+            tag="bl_notebook",
+            pool_size=pool_size,
+            preload=list(preload_modules),
+            soft_restart=soft_restart,
+            restart_template=restart_template,
+            factory_startup=factory_startup,
+            background=background,
+            addon=list(addons),
+            disable_addon=list(disable_addons),
+            threads=str(threads or 0),
+            cpus=str(cpus) if cpus else None,
+            usage_log=str(usage_log) if usage_log else None,
+            cull_idle_timeout=cull_idle_timeout,
+            idle_purge=idle_purge,
+            memory_limit=memory_limit,
+            checkpoint_dir=str(checkpoint_dir) if checkpoint_dir else None,
+            restore_checkpoint=restore_checkpoint,
+            prewarm_profile=None,
+            widgets=get_widget_frontends(),
+        )
+        if prewarm_cache_dir:
+            # Recorded by bl --warm or the first launch of blender
+            options["prewarm_profile"] = str(
+                get_profile_path(prewarm_cache_dir, blender)
+            )
         # Install bl_notebook for blender's python.
 
         # The original blender_notebook added sys.path for loading ipykernel.
         # This would cause blender python to import an incompatible version.
         # To avoid this, do not add sys.path and always install ipykernel into
         # site-packages in blender's python.
+        packages = ["ipykernel"] + list(packages)
 
-        env = os.environ.copy()
-
-        os.environ["PATH"] = env["PATH"]
-
-        # Test if bl_notebook is installed.
-        code = run_command(
-            [str(blender.python_executable), "-c", "import ipykernel"],
-            verbose=self.verbose,
-            dry_run=self.dry_run,
-            show_nonzero=False,
-            fail_on_exit=False,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            env=env,
-        )
-        if code is None or code != 0:
-            print_error("Installing ipykernel...")
-            run_command(
-                [
-                    str(blender.python_executable),
-                    "-m",
-                    "ensurepip",
-                ],
-                verbose=self.verbose,
-                dry_run=self.dry_run,
-                fail_on_exit=True,
+        def fingerprint():
+            return get_fingerprint(
+                blender.executable,
+                blender.python_executable,
+                packages,
+                options,
             )
-            run_command(
-                [
-                    str(blender.python_executable),
-                    "-m",
-                    "pip",
-                    "install",
-                    "--no-warn-script-location",
-                    "ipykernel",
-                ],
+
+        current = fingerprint()
+        if read_fingerprint(kernel_path) == current:
+            if self.verbose:
+                print_error(f"Kernel is up to date: {kernel_path}")
+            return False
+
+        if self.verbose or self.dry_run:
+            print_error(f"Write kernel: {kernel_path}", dry_run=self.dry_run)
+        if self.dry_run:
+            return True
+        write_kernel(kernel_path, blender.executable, **options)
+
+        # pip runs only when a package is missing or outside its requirement
+        versions = find_package_versions(blender.python_executable, packages)
+        if None in versions.values():
+            self.install_packages(blender, packages)
+            current = fingerprint()
+        write_fingerprint(kernel_path, current)
+        return True
+
+    def install_packages(self, blender, packages):
+        """Install packages into blender's python
+
+        Called when find_package_versions() finds a package missing or with
+        a version outside of its requirement; pip decides what to install.
+        Raises OSError if they can not be installed.
+        """
+        env = os.environ.copy()
+        print_error(f"Installing {' '.join(packages)}...")
+        if self.wheelhouse is not None:
+            try:
+                self.wheelhouse.install(blender.python_executable, packages)
+            except OSError as exc:
+                print_error(f"Can not install from the wheelhouse: {exc}")
+            else:
+                return
+        for cmd in [
+            [
+                str(blender.python_executable),
+                "-m",
+                "ensurepip",
+            ],
+            [
+                str(blender.python_executable),
+                "-m",
+                "pip",
+                "install",
+                "--no-warn-script-location",
+            ]
+            + packages,
+        ]:
+            # Raise instead of exiting, this may run in a thread
+            code = run_command(
+                cmd,
                 verbose=self.verbose,
                 dry_run=self.dry_run,
-                fail_on_exit=True,
                 env=env,
             )
+            if code:
+                raise OSError(
+                    f"Can not install {' '.join(packages)}"
+                    f" (exited by {code})"
+                )
+
+    def sync_kernels(self, blenders, get_kernel_options, profiles=(None,)):
+        """Update the kernels of blenders in parallel, remove the others
+
+        get_kernel_options(profile) returns the options of install_kernel().
+        The kernels of one blender are updated in turn, since they share the
+        site-packages. Returns the names of the updated kernels. Kernels of
+        a blender which fail to install are reported and skipped.
+        """
+
+        def sync(blender):
+            return [
+                self.get_kernel_name(blender, profile)
+                for profile in profiles
+                if self.install_kernel(
+                    blender, profile=profile, **get_kernel_options(profile)
+                )
+            ]
+
+        updated = []
+        workers = max(1, min(len(blenders), os.cpu_count() or 1))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for blender, future in [
+                (x, executor.submit(sync, x)) for x in blenders
+            ]:
+                try:
+                    updated += future.result()
+                except OSError as exc:
+                    print_error(f"{blender.name}: {exc}")
+
+        expected = {
+            self.get_kernel_name(blender, profile)
+            for blender in blenders
+            for profile in profiles
+        }
+        for entry in self.blender_kernel_directories():
+            if entry.name not in expected:
+                self.remove_kernel(entry.name)
+        return updated
 
     def execute_notebook(
         self,
@@ -206,7 +340,20 @@ class NotebookManager:
         if no_browser:
             options += ["--no-browser"]
 
+        if use_lab:
+            # Idle culling by kernelspec, see culling.py. The classic
+            # notebook does not run on jupyter_server.
+            options += [
+                "--ServerApp.kernel_manager_class",
+                "bl_notebook.culling.BlenderKernelManager",
+                "--MappingKernelManager.cull_interval",
+                str(CULL_INTERVAL),
+            ]
+
         os.environ["JUPYTER_DATA_DIR"] = str(self.data_dir)
+        if self.verbose:
+            # Blender kernels show their startup time, see kernel.py
+            os.environ["BL_KERNEL_VERBOSE"] = "1"
 
         if not use_lab:
             try:
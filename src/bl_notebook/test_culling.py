@@ -0,0 +1,105 @@
+import asyncio
+import json
+import types
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("jupyter_server")
+
+from jupyter_client.kernelspec import (  # noqa: E402
+    KernelSpec,
+    KernelSpecManager,
+)
+
+from .culling import BlenderKernelManager, get_cull_request_path  # noqa: E402
+
+
+class SpecManager(KernelSpecManager):
+    def get_kernel_spec(self, kernel_name):
+        if kernel_name == "python3":
+            return KernelSpec(name=kernel_name, metadata={})
+        return KernelSpec(
+            name=kernel_name,
+            metadata={"bl_notebook": {"cull_idle_timeout": 3600}},
+        )
+
+
+def make_kernel(name, idle, state="idle", connection_file=None):
+    return types.SimpleNamespace(
+        kernel_name=name,
+        execution_state=state,
+        last_activity=datetime.now(timezone.utc) - timedelta(seconds=idle),
+        connection_file=connection_file,
+        provisioner=types.SimpleNamespace(pid=1234),
+    )
+
+
+@pytest.fixture
+def manager():
+    manager = BlenderKernelManager(kernel_spec_manager=SpecManager())
+    manager.cull_idle_timeout = 600
+    manager.culled = []
+
+    async def shutdown_kernel(kernel_id):
+        manager.culled.append(kernel_id)
+        manager._kernels.pop(kernel_id, None)
+
+    manager.shutdown_kernel = shutdown_kernel
+    return manager
+
+
+def cull(manager, *kernel_ids):
+    async def run():
+        for kernel_id in kernel_ids:
+            await manager.cull_kernel_if_idle(kernel_id)
+
+    asyncio.run(run())
+    return manager.culled
+
+
+def test_cull_options(manager):
+    # The manager's thresholds, except for kernelspecs which set their own
+    manager.cull_connected = False
+    assert manager.get_cull_options(make_kernel("python3", 0)) == (
+        600,
+        False,
+    )
+    assert manager.get_cull_options(make_kernel("blender", 0)) == (
+        3600,
+        True,
+    )
+
+
+def test_cull_by_kernelspec(manager):
+    manager._kernels.update(
+        python=make_kernel("python3", 1000),
+        blender=make_kernel("blender", 1000),
+        forgotten=make_kernel("blender", 4000),
+        busy=make_kernel("blender", 4000, state="busy"),
+        dead=make_kernel("blender", 0, state="dead"),
+    )
+    # Forgotten tabs keep blender kernels connected
+    manager._kernel_connections["forgotten"] = 1
+    culled = cull(manager, "python", "blender", "forgotten", "busy", "dead")
+    assert culled == ["python", "forgotten", "dead"]
+
+
+def test_cull_request(manager, tmp_path):
+    connection_file = tmp_path / "kernel-1.json"
+    path = get_cull_request_path(connection_file, 1234)
+    assert path == tmp_path / "bl-cull-1234.json"
+    manager._kernels.update(
+        busy=make_kernel("blender", 0, "busy", connection_file),
+        idle=make_kernel("blender", 0, "idle", connection_file),
+    )
+
+    # Not before the kernel has asked to be culled
+    assert cull(manager, "idle") == []
+
+    path.write_text(json.dumps({"reason": "RSS 9000 MB > 8000 MB"}))
+    # Not while busy
+    assert cull(manager, "busy") == []
+    assert path.exists()
+    assert cull(manager, "idle") == ["idle"]
+    assert not path.exists()
@@ -0,0 +1,41 @@
+from .wheelhouse import Wheelhouse
+
+
+def make_distribution(site_packages, name, files):
+    dist_info = site_packages / f"{name}-1.0.dist-info"
+    dist_info.mkdir(parents=True)
+    for path in files:
+        path = site_packages / path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(path.name)
+    records = files + [f"{dist_info.name}/RECORD", "../../bin/script,,"]
+    (dist_info / "RECORD").write_text("\n".join(records) + "\n")
+
+
+def test_link(tmp_path):
+    source_dir = tmp_path / "source"
+    make_distribution(source_dir, "numpy", ["numpy/__init__.py"])
+    make_distribution(source_dir, "ipykernel", ["ipykernel/__init__.py"])
+    make_distribution(source_dir, "comm", ["comm/__init__.py"])
+    source = {
+        "site_packages": str(source_dir),
+        "packages": ["ipykernel"],
+        "distributions": ["comm", "ipykernel"],
+        "base": ["numpy"],
+    }
+    wheelhouse = Wheelhouse(tmp_path / "wheelhouse")
+
+    # Without numpy pip may have to install more than the source has
+    target = tmp_path / "target"
+    target.mkdir()
+    assert not wheelhouse.link(source, target)
+
+    make_distribution(target, "numpy", ["numpy/__init__.py"])
+    assert wheelhouse.link(source, target)
+    linked = target / "ipykernel/__init__.py"
+    assert linked.samefile(source_dir / "ipykernel/__init__.py")
+    assert (target / "comm-1.0.dist-info/RECORD").exists()
+    assert not (target / "numpy/__init__.py").samefile(
+        source_dir / "numpy/__init__.py"
+    )
+    assert not (tmp_path / "bin").exists()
@@ -1,9 +1,10 @@
 import hashlib
+import os
 import platform
 import random
-import os
 import re
 import shlex
+import shutil
 import subprocess
 import sys
 from contextlib import suppress
@@ -13,7 +14,13 @@ from typing import Optional, Union
 
 from bl_notebook.blender.ostype import OSType
 
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
 NOTEBOOK_AUTH_SALT_LEN = 12  # notebook.auth.salt_len
+FICLONE = 0x40049409  # linux/fs.h
 
 
 def is_win32():
@@ -50,13 +57,25 @@ def run_command(
     dry_run=False,
     fail_on_exit=False,
     yes: Optional[Union[str, bytes, bool]] = None,
+    budget=None,
     **kwargs,
 ) -> Optional[int]:
+    """Run a command
+
+    budget limits the threads and CPUs of the command. Its env() returns
+    environment variables of the command and its preexec() runs in the
+    child before exec (see bl_threads.Budget).
+    """
     if verbose or dry_run:
         print_command(cmd, dry_run=dry_run)
         if dry_run:
             return None
 
+    if budget is not None:
+        kwargs["env"] = dict(kwargs.get("env") or os.environ, **budget.env())
+        if os.name == "posix":
+            kwargs["preexec_fn"] = budget.preexec
+
     def print_command_and_error(message):
         if not verbose:
             print_command(cmd)
@@ -92,6 +111,48 @@ def run_command(
     return code
 
 
+def _copy_file_fast(fsrc, fdst):
+    """Copy with reflink or copy_file_range, return False if unsupported"""
+    if fcntl is not None:
+        with suppress(OSError):
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return True
+
+    if hasattr(os, "copy_file_range"):
+        size = os.fstat(fsrc.fileno()).st_size
+        offset = 0
+        with suppress(OSError):
+            while offset < size:
+                n = os.copy_file_range(
+                    fsrc.fileno(), fdst.fileno(), size - offset
+                )
+                if n == 0:
+                    break
+                offset += n
+        return offset == size
+
+    return False
+
+
+def copy_file(src, dst):
+    """Copy a file without passing the data through user space if possible
+
+    Tries reflink, then copy_file_range and falls back to shutil.copyfile
+    (which uses sendfile where available).
+    """
+    delete = True
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            done = _copy_file_fast(fsrc, fdst)
+        if not done:
+            shutil.copyfile(src, dst)
+        delete = False
+    finally:
+        if delete:
+            with suppress(FileNotFoundError):
+                os.unlink(dst)
+
+
 def make_password(plain_password):
     salt_len = NOTEBOOK_AUTH_SALT_LEN
     h = hashlib.new("sha1")
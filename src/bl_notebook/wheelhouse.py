@@ -0,0 +1,211 @@
+"""
+Shared offline wheelhouse for blender's python.
+
+Every blender has its own python, and the kernel needs ipykernel and the
+packages of the kernel options in its site-packages. Instead of running pip
+online for each blender, the wheels are built once for each python ABI
+into the cache directory:
+
+    <cache_dir>/wheelhouse/cpython-311-linux-x86_64/*.whl
+
+and installed from there with pip --no-index. Once a blender of an ABI has
+the packages, the other blenders of the ABI get hardlinks to its files
+(see the RECORD of the *.dist-info directories) instead of running pip.
+"""
+
+import csv
+import json
+import os
+import shutil
+import subprocess
+import threading
+from pathlib import Path
+
+from .blender_notebook.installer import (
+    get_distributions,
+    get_site_packages,
+    normalize_package_name,
+)
+from .util import print_error, run_command
+
+WHEELHOUSE_DIR_NAME = "wheelhouse"
+
+# Packages of the wheelhouse and the site-packages installed from it
+REQUIREMENTS_NAME = "requirements.txt"
+SOURCE_NAME = "source.json"
+
+
+def get_abi(python_executable):
+    """ABI of a python, e.g. "cpython-311-linux-x86_64" """
+    code = (
+        "import sys, sysconfig;"
+        " print(sys.implementation.cache_tag + '-' + sysconfig.get_platform())"
+    )
+    try:
+        output = subprocess.check_output([str(python_executable), "-c", code])
+    except (OSError, subprocess.CalledProcessError) as exc:
+        raise OSError(f"{python_executable}: {exc}")
+    return output.decode("utf-8").strip().replace(".", "_").replace(" ", "_")
+
+
+def read_records(dist_info):
+    """Files of a distribution relative to its site-packages"""
+    with open(Path(dist_info) / "RECORD", newline="") as fh:
+        for row in csv.reader(fh):
+            # Scripts are installed outside site-packages
+            if row and not row[0].startswith(".."):
+                yield row[0]
+
+
+def link_file(src, dst):
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Another file system
+        shutil.copy2(src, dst)
+
+
+class Wheelhouse:
+    def __init__(self, root, verbose=False, dry_run=False):
+        self.root = Path(root)
+        self.verbose = verbose
+        self.dry_run = dry_run
+        self._abis = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get_lock(self, abi):
+        """Lock of the wheelhouse of an ABI between threads"""
+        with self._lock:
+            return self._locks.setdefault(abi, threading.Lock())
+
+    def get_directory(self, python_executable):
+        key = str(python_executable)
+        if key not in self._abis:
+            self._abis[key] = get_abi(python_executable)
+        return self.root / self._abis[key]
+
+    def run_pip(self, python_executable, args):
+        cmd = [str(python_executable), "-m", "pip"] + args
+        code = run_command(cmd, verbose=self.verbose, dry_run=self.dry_run)
+        if code:
+            raise OSError(f"pip {args[0]} exited by {code}")
+
+    def ensure_pip(self, python_executable):
+        # ensurepip installs the bundled pip without network access
+        code = run_command(
+            [str(python_executable), "-m", "ensurepip"],
+            verbose=self.verbose,
+            dry_run=self.dry_run,
+        )
+        if code:
+            raise OSError(f"ensurepip exited by {code}")
+
+    def fill(self, python_executable, packages):
+        """Build the wheels of packages unless the wheelhouse has them"""
+        directory = self.get_directory(python_executable)
+        path = directory / REQUIREMENTS_NAME
+        with self.get_lock(directory.name):
+            filled = set()
+            if path.exists():
+                filled = set(path.read_text().split())
+            if set(packages) <= filled:
+                return directory
+            requirements = sorted(filled | set(packages))
+            print_error(f"Filling wheelhouse {directory}...")
+            directory.mkdir(parents=True, exist_ok=True)
+            self.ensure_pip(python_executable)
+            self.run_pip(
+                python_executable,
+                ["wheel", "--wheel-dir", str(directory)] + requirements,
+            )
+            if not self.dry_run:
+                path.write_text("\n".join(requirements) + "\n")
+                # The source site-packages lack the new packages
+                (directory / SOURCE_NAME).unlink(missing_ok=True)
+        return directory
+
+    def get_source(self, directory, packages):
+        """site-packages installed from the wheelhouse with packages"""
+        try:
+            source = json.loads((directory / SOURCE_NAME).read_text())
+        except (OSError, ValueError):
+            return None
+        if not set(packages) <= set(source["packages"]):
+            return None
+        if not Path(source["site_packages"]).exists():
+            return None
+        return source
+
+    def link(self, source, site_packages):
+        """Hardlink the distributions of source into site-packages
+
+        Distributions already in site-packages are kept. Returns False if
+        site-packages lacks some of the distributions pip found in the
+        source (they were not installed from the wheelhouse).
+        """
+        source_dir = Path(source["site_packages"])
+        available = get_distributions(source_dir)
+        installed = get_distributions(site_packages)
+        if not set(source["base"]) <= set(installed):
+            return False
+        names = [x for x in source["distributions"] if x not in installed]
+        for name in names:
+            if name not in available:
+                return False
+        if self.verbose or self.dry_run:
+            print_error(
+                f"Link {len(names)} packages: {source_dir} -> {site_packages}",
+                dry_run=self.dry_run,
+            )
+        if self.dry_run:
+            return True
+        for name in names:
+            for relpath in read_records(available[name]):
+                dst = site_packages / relpath
+                if not dst.exists():
+                    link_file(source_dir / relpath, dst)
+        return True
+
+    def install(self, python_executable, packages):
+        """Install packages into blender's python from the wheelhouse"""
+        directory = self.fill(python_executable, packages)
+        site_packages = get_site_packages(python_executable)
+        if not site_packages:
+            raise OSError(f"No site-packages for {python_executable}")
+        site_packages = site_packages[-1]
+
+        source = self.get_source(directory, packages)
+        if source is not None and self.link(source, site_packages):
+            return
+
+        before = set(get_distributions(site_packages))
+        self.ensure_pip(python_executable)
+        self.run_pip(
+            python_executable,
+            [
+                "install",
+                "--no-index",
+                "--find-links",
+                str(directory),
+                "--no-warn-script-location",
+            ]
+            + list(packages),
+        )
+        if self.dry_run:
+            return
+        with self.get_lock(directory.name):
+            if self.get_source(directory, packages) is None:
+                # pip is part of every blender's python
+                added = set(get_distributions(site_packages)) - before
+                added.discard(normalize_package_name("pip"))
+                source = {
+                    "site_packages": str(site_packages),
+                    "packages": sorted(packages),
+                    "distributions": sorted(added),
+                    "base": sorted(before),
+                }
+                (directory / SOURCE_NAME).write_text(
+                    json.dumps(source, indent=2)
+                )